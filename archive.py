@@ -0,0 +1,225 @@
+"""
+Shownotes 归档
+
+每次运行的段落（起止时间、标题、原文、校对结果、使用的模型）连同源文件路径和内容摘要写入本地 SQLite 文件，
+每段完成后立即写入，输出文件与生成它的 SRT 文件可以对应起来。
+- 检索：FTS5 索引标题、原文和校对结果。中文没有空格分词，使用 trigram 分词器按子串匹配，
+  关键词不少于 3 个字时走索引；更短的关键词（或 SQLite 未编译 FTS5 时）退回 LIKE 扫描
+- 复用：按原文的摘要查找此前的结果，原文相同、模型和提示词版本也相同的段落（同一文件重新处理，
+  或换了分段长度后恰好相同的段落）直接沿用标题和校对结果，不再请求 API
+多个进程（GUI 中并行的任务、命令行）可同时写入同一个归档文件。
+"""
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+DEFAULT_ARCHIVE_PATH = "kimi_archive.db"
+DEFAULT_SEARCH_LIMIT = 20
+DB_TIMEOUT_SECONDS = 30.0
+TRIGRAM_MIN_CHARS = 3     # trigram 索引只能匹配不少于 3 个字的关键词
+SNIPPET_CHARS = 24        # 检索结果中关键词前后保留的字数
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, source TEXT NOT NULL, source_hash TEXT NOT NULL, target_length INTEGER NOT NULL,
+    title_model TEXT, proofread_model TEXT, outputs TEXT, started_at REAL NOT NULL, prompt_version TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_source_hash ON runs (source_hash);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY, run_id INTEGER NOT NULL REFERENCES runs (id), idx INTEGER NOT NULL,
+    time TEXT NOT NULL, start_ms INTEGER NOT NULL, end_ms INTEGER NOT NULL,
+    title TEXT, original TEXT NOT NULL, proofread TEXT, original_hash TEXT NOT NULL, completed_at REAL NOT NULL,
+    UNIQUE (run_id, idx)
+);
+CREATE INDEX IF NOT EXISTS segments_original_hash ON segments (original_hash, completed_at);
+"""
+
+# 外部内容表：索引只保存词条，正文仍在 segments 中，触发器保持两者一致
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+    title, original, proofread, content='segments', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+    INSERT INTO segments_fts (rowid, title, original, proofread) VALUES (new.id, new.title, new.original, new.proofread);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, title, original, proofread)
+    VALUES ('delete', old.id, old.title, old.original, old.proofread);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_au AFTER UPDATE ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, title, original, proofread)
+    VALUES ('delete', old.id, old.title, old.original, old.proofread);
+    INSERT INTO segments_fts (rowid, title, original, proofread) VALUES (new.id, new.title, new.original, new.proofread);
+END;
+"""
+
+
+def file_digest(path: str) -> str:
+    """源文件内容的 SHA-256，文件被移动或改名后仍能找到此前的结果"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _snippet(text: str, terms: List[str]) -> str:
+    """第一处关键词前后各 SNIPPET_CHARS 个字，其中的关键词用【】标出"""
+    text = text or ""
+    lowered = text.lower()
+    found = [(lowered.find(term.lower()), term) for term in terms]
+    found = sorted((position, term) for position, term in found if position >= 0)
+    if not found:
+        return text[:2 * SNIPPET_CHARS] + ("…" if len(text) > 2 * SNIPPET_CHARS else "")
+    first, term = found[0]
+    start = max(0, first - SNIPPET_CHARS)
+    end = min(len(text), first + len(term) + SNIPPET_CHARS)
+    parts, cursor = [], start
+    for position, term in found:
+        if position < cursor or position + len(term) > end:
+            continue
+        parts.append(text[cursor:position] + "【" + text[position:position + len(term)] + "】")
+        cursor = position + len(term)
+    parts.append(text[cursor:end])
+    return ("…" if start > 0 else "") + "".join(parts) + ("…" if end < len(text) else "")
+
+
+class ShownotesArchive:
+    """归档文件的读写，线程安全"""
+    def __init__(self, path: str = DEFAULT_ARCHIVE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=DB_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(runs)")}
+        if "prompt_version" not in columns:
+            # 早期的归档没有提示词版本，其中的结果不再沿用
+            self._db.execute("ALTER TABLE runs ADD COLUMN prompt_version TEXT")
+        try:
+            self._db.executescript(_FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError:
+            # SQLite 未编译 FTS5 或版本低于 3.34（没有 trigram 分词器）：检索退回 LIKE 扫描
+            self.full_text = False
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def start_run(self, source: str, source_hash: str, target_length: int, title_model: str = None,
+                  proofread_model: str = None, outputs: List[str] = (), prompt_version: str = None) -> int:
+        """登记一次运行，返回运行编号；outputs 为本次写出的输出文件，prompt_version 为提示词的版本"""
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT INTO runs (source, source_hash, target_length, title_model, proofread_model, outputs, "
+                "started_at, prompt_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(source) if source else "", source_hash, target_length, title_model,
+                 proofread_model, ", ".join(outputs), time.time(), prompt_version))
+            return cursor.lastrowid
+
+    def add_segment(self, run_id: int, index: int, segment, title: Optional[str], original: str,
+                    proofread: Optional[str]):
+        """写入（或更新）一段的结果，segment 提供 time/start_ms/end_ms；未生成的标题或正文为 None"""
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO segments (run_id, idx, time, start_ms, end_ms, title, original, proofread, "
+                "original_hash, completed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (run_id, idx) DO UPDATE SET title = excluded.title, proofread = excluded.proofread, "
+                "completed_at = excluded.completed_at",
+                (run_id, index, segment.time, segment.start_ms, segment.end_ms, title, original, proofread,
+                 text_digest(original), time.time()))
+
+    def prior_results(self, texts: List[str], title_model: str, proofread_model: str, prompt_version: str):
+        """
+        按原文查找此前的结果，返回 (标题列表, 校对结果列表)，没有记录的为 None；
+        标题只沿用同一标题模型、校对结果只沿用同一校对模型生成的，且提示词版本相同；
+        同一原文有多条记录时各取最近一次非空的标题和校对结果
+        """
+        titles, proofread = [None] * len(texts), [None] * len(texts)
+        with self._lock:
+            for i, text in enumerate(texts):
+                digest = text_digest(text)
+                for column, model, results in (("title", title_model, titles),
+                                               ("proofread", proofread_model, proofread)):
+                    row = self._db.execute(
+                        f"SELECT segments.{column} FROM segments JOIN runs ON runs.id = segments.run_id "
+                        f"WHERE segments.original_hash = ? AND segments.original = ? "
+                        f"AND segments.{column} IS NOT NULL AND runs.{column}_model = ? AND runs.prompt_version = ? "
+                        f"ORDER BY segments.completed_at DESC LIMIT 1",
+                        (digest, text, model, prompt_version)).fetchone()
+                    if row:
+                        results[i] = row[0]
+        return titles, proofread
+
+    def runs_for(self, source_hash: str) -> List[dict]:
+        """同一源文件（按内容摘要）此前的运行，最近的在前"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT runs.*, COUNT(segments.id) AS segment_count, "
+                "SUM(segments.title IS NOT NULL) AS title_count, SUM(segments.proofread IS NOT NULL) AS proofread_count "
+                "FROM runs LEFT JOIN segments ON segments.run_id = runs.id WHERE runs.source_hash = ? "
+                "GROUP BY runs.id ORDER BY runs.started_at DESC", (source_hash,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[dict]:
+        """
+        按标题、原文或校对结果检索段落，空格分隔的多个关键词需全部出现；
+        返回 source/time/title/snippet 等字段，索引检索时按相关度排序，否则按时间倒序
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        columns = ("SELECT segments.id, runs.source, runs.started_at, segments.idx, segments.time, segments.title, "
+                   "segments.original, segments.proofread FROM segments JOIN runs ON runs.id = segments.run_id ")
+        if self.full_text and all(len(term) >= TRIGRAM_MIN_CHARS for term in terms):
+            match = " AND ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+            sql = (columns + "JOIN segments_fts ON segments_fts.rowid = segments.id "
+                   "WHERE segments_fts MATCH ? ORDER BY segments_fts.rank LIMIT ?")
+            params = (match, limit)
+        else:
+            conditions = " AND ".join("(segments.title LIKE ? ESCAPE '\\' OR segments.original LIKE ? ESCAPE '\\' "
+                                      "OR segments.proofread LIKE ? ESCAPE '\\')" for _ in terms)
+            params = []
+            for term in terms:
+                pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                params.extend([pattern] * 3)
+            sql = columns + f"WHERE {conditions} ORDER BY segments.completed_at DESC LIMIT ?"
+            params = (*params, limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result["snippet"] = _snippet(row["proofread"] or row["original"], terms)
+            results.append(result)
+        return results
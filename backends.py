@@ -0,0 +1,151 @@
+"""
+对话补全后端
+
+所有标题生成和校对请求都经过 CompletionBackend.complete()，接入新的服务只需要一个适配器：
+- OpenAICompatibleBackend: Moonshot 等 OpenAI 兼容接口，有按账号的速率限制，默认逐条请求，支持 /v1/batches
+- LlamaCppBackend: llama.cpp server，并发数等于服务端的槽位数（--parallel），启动时从 /props 读取
+- VLLMBackend: vLLM 的 OpenAI 兼容服务，连续批处理把同时到达的请求合批执行，可承受很高的并发
+每个适配器声明自己的并发数 max_concurrency 和批量接口单次请求数上限 max_batch（0 为不支持批量接口），
+处理流程据此决定同时发出的请求数。本地推理服务没有按请求计费的配额，rpm/tpm 保持 0 即可。
+"""
+import json
+import threading
+import urllib.request
+from typing import List, Optional
+
+DEFAULT_BASE_URL = "https://api.moonshot.cn/v1"
+OPENAI_MAX_BATCH = 50000       # /v1/batches 单个请求文件的请求数上限
+LLAMACPP_DEFAULT_SLOTS = 4     # 读取不到 /props 时使用的槽位数
+VLLM_DEFAULT_CONCURRENCY = 64  # vLLM 默认 max_num_seqs 为 256，留出余量给其他客户端
+PROBE_TIMEOUT_SECONDS = 5.0
+
+BACKEND_NAMES = ("openai", "llamacpp", "vllm")
+
+
+class BackendUnsupported(Exception):
+    """后端不支持所需的功能（如批量接口）"""
+
+
+def _server_root(base_url: str) -> str:
+    """去掉结尾的 /v1，得到服务根地址"""
+    url = base_url.rstrip("/")
+    return url[:-3] if url.endswith("/v1") else url
+
+
+def _get_json(url: str, api_key: str = None) -> Optional[dict]:
+    """GET 一个 JSON 接口，失败时返回 None"""
+    request = urllib.request.Request(url)
+    if api_key:
+        request.add_header("Authorization", f"Bearer {api_key}")
+    try:
+        with urllib.request.urlopen(request, timeout=PROBE_TIMEOUT_SECONDS) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+class CompletionBackend:
+    """
+    补全后端接口
+    complete() 返回与 openai 客户端相同结构的响应（choices[0].message.content、usage）
+    """
+    name = "base"
+    max_concurrency = 1  # 同时进行的请求数上限
+    max_batch = 0        # 批量接口单个任务的请求数上限，0 为不支持
+
+    def complete(self, model: str, messages: List[dict], temperature: float = 0.6):
+        raise NotImplementedError
+
+    def batch_client(self):
+        """返回支持 files/batches 接口的客户端，供批量模式使用"""
+        raise BackendUnsupported(f"{self.name} 后端不支持批量接口，请直接逐段处理")
+
+    def describe(self) -> str:
+        batch = f"，批量上限 {self.max_batch}" if self.max_batch else ""
+        return f"{self.name}（并发 {self.max_concurrency}{batch}）"
+
+
+class OpenAICompatibleBackend(CompletionBackend):
+    """Moonshot 及其他 OpenAI 兼容接口；按账号限流，默认逐条请求，可在配置中提高并发"""
+    name = "openai"
+    max_batch = OPENAI_MAX_BATCH
+
+    def __init__(self, api_key: str, base_url: str = DEFAULT_BASE_URL, max_concurrency: int = 0):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.max_concurrency = max_concurrency or 1
+
+    def _extra_body(self) -> Optional[dict]:
+        return None
+
+    def complete(self, model, messages, temperature=0.6):
+        extra_body = self._extra_body()
+        if extra_body:
+            return self.client.chat.completions.create(model=model, messages=messages, temperature=temperature,
+                                                       extra_body=extra_body)
+        return self.client.chat.completions.create(model=model, messages=messages, temperature=temperature)
+
+    def batch_client(self):
+        if not self.max_batch:
+            return super().batch_client()
+        return self.client
+
+
+class LlamaCppBackend(OpenAICompatibleBackend):
+    """
+    llama.cpp server（/v1/chat/completions）
+    服务端只加载一个模型，请求中的模型名不起作用；每个槽位同时处理一个请求，
+    未指定并发数时从 /props 的 total_slots 读取。请求带上 cache_prompt，复用相同的提示词前缀。
+    """
+    name = "llamacpp"
+    max_batch = 0
+
+    def __init__(self, api_key: str = "", base_url: str = "http://127.0.0.1:8080/v1", max_concurrency: int = 0):
+        super().__init__(api_key or "no-key", base_url, max_concurrency)
+        if not max_concurrency:
+            props = _get_json(_server_root(base_url) + "/props", api_key) or {}
+            self.max_concurrency = int(props.get("total_slots") or LLAMACPP_DEFAULT_SLOTS)
+
+    def _extra_body(self):
+        return {"cache_prompt": True}
+
+
+class VLLMBackend(OpenAICompatibleBackend):
+    """
+    vLLM OpenAI 兼容服务
+    连续批处理由服务端完成，客户端只需保持足够多的并发请求；
+    配置的模型名不在 /v1/models 中时改用服务端加载的第一个模型。
+    """
+    name = "vllm"
+    max_batch = 0
+
+    def __init__(self, api_key: str = "", base_url: str = "http://127.0.0.1:8000/v1", max_concurrency: int = 0):
+        super().__init__(api_key or "no-key", base_url, max_concurrency or VLLM_DEFAULT_CONCURRENCY)
+        self._api_key = api_key
+        self._base_url = base_url
+        self._served = None
+        self._lock = threading.Lock()
+
+    def served_model(self, model: str) -> str:
+        with self._lock:
+            if self._served is None:
+                listing = _get_json(self._base_url.rstrip("/") + "/models", self._api_key) or {}
+                self._served = [item.get("id") for item in listing.get("data", []) if item.get("id")]
+        if not self._served or model in self._served:
+            return model
+        return self._served[0]
+
+    def complete(self, model, messages, temperature=0.6):
+        return super().complete(self.served_model(model), messages, temperature)
+
+
+def create_backend(name: str, api_key: str, base_url: str, max_concurrency: int = 0) -> CompletionBackend:
+    """按名称创建后端；max_concurrency 为 0 时使用适配器的默认值"""
+    name = (name or "openai").strip().lower()
+    if name == "openai":
+        return OpenAICompatibleBackend(api_key, base_url, max_concurrency)
+    if name == "llamacpp":
+        return LlamaCppBackend(api_key, base_url, max_concurrency)
+    if name == "vllm":
+        return VLLMBackend(api_key, base_url, max_concurrency)
+    raise ValueError(f"未知的后端: {name}，可选: {', '.join(BACKEND_NAMES)}")
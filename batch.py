@@ -0,0 +1,237 @@
+"""
+批量接口（OpenAI 兼容的 /v1/batches）
+
+夜间重新处理历史节目时不需要交互延迟，把所有请求写成一个 JSONL 文件一次提交，
+由服务端异步执行，不占用逐条调用的速率限制：
+- write_batch_file: 生成批量请求文件，每行一个 custom_id 和对应的 chat/completions 请求体
+- run_batch: 上传、提交、轮询直到结束，下载结果并按 custom_id 返回
+- LocalBatchClient: 本地替身，接口与 openai 客户端的 files/batches 相同，离线测试用
+"""
+import itertools
+import json
+import os
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Tuple
+
+from budget import count_tokens, count_message_tokens
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_SECONDS = 30.0
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchFailed(Exception):
+    """批量任务整体失败（过期、被取消或服务端拒绝）"""
+
+
+def write_batch_file(path: str, requests: Dict[str, list], model: str, temperature: float = 0.6):
+    """requests 为 custom_id -> messages，写出批量请求 JSONL 文件"""
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, messages in requests.items():
+            line = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {"model": model, "messages": messages, "temperature": temperature},
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def parse_batch_output(text: str) -> Tuple[Dict[str, dict], Dict[str, str]]:
+    """
+    解析结果文件（输出文件和错误文件格式相同）
+    返回 (custom_id -> 响应体, custom_id -> 失败原因)
+    """
+    results, errors = {}, {}
+    for line in (text or "").splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        custom_id = item.get("custom_id")
+        response = item.get("response") or {}
+        if item.get("error"):
+            error = item["error"]
+            errors[custom_id] = error.get("message", str(error)) if isinstance(error, dict) else str(error)
+        elif response.get("status_code", 200) != 200:
+            body = response.get("body") or {}
+            message = (body.get("error") or {}).get("message", "") if isinstance(body, dict) else ""
+            errors[custom_id] = f"HTTP {response.get('status_code')} {message}".strip()
+        else:
+            results[custom_id] = response.get("body") or {}
+    return results, errors
+
+
+def completion_content(body: dict) -> str:
+    """从 chat/completions 响应体中取出回复内容"""
+    choices = body.get("choices") or []
+    if not choices:
+        return ""
+    return (choices[0].get("message") or {}).get("content") or ""
+
+
+def completion_tokens_used(body: dict) -> int:
+    """响应体中的 total_tokens，没有 usage 时返回 0"""
+    return int((body.get("usage") or {}).get("total_tokens") or 0)
+
+
+def _file_text(client, file_id: str) -> str:
+    content = client.files.content(file_id)
+    return content.text if hasattr(content, "text") else content.read().decode("utf-8")
+
+
+def run_batch(client, requests: Dict[str, list], model: str, input_path: str,
+              poll_seconds: float = BATCH_POLL_SECONDS, log=print) -> Tuple[Dict[str, dict], Dict[str, str]]:
+    """
+    提交一批请求并等待结束，返回 (custom_id -> 响应体, custom_id -> 失败原因)
+    没有出现在结果中的请求记为失败，由调用方决定是否重新提交
+    """
+    write_batch_file(input_path, requests, model)
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                  completion_window=BATCH_COMPLETION_WINDOW)
+    log(f"[批量] 已提交 {len(requests)} 个请求，任务 {batch.id}，请求文件 {input_path}")
+    last_status = None
+    while batch.status not in BATCH_FINAL_STATUSES:
+        if batch.status != last_status:
+            log(f"[批量] 任务 {batch.id} 状态: {batch.status}")
+            last_status = batch.status
+        time.sleep(poll_seconds)
+        batch = client.batches.retrieve(batch.id)
+    counts = getattr(batch, "request_counts", None)
+    if counts is not None:
+        log(f"[批量] 任务 {batch.id} {batch.status}：完成 {counts.completed}，失败 {counts.failed}，共 {counts.total}")
+    if batch.status != "completed" and not getattr(batch, "output_file_id", None):
+        raise BatchFailed(f"批量任务 {batch.id} 状态为 {batch.status}")
+
+    results, errors = {}, {}
+    for file_id in (getattr(batch, "output_file_id", None), getattr(batch, "error_file_id", None)):
+        if file_id:
+            file_results, file_errors = parse_batch_output(_file_text(client, file_id))
+            results.update(file_results)
+            errors.update(file_errors)
+    for custom_id in requests:
+        if custom_id not in results and custom_id not in errors:
+            errors[custom_id] = f"没有返回结果（任务状态 {batch.status}）"
+    return results, errors
+
+
+def offline_reply(messages: List[dict]) -> str:
+    """
+    离线替身的默认回复：标题取正文开头，校对原样返回正文
+    正文是提示词的最后一行，与 build_title_prompt/build_proofread_prompt 的格式对应
+    """
+    prompt = messages[-1]["content"] if messages else ""
+    lines = [line for line in prompt.strip().split("\n") if line.strip()]
+    text = lines[-1].strip() if lines else ""
+    if "生成标题" in prompt:
+        return text[:12]
+    return text
+
+
+class _LocalFiles:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, file, purpose="batch"):
+        data = file.read()
+        return self._owner._store(data.decode("utf-8") if isinstance(data, bytes) else data, purpose)
+
+    def content(self, file_id):
+        return SimpleNamespace(text=self._owner._files[file_id])
+
+
+class _LocalBatches:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, input_file_id, endpoint=BATCH_ENDPOINT, completion_window=BATCH_COMPLETION_WINDOW, **kwargs):
+        return self._owner._create_batch(input_file_id, endpoint)
+
+    def retrieve(self, batch_id):
+        return self._owner._advance(batch_id)
+
+
+class LocalBatchClient:
+    """
+    本地批量接口替身，实现 openai 客户端中 files.create/files.content/batches.create/batches.retrieve
+    reply(messages) 生成回复内容，默认为离线回复；也可以传入转发给其他 OpenAI 兼容服务的函数
+    fail_every 大于 0 时每第 N 个请求返回失败，用于测试失败重提
+    任务提交后第一次查询为 in_progress，第二次查询时执行全部请求并完成
+    """
+    def __init__(self, reply: Callable[[List[dict]], str] = offline_reply, fail_every: int = 0):
+        self.reply = reply
+        self.fail_every = fail_every
+        self.files = _LocalFiles(self)
+        self.batches = _LocalBatches(self)
+        self._files: Dict[str, str] = {}
+        self._batches: Dict[str, SimpleNamespace] = {}
+        self._ids = itertools.count(1)
+        self._request_count = 0
+
+    def _store(self, text: str, purpose: str) -> SimpleNamespace:
+        file_id = f"file-local-{next(self._ids)}"
+        self._files[file_id] = text
+        return SimpleNamespace(id=file_id, purpose=purpose, bytes=len(text.encode("utf-8")))
+
+    def _create_batch(self, input_file_id: str, endpoint: str) -> SimpleNamespace:
+        if input_file_id not in self._files:
+            raise ValueError(f"文件不存在: {input_file_id}")
+        batch = SimpleNamespace(id=f"batch-local-{next(self._ids)}", status="validating", endpoint=endpoint,
+                                input_file_id=input_file_id, output_file_id=None, error_file_id=None,
+                                request_counts=SimpleNamespace(total=0, completed=0, failed=0))
+        self._batches[batch.id] = batch
+        return batch
+
+    def _advance(self, batch_id: str) -> SimpleNamespace:
+        batch = self._batches[batch_id]
+        if batch.status == "validating":
+            batch.status = "in_progress"
+        elif batch.status == "in_progress":
+            self._execute(batch)
+        return batch
+
+    def _execute(self, batch: SimpleNamespace):
+        outputs, failures = [], []
+        for line in self._files[batch.input_file_id].splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            self._request_count += 1
+            result = {"id": f"req-local-{self._request_count}", "custom_id": request["custom_id"]}
+            if self.fail_every and self._request_count % self.fail_every == 0:
+                result["response"] = {"status_code": 500, "body": {"error": {"message": "本地替身模拟的失败"}}}
+                result["error"] = None
+                failures.append(result)
+                continue
+            messages = request["body"]["messages"]
+            content = self.reply(messages)
+            prompt_tokens = count_message_tokens(messages)
+            completion_tokens = count_tokens(content)
+            result["response"] = {"status_code": 200, "body": {
+                "object": "chat.completion",
+                "model": request["body"].get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            }}
+            result["error"] = None
+            outputs.append(result)
+        if outputs:
+            batch.output_file_id = self._store("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in outputs),
+                                               "batch_output").id
+        if failures:
+            batch.error_file_id = self._store("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in failures),
+                                              "batch_output").id
+        batch.request_counts = SimpleNamespace(total=len(outputs) + len(failures), completed=len(outputs),
+                                               failed=len(failures))
+        batch.status = "completed"
+
+
+def batch_input_path(output_dir: str, prefix: str, round_number: int, part: int = None) -> str:
+    """part 用于同一轮按模型拆分的多个批量任务"""
+    suffix = f"_part{part}" if part else ""
+    return os.path.join(output_dir, f"{prefix}_round{round_number}{suffix}.jsonl")
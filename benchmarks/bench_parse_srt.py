@@ -0,0 +1,132 @@
+"""
+SRT 解析性能对比：旧版逐行解析 vs 单次正则解析
+
+生成 10 小时以上的合成字幕文件（UTF-8、UTF-8 BOM + CRLF、GBK、UTF-16），
+分别统计读取+解析耗时和解析出的字幕条数。
+
+用法: python benchmarks/bench_parse_srt.py [--hours 12] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+# main.py 导入时读取当前目录下的 kimi_config.ini
+os.chdir(REPO_ROOT)
+
+from main import read_srt_text, parse_srt  # noqa: E402
+
+SAMPLE_LINES = [
+    "今天我们来聊一聊人工智能在内容创作中的应用",
+    "这个问题其实大家讨论了很久",
+    "So the key point is latency, not throughput",
+    "我们先看一下第三季度的数据",
+    "对 就是这样 然后呢",
+]
+
+
+def legacy_parse_srt(file_path):
+    """旧版实现：readlines 后逐行 strip，仅支持 UTF-8"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        srt_lines = f.readlines()
+    items = []
+    idx = 0
+    while idx < len(srt_lines):
+        line = srt_lines[idx].strip()
+        if line.isdigit():
+            index = int(line)
+            idx += 1
+            if idx >= len(srt_lines):
+                break
+            time_line = srt_lines[idx].strip()
+            if '-->' not in time_line:
+                idx += 1
+                continue
+            start_time, end_time = [t.strip() for t in time_line.split('-->')]
+            idx += 1
+            text_lines = []
+            while idx < len(srt_lines) and srt_lines[idx].strip() != '':
+                text_lines.append(srt_lines[idx].strip())
+                idx += 1
+            items.append((index, start_time, end_time, ' '.join(text_lines)))
+        idx += 1
+    return items
+
+
+def new_parse_srt(file_path):
+    text, _ = read_srt_text(file_path)
+    return parse_srt(text)
+
+
+def generate_srt(hours: float, seed: int = 0) -> str:
+    """生成合成字幕，每条 1.5~4 秒，条间停顿 0~1.5 秒"""
+    rng = random.Random(seed)
+    blocks = []
+    t = 0
+    end_of_show = int(hours * 3600 * 1000)
+    index = 1
+    while t < end_of_show:
+        start = t
+        end = start + rng.randint(1500, 4000)
+        lines = [rng.choice(SAMPLE_LINES)]
+        if rng.random() < 0.2:
+            lines.append(rng.choice(SAMPLE_LINES))
+        blocks.append(f"{index}\n{_fmt(start)} --> {_fmt(end)}\n" + "\n".join(lines) + "\n")
+        t = end + rng.randint(0, 1500)
+        index += 1
+    return "\n".join(blocks)
+
+
+def _fmt(ms: int) -> str:
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def bench(func, path, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            result = func(path)
+        except UnicodeDecodeError:
+            return None, None
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SRT 解析性能对比")
+    parser.add_argument("--hours", type=float, default=12, help="合成字幕时长（小时），默认 12")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最快一次，默认 3")
+    args = parser.parse_args()
+
+    text = generate_srt(args.hours)
+    variants = [
+        ("utf-8", text.encode('utf-8')),
+        ("utf-8 BOM+CRLF", b'\xef\xbb\xbf' + text.replace('\n', '\r\n').encode('utf-8')),
+        ("gbk", text.encode('gbk')),
+        ("utf-16", text.encode('utf-16')),
+    ]
+    expected = text.count(' --> ')
+    print(f"合成字幕: {args.hours} 小时，{expected} 条")
+    print(f"{'变体':<16}{'大小(MB)':>10}{'旧版耗时':>12}{'旧版条数':>10}{'新版耗时':>12}{'新版条数':>10}{'加速':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, data in variants:
+            path = os.path.join(tmp, "bench.srt")
+            with open(path, 'wb') as f:
+                f.write(data)
+            old_time, old_count = bench(legacy_parse_srt, path, args.repeat)
+            new_time, new_count = bench(new_parse_srt, path, args.repeat)
+            old_cell = f"{old_time * 1000:.0f}ms" if old_time is not None else "解码失败"
+            speedup = f"{old_time / new_time:.1f}x" if old_time else "-"
+            print(f"{name:<16}{len(data) / 1e6:>10.1f}{old_cell:>12}{str(old_count or '-'):>10}"
+                  f"{new_time * 1000:>10.0f}ms{new_count:>10}{speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
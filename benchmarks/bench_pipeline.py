@@ -0,0 +1,289 @@
+"""
+不调用 API 的处理步骤性能基准
+
+重新按不同 target_length 切分大量历史字幕时，瓶颈在本地的读取、解析、合并和格式化。
+合成 1k~1M 条字幕（中文/英文/中英混合，LF 或 CRLF+BOM），逐步统计耗时和峰值内存：
+- read_srt: 读取文件并识别编码
+- parse_srt: 解析为字幕条目
+- convert_time_format: 转换所有字幕的开始时间
+- merge_subtitles@N: 按每个目标长度合并
+- format_output: 按第一个目标长度的合并结果格式化输出
+耗时取多次运行中最快的一次（计时期间关闭垃圾回收）；峰值内存在另一次运行中用 tracemalloc 统计，不影响耗时。
+结果与 benchmarks/baselines.json 比较，任一步骤的耗时或峰值内存超出基线 --threshold 时以状态码 1 退出。
+基线与机器相关，更换机器或有意改变性能后用 --save-baseline 重新生成；
+在负载波动大的共享机器上计时误差可达 50%，应提高 --threshold 或只看峰值内存（结果稳定）。
+
+用法: python benchmarks/bench_pipeline.py [--sizes 1k,10k,100k] [--scripts cjk,latin,mixed]
+                                          [--variants lf,crlf-bom] [--threshold 0.25] [--save-baseline]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+# main.py 导入时读取当前目录下的 kimi_config.ini
+os.chdir(REPO_ROOT)
+
+from main import read_srt_text, parse_srt, convert_time_format, merge_subtitles, format_output  # noqa: E402
+
+BASELINE_PATH = os.path.join(REPO_ROOT, "benchmarks", "baselines.json")
+DEFAULT_SIZES = "1k,10k,100k"
+DEFAULT_THRESHOLD = 0.25
+# 变化小于以下绝对值时不算退步，避免小规模用例的计时抖动
+MIN_SECONDS_DELTA = 0.005
+MIN_BYTES_DELTA = 256 * 1024
+
+CJK_LINES = [
+    "今天我们来聊一聊人工智能在内容创作中的应用",
+    "这个问题其实大家讨论了很久",
+    "我们先看一下第三季度的数据",
+    "对 就是这样 然后呢",
+    "嗯 我觉得这个观点挺有意思的",
+    "接下来请嘉宾介绍一下自己",
+]
+LATIN_LINES = [
+    "So the key point is latency, not throughput",
+    "Let's take a look at the numbers from last quarter",
+    "I think that's a really interesting point",
+    "Welcome back to the show, everyone",
+    "We shipped the new version on Monday",
+]
+MIXED_LINES = [
+    "我们用 Python 写了一个 demo",
+    "这个 API 的 rate limit 是每分钟三次",
+    "上周发布的 v2.0 支持 WebVTT 章节",
+]
+SCRIPTS = {
+    "cjk": CJK_LINES,
+    "latin": LATIN_LINES,
+    "mixed": CJK_LINES + LATIN_LINES + MIXED_LINES,
+}
+VARIANTS = ("lf", "crlf-bom")
+
+
+def parse_size(value: str) -> int:
+    """1k/10k/1m 形式的字幕条数"""
+    value = value.strip().lower()
+    for suffix, factor in (("k", 1000), ("m", 1000000)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+def size_label(count: int) -> str:
+    if count >= 1000000 and count % 1000000 == 0:
+        return f"{count // 1000000}m"
+    if count >= 1000 and count % 1000 == 0:
+        return f"{count // 1000}k"
+    return str(count)
+
+
+def _fmt(ms: int) -> str:
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def generate_srt(count: int, script: str = "mixed", seed: int = 0) -> str:
+    """生成 count 条合成字幕，每条 1.5~4 秒、一到两行，条间停顿 0~1.5 秒；同一参数结果相同"""
+    rng = random.Random(seed)
+    pool = SCRIPTS[script]
+    blocks = []
+    t = 0
+    for index in range(1, count + 1):
+        end = t + rng.randint(1500, 4000)
+        lines = [rng.choice(pool)]
+        if rng.random() < 0.2:
+            lines.append(rng.choice(pool))
+        blocks.append(f"{index}\n{_fmt(t)} --> {_fmt(end)}\n" + "\n".join(lines) + "\n")
+        t = end + rng.randint(0, 1500)
+    return "\n".join(blocks)
+
+
+def encode_variant(text: str, variant: str) -> bytes:
+    if variant == "crlf-bom":
+        return b'\xef\xbb\xbf' + text.replace('\n', '\r\n').encode('utf-8')
+    return text.encode('utf-8')
+
+
+def run_stages(path: str, target_lengths, measure):
+    """
+    依次执行各步骤，measure(步骤名, 函数) 执行函数并返回其结果
+    返回解析出的字幕条数，用于确认结果正确
+    """
+    text, _ = measure("read_srt", lambda: read_srt_text(path))
+    items = measure("parse_srt", lambda: parse_srt(text))
+    measure("convert_time_format", lambda: [convert_time_format(item.start_time) for item in items])
+    merged = None
+    for target_length in target_lengths:
+        segments = measure(f"merge_subtitles@{target_length}", lambda: merge_subtitles(items, target_length))
+        merged = merged or segments
+    titles = [f"标题{i + 1}" for i in range(len(merged))]
+    measure("format_output", lambda: format_output(merged, titles))
+    return len(items)
+
+
+def bench_case(path: str, target_lengths, repeat: int):
+    """返回 (步骤名 -> {"seconds", "peak_bytes"}, 字幕条数)"""
+    results = {}
+
+    def timed(name, func):
+        # 与 timeit 相同，计时期间关闭垃圾回收，减少前面用例留下的对象造成的抖动
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        entry = results.setdefault(name, {"seconds": elapsed})
+        entry["seconds"] = min(entry["seconds"], elapsed)
+        return result
+
+    def traced(name, func):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        results[name]["peak_bytes"] = tracemalloc.get_traced_memory()[1] - before
+        return result
+
+    for _ in range(repeat):
+        count = run_stages(path, target_lengths, timed)
+    tracemalloc.start()
+    try:
+        run_stages(path, target_lengths, traced)
+    finally:
+        tracemalloc.stop()
+    return results, count
+
+
+def _change(current: float, baseline: float) -> str:
+    return f"{(current - baseline) / baseline:+.0%}" if baseline else "-"
+
+
+def _format_bytes(value: float) -> str:
+    if value >= 1024 * 1024:
+        return f"{value / 1024 / 1024:.1f}MB"
+    return f"{value / 1024:.0f}KB"
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """逐步骤与基线比较，返回 (表格行, 退步的项)"""
+    rows, regressions = [], []
+    for case, stages in results.items():
+        base_stages = baseline.get(case, {})
+        for stage, current in stages.items():
+            base = base_stages.get(stage)
+            status = "无基线"
+            time_change = memory_change = "-"
+            if base:
+                time_change = _change(current["seconds"], base["seconds"])
+                memory_change = _change(current["peak_bytes"], base["peak_bytes"])
+                problems = []
+                if (current["seconds"] > base["seconds"] * (1 + threshold)
+                        and current["seconds"] - base["seconds"] > MIN_SECONDS_DELTA):
+                    problems.append("耗时")
+                if (current["peak_bytes"] > base["peak_bytes"] * (1 + threshold)
+                        and current["peak_bytes"] - base["peak_bytes"] > MIN_BYTES_DELTA):
+                    problems.append("内存")
+                status = "退步: " + "、".join(problems) if problems else "正常"
+                if problems:
+                    regressions.append(f"{case} {stage}（{'、'.join(problems)}）")
+            rows.append(f"{case:<20}{stage:<24}{current['seconds'] * 1000:>10.1f}ms{time_change:>8}"
+                        f"{_format_bytes(current['peak_bytes']):>10}{memory_change:>8}  {status}")
+    return rows, regressions
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get("results", {})
+
+
+def save_baseline(path: str, results: dict, merge: dict):
+    """保存基线；本次没有运行的用例保留原有基线"""
+    state = {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "results": {**merge, **results},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="读取、解析、合并、格式化各步骤的性能基准")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"逗号分隔的字幕条数，支持 k/m 后缀，最大 1m（默认: {DEFAULT_SIZES}）")
+    parser.add_argument("--scripts", default=",".join(SCRIPTS),
+                        help=f"逗号分隔的文字类型: {', '.join(SCRIPTS)}（默认: 全部）")
+    parser.add_argument("--variants", default=",".join(VARIANTS),
+                        help=f"逗号分隔的文件变体: {', '.join(VARIANTS)}（默认: 全部）")
+    parser.add_argument("--target-lengths", default="500,200,1000",
+                        help="逗号分隔的合并目标长度，第一个用于 format_output（默认: 500,200,1000）")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例重复次数，耗时取最快一次（默认: 5）")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"耗时或峰值内存超出基线的比例达到此值视为退步（默认: {DEFAULT_THRESHOLD}）")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件（默认: benchmarks/baselines.json）")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线，不做比较")
+    args = parser.parse_args()
+
+    sizes = [parse_size(value) for value in args.sizes.split(",") if value.strip()]
+    scripts = [value.strip() for value in args.scripts.split(",") if value.strip()]
+    variants = [value.strip() for value in args.variants.split(",") if value.strip()]
+    target_lengths = [int(value) for value in args.target_lengths.split(",") if value.strip()]
+    for value in scripts:
+        if value not in SCRIPTS:
+            parser.error(f"未知的文字类型: {value}")
+    for value in variants:
+        if value not in VARIANTS:
+            parser.error(f"未知的文件变体: {value}")
+    if args.repeat < 1:
+        parser.error("--repeat 至少为 1")
+    if any(size < 1 or size > 1000000 for size in sizes):
+        parser.error("字幕条数应在 1 到 1m 之间")
+
+    results = {}
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.srt")
+        for size in sizes:
+            for script in scripts:
+                text = generate_srt(size, script)
+                for variant in variants:
+                    case = f"{size_label(size)}-{script}-{variant}"
+                    data = encode_variant(text, variant)
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                    print(f"[基准] {case}: {len(data) / 1e6:.1f}MB", flush=True)
+                    results[case], count = bench_case(path, target_lengths, args.repeat)
+                    if count != size:
+                        errors.append(f"{case} 解析出 {count} 条字幕，应为 {size} 条")
+
+    baseline = load_baseline(args.baseline)
+    if args.save_baseline:
+        save_baseline(args.baseline, results, baseline)
+        print(f"[基准] 已保存基线: {args.baseline}")
+    rows, regressions = compare(results, {} if args.save_baseline else baseline, args.threshold)
+    print(f"{'用例':<18}{'步骤':<22}{'耗时':>12}{'变化':>6}{'峰值内存':>8}{'变化':>6}  状态")
+    print("\n".join(rows))
+    for error in errors:
+        print(f"[基准] 错误: {error}")
+    if regressions:
+        print(f"[基准] {len(regressions)} 项超出基线 {args.threshold:.0%}：")
+        for item in regressions:
+            print(f"  {item}")
+    if errors or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+用量预估与预算控制
+
+- 本地估算 token 数（不调用 API）
+- 按配置的 RPM/TPM 估算请求数和耗时
+- 单次运行与每日 token 上限：发起请求前预留预计用量，完成后按实际用量结算，达到上限后停止发起新请求
+- 未完成的段落保存为待处理文件，可用 --resume 继续
+"""
+import contextlib
+import datetime
+import json
+import math
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+# 预估参数：中文约 1.5 字/token，其他字符约 4 字符/token
+CJK_CHARS_PER_TOKEN = 1.5
+OTHER_CHARS_PER_TOKEN = 4.0
+MESSAGE_OVERHEAD_TOKENS = 8
+TITLE_COMPLETION_TOKENS = 16
+PROOFREAD_COMPLETION_RATIO = 1.15   # 校对输出在原文基础上增加标点
+OUTPUT_TOKENS_PER_SECOND = 40.0
+# 未配置 rpm/tpm 时预估耗时使用的默认值（免费额度），调度本身不限制
+ESTIMATE_DEFAULT_RPM = 3
+ESTIMATE_DEFAULT_TPM = 32000
+REQUEST_OVERHEAD_SECONDS = 1.0
+
+DB_TIMEOUT_SECONDS = 30.0
+RESERVATION_TTL_SECONDS = 3600.0  # 超过这个时间仍未结算的预留视为所在进程已退出
+
+_USAGE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (day TEXT PRIMARY KEY, tokens INTEGER NOT NULL, requests INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS reservations (
+    id INTEGER PRIMARY KEY, day TEXT NOT NULL, tokens INTEGER NOT NULL, created_at REAL NOT NULL
+);
+"""
+
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uf900-\ufaff\u3000-\u303f\uff00-\uffef]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def count_tokens(text: str) -> int:
+    """本地估算 token 数"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = len(_SPACE_RE.sub('', text)) - cjk
+    return int(math.ceil(cjk / CJK_CHARS_PER_TOKEN + other / OTHER_CHARS_PER_TOKEN))
+
+
+def count_message_tokens(messages: List[dict]) -> int:
+    """估算一次对话请求的提示词 token 数"""
+    return sum(count_tokens(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+class StepEstimate:
+    """单个步骤的预估结果"""
+    def __init__(self, name: str, requests: int, prompt_tokens: int, completion_tokens: int, seconds: float):
+        self.name = name
+        self.requests = requests
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.seconds = seconds
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def estimate_step(name: str, prompt_tokens: List[int], completion_tokens: List[int],
+                  rpm: int, tpm: int) -> StepEstimate:
+    """
+    按请求逐个累计耗时：每次请求取网络耗时与 RPM 间隔的较大值，
+    总耗时不低于 TPM 限制下的最短时间
+    """
+    interval = 60.0 / rpm if rpm > 0 else 0.0
+    seconds = 0.0
+    for completion in completion_tokens:
+        latency = REQUEST_OVERHEAD_SECONDS + completion / OUTPUT_TOKENS_PER_SECOND
+        seconds += max(interval, latency)
+    total = sum(prompt_tokens) + sum(completion_tokens)
+    if tpm > 0:
+        seconds = max(seconds, total / tpm * 60.0)
+    return StepEstimate(name, len(prompt_tokens), sum(prompt_tokens), sum(completion_tokens), seconds)
+
+
+def format_estimates(estimates: List[StepEstimate], price_prompt: float = 0.0, price_completion: float = 0.0) -> str:
+    """格式化预估结果表格，price_* 为每千 token 价格（元），为 0 时不显示费用"""
+    lines = [f"{'步骤':<8}{'请求数':>8}{'提示词tokens':>14}{'输出tokens':>12}{'预计耗时':>10}"]
+    for est in estimates + [_sum_estimates(estimates)]:
+        lines.append(f"{est.name:<8}{est.requests:>8}{est.prompt_tokens:>14}{est.completion_tokens:>12}"
+                     f"{format_seconds(est.seconds):>10}")
+    if price_prompt or price_completion:
+        total = _sum_estimates(estimates)
+        cost = total.prompt_tokens / 1000 * price_prompt + total.completion_tokens / 1000 * price_completion
+        lines.append(f"预计费用: {cost:.4f} 元")
+    return '\n'.join(lines)
+
+
+def _sum_estimates(estimates: List[StepEstimate]) -> StepEstimate:
+    return StepEstimate(
+        "合计",
+        sum(e.requests for e in estimates),
+        sum(e.prompt_tokens for e in estimates),
+        sum(e.completion_tokens for e in estimates),
+        sum(e.seconds for e in estimates),
+    )
+
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}时{seconds % 3600 // 60}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds}秒"
+
+
+class BudgetExceeded(Exception):
+    """预算已用尽，不再发起新请求"""
+
+
+class Reservation:
+    """check() 预留的用量：请求完成后交给 charge() 按实际用量结算，请求失败时交给 release() 退回"""
+    def __init__(self, tokens: int, row: int = None):
+        self.tokens = tokens
+        self.row = row  # 每日用量表中的预留记录
+
+
+class Budget:
+    """
+    单次运行与每日 token 预算，上限为 0 表示不限制
+    check() 在检查上限的同时预留预计用量，并发的请求各自占用额度，不会一起通过检查后共同超出上限；
+    charge() 按实际用量结算并释放预留。
+    每日用量和各进程的预留保存在 SQLite 文件 usage_path 中，读改写在 BEGIN IMMEDIATE 事务内完成，
+    同一台机器上的 GUI 和命令行进程共用每日预算。线程安全，GUI 队列中并行的任务可共用一个预算
+    """
+    run_label = "单次运行预算"
+
+    def __init__(self, max_run_tokens: int = 0, max_day_tokens: int = 0, usage_path: str = None):
+        self.max_run_tokens = max_run_tokens
+        self.max_day_tokens = max_day_tokens
+        self.usage_path = usage_path or default_usage_path()
+        self.run_tokens = 0
+        self.run_requests = 0
+        self._reserved = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+    def check(self, tokens: int) -> Reservation:
+        """发起请求前检查并预留预计用量，会超出上限时抛出 BudgetExceeded"""
+        with self._lock:
+            self._check_run(tokens)
+            row = None
+            if self.max_day_tokens:
+                with self._transaction() as db:
+                    day_tokens = self._day_tokens(db)
+                    if day_tokens + tokens > self.max_day_tokens:
+                        raise BudgetExceeded(f"已达到每日预算（{day_tokens}/{self.max_day_tokens} tokens）")
+                    row = db.execute("INSERT INTO reservations (day, tokens, created_at) VALUES (?, ?, ?)",
+                                     (_today(), tokens, time.time())).lastrowid
+            self._reserved += tokens
+            return Reservation(tokens, row)
+
+    def charge(self, tokens: int, reservation: Reservation = None):
+        """记录一次请求的实际用量，并释放 check() 时的预留"""
+        with self._lock:
+            self.run_tokens += tokens
+            self.run_requests += 1
+            with self._transaction() as db:
+                if reservation is not None:
+                    self._release(db, reservation)
+                db.execute("INSERT INTO usage (day, tokens, requests) VALUES (?, ?, 1) ON CONFLICT (day) DO UPDATE "
+                           "SET tokens = tokens + excluded.tokens, requests = requests + 1", (_today(), tokens))
+
+    def release(self, reservation: Reservation):
+        """请求未发出或失败时退回预留"""
+        if reservation is None:
+            return
+        with self._lock:
+            with self._transaction() as db:
+                self._release(db, reservation)
+
+    def charge_completion(self, completion, prompt_tokens: int, completion_tokens: int,
+                          reservation: Reservation = None):
+        """按接口返回的 usage 记账，没有 usage 时使用本地估算值"""
+        usage = getattr(completion, "usage", None)
+        total = getattr(usage, "total_tokens", None) if usage else None
+        self.charge(total if total else prompt_tokens + completion_tokens, reservation)
+
+    def day_usage(self) -> dict:
+        with self._lock:
+            with self._transaction() as db:
+                row = db.execute("SELECT tokens, requests FROM usage WHERE day = ?", (_today(),)).fetchone()
+        return {"tokens": row[0], "requests": row[1]} if row else {}
+
+    def _check_run(self, tokens: int):
+        """本预算的单次上限，计入其他线程已预留但尚未结算的用量；调用时已持有 _lock"""
+        if self.max_run_tokens and self.run_tokens + self._reserved + tokens > self.max_run_tokens:
+            pending = f"，进行中的请求预留 {self._reserved}" if self._reserved else ""
+            raise BudgetExceeded(f"已达到{self.run_label}（{self.run_tokens}/{self.max_run_tokens} tokens{pending}）")
+
+    def _release(self, db, reservation: Reservation):
+        self._reserved -= reservation.tokens
+        if reservation.row is not None:
+            db.execute("DELETE FROM reservations WHERE id = ?", (reservation.row,))
+
+    def _day_tokens(self, db) -> int:
+        """今天已用的和各进程预留中的 token 数；进程异常退出留下的过期预留不计入"""
+        used = db.execute("SELECT tokens FROM usage WHERE day = ?", (_today(),)).fetchone()
+        reserved = db.execute("SELECT COALESCE(SUM(tokens), 0) FROM reservations WHERE day = ? AND created_at > ?",
+                              (_today(), time.time() - RESERVATION_TTL_SECONDS)).fetchone()[0]
+        return (used[0] if used else 0) + reserved
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE 取得写锁，多个进程对每日用量的读改写互斥
+        if self._db is None:
+            self._db = sqlite3.connect(self.usage_path, timeout=DB_TIMEOUT_SECONDS, isolation_level=None,
+                                       check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_USAGE_SCHEMA)
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._db
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+
+class JobBudget(Budget):
+    """
+    共享预算中的单个任务：检查、预留和记账作用于共享预算，同时单独统计本任务的用量
+    本任务的计数与上限检查在同一把锁内完成，任务内并发的请求线程不会漏计或一起越过上限
+    """
+    def __init__(self, shared: Optional[Budget]):
+        super().__init__()
+        self.shared = shared
+
+    def check(self, tokens: int) -> Reservation:
+        with self._lock:
+            self._check_run(tokens)
+            self._reserved += tokens
+        try:
+            return self.shared.check(tokens) if self.shared else Reservation(tokens)
+        except BaseException:
+            with self._lock:
+                self._reserved -= tokens
+            raise
+
+    def charge(self, tokens: int, reservation: Reservation = None):
+        if self.shared:
+            self.shared.charge(tokens, reservation)
+        with self._lock:
+            self.run_tokens += tokens
+            self.run_requests += 1
+            if reservation is not None:
+                self._reserved -= reservation.tokens
+
+    def release(self, reservation: Reservation):
+        if reservation is None:
+            return
+        if self.shared:
+            self.shared.release(reservation)
+        with self._lock:
+            self._reserved -= reservation.tokens
+
+    def day_usage(self) -> dict:
+        return self.shared.day_usage() if self.shared else {}
+
+
+class RetryBudget(JobBudget):
+    """
+    死信重试使用的预算：max_tokens 为所有重试合计的上限（0 为不单独限制），
+    同时检查并计入 shared（运行预算或任务预算）；shared 为 None 时只受自身上限约束
+    """
+    run_label = "重试预算"
+
+    def __init__(self, shared: Optional[Budget], max_tokens: int = 0):
+        super().__init__(shared)
+        self.max_run_tokens = max_tokens
+
+
+def call_with_budget(budget: Optional[Budget], prompt_tokens: int, completion_tokens: int, call):
+    """
+    预留预计用量后执行 call() 发起请求，成功后按返回的 usage 结算，失败时退回预留；
+    budget 为 None 时不做检查。返回 call() 的结果
+    """
+    if budget is None:
+        return call()
+    reservation = budget.check(prompt_tokens + completion_tokens)
+    try:
+        completion = call()
+    except BaseException:
+        budget.release(reservation)
+        raise
+    budget.charge_completion(completion, prompt_tokens, completion_tokens, reservation)
+    return completion
+
+
+def default_usage_path() -> str:
+    """每日用量文件，放在系统临时目录中，与工作目录无关，同一台机器上的进程共用"""
+    return os.path.join(tempfile.gettempdir(), "kimi_usage.db")
+
+
+def _today() -> str:
+    return datetime.date.today().isoformat()
+
+
+def save_pending(path: str, source: str, target_length: int, segments, titles: List[Optional[str]],
+                 proofread: List[Optional[str]], dead_letters: List[dict] = None):
+    """
+    保存待处理状态，titles/proofread 中为 None 的条目表示尚未完成
+    segments 为 MergedSegment 列表（原始正文）；dead_letters 为多次重试仍失败的条目（失败原因和尝试次数）
+    """
+    state = {
+        "source": source,
+        "target_length": target_length,
+        "segments": [
+            {"time": seg.time, "start_ms": seg.start_ms, "end_ms": seg.end_ms, "text": seg.text}
+            for seg in segments
+        ],
+        "titles": titles,
+        "proofread": proofread,
+    }
+    if dead_letters:
+        state["dead_letters"] = dead_letters
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+def load_pending(path: str) -> dict:
+    """读取待处理状态文件"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
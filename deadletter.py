@@ -0,0 +1,136 @@
+"""
+死信队列
+
+单段请求失败（非 429 的接口错误、多次 429 后仍失败、返回内容异常）时不再中止整个任务，
+也不再用占位内容代替：失败的段落记入死信队列，流程继续处理后面的段落；
+本阶段结束后按退避间隔重试队列中的段落，重试使用单独的预算上限。
+多轮重试后仍失败的段落在输出中明确标注，并和失败原因一起保存到待处理文件，可用 --resume 再次重试。
+连续多段失败通常说明接口本身不可用（如 API Key 无效），此时停止发起新请求，剩余段落记为待处理。
+"""
+import threading
+import time
+from typing import Callable, Dict, List
+
+from budget import BudgetExceeded
+from scheduler import AcquireCancelled, TASK_TITLE, TASK_PROOFREAD
+
+DEFAULT_RETRY_ROUNDS = 2              # 本阶段结束后重试的轮数，0 为不重试
+DEFAULT_RETRY_BACKOFF_SECONDS = 10.0  # 第一轮重试前的等待秒数，之后每轮加倍
+MAX_RETRY_BACKOFF_SECONDS = 300.0
+MAX_CONSECUTIVE_FAILURES = 5          # 连续失败达到此段数时停止发起新请求
+
+FAILED_TITLE = "【标题生成失败】"
+FAILED_TEXT_MARK = "【未校对】"
+
+TASK_KEYS = {TASK_TITLE: "title", TASK_PROOFREAD: "proofread"}
+TASK_NAMES = {TASK_TITLE: "标题", TASK_PROOFREAD: "校对"}
+_TASKS_BY_KEY = {key: task for task, key in TASK_KEYS.items()}
+
+
+def failed_text(text: str) -> str:
+    """校对失败的段落输出原文，并在开头标注"""
+    return FAILED_TEXT_MARK + text
+
+
+def error_message(error) -> str:
+    return str(error) or type(error).__name__
+
+
+class DeadLetterQueue:
+    """
+    失败的请求，按 (调用类型, 段落序号) 记录最近一次的失败原因和累计尝试次数，线程安全
+    entries 为 to_list() 的结果，用于从待处理文件恢复
+    """
+    def __init__(self, entries: List[dict] = None):
+        self._lock = threading.Lock()
+        self._entries: Dict[tuple, dict] = {}
+        for entry in entries or []:
+            task = _TASKS_BY_KEY[entry["task"]]
+            self._entries[(task, entry["index"])] = {"error": entry.get("error", ""),
+                                                     "attempts": entry.get("attempts", 0)}
+
+    def add(self, task: int, index: int, error) -> int:
+        """记录一次失败（error 为异常或原因），返回该条目累计的失败次数"""
+        with self._lock:
+            entry = self._entries.setdefault((task, index), {"error": "", "attempts": 0})
+            entry["error"] = error_message(error)
+            entry["attempts"] += 1
+            return entry["attempts"]
+
+    def extend(self, other: "DeadLetterQueue", offset: int = 0):
+        """并入另一个队列的条目，段落序号加上 offset"""
+        with other._lock:
+            entries = {(task, index + offset): dict(entry) for (task, index), entry in other._entries.items()}
+        with self._lock:
+            self._entries.update(entries)
+
+    def remove(self, task: int, index: int):
+        """该条目已成功，移出队列"""
+        with self._lock:
+            self._entries.pop((task, index), None)
+
+    def failed(self, task: int, index: int) -> bool:
+        with self._lock:
+            return (task, index) in self._entries
+
+    def indices(self, task: int) -> List[int]:
+        with self._lock:
+            return sorted(index for t, index in self._entries if t == task)
+
+    def error(self, task: int, index: int) -> str:
+        with self._lock:
+            return self._entries.get((task, index), {}).get("error", "")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def to_list(self) -> List[dict]:
+        """保存到待处理文件的形式"""
+        with self._lock:
+            return [{"task": TASK_KEYS[task], "index": index, **entry}
+                    for (task, index), entry in sorted(self._entries.items())]
+
+    def summary(self) -> List[str]:
+        """每个仍失败的条目一行"""
+        return [f"第 {entry['index'] + 1} 段{TASK_NAMES[_TASKS_BY_KEY[entry['task']]]}"
+                f"（尝试 {entry['attempts']} 次）：{entry['error']}" for entry in self.to_list()]
+
+
+def retry_backoff(round_number: int, backoff_seconds: float) -> float:
+    """第 round_number 轮（从 1 开始）重试前的等待秒数"""
+    return min(MAX_RETRY_BACKOFF_SECONDS, backoff_seconds * 2 ** (round_number - 1))
+
+
+def retry_dead_letters(queue: DeadLetterQueue, task: int, func: Callable[[int], object],
+                       rounds: int = DEFAULT_RETRY_ROUNDS, backoff_seconds: float = DEFAULT_RETRY_BACKOFF_SECONDS,
+                       wait: Callable[[float], bool] = time.sleep, log=print) -> Dict[int, object]:
+    """
+    重试队列中 task 类型的条目：每轮先等待退避时间，再按段落顺序逐个调用 func(index)
+    成功的条目移出队列，返回 段落序号 -> 结果；失败的留在队列中进入下一轮
+    预算用尽（BudgetExceeded）时停止重试；wait(seconds) 返回 True（如任务已取消）时也停止
+    """
+    recovered = {}
+    for round_number in range(1, rounds + 1):
+        indices = queue.indices(task)
+        if not indices:
+            break
+        delay = retry_backoff(round_number, backoff_seconds)
+        log(f"死信队列中有 {len(indices)} 段{TASK_NAMES[task]}失败，{delay:.0f} 秒后进行第 {round_number}/{rounds} 轮重试")
+        if wait(delay):
+            break
+        for index in indices:
+            try:
+                recovered[index] = func(index)
+            except BudgetExceeded as e:
+                log(f"{e}，停止重试")
+                return recovered
+            except AcquireCancelled:
+                raise
+            except Exception as e:
+                attempts = queue.add(task, index, e)
+                log(f"第 {index + 1} 段{TASK_NAMES[task]}重试失败（已尝试 {attempts} 次）：{error_message(e)}")
+            else:
+                queue.remove(task, index)
+                log(f"第 {index + 1} 段{TASK_NAMES[task]}重试成功")
+    return recovered
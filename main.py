@@ -1,26 +1,122 @@
 
+import bisect
+import collections
+import codecs
+import mmap
+import os
+import re
+import sqlite3
 import sys
+import threading
+import argparse
+import atexit
 from typing import List
 import time
 import datetime
 import configparser
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import (
+    get_scheduler, default_state_path, PRIORITY_NAMES, PRIORITY_INTERACTIVE, PRIORITY_BATCH, TASK_TITLE, TASK_PROOFREAD
+)
+from writers import WRITERS, DEFAULT_FORMATS, parse_formats, open_writers
+from profiling import RunProfiler
+from batch import (
+    run_batch, batch_input_path, completion_content, completion_tokens_used, LocalBatchClient, BatchFailed,
+    BATCH_POLL_SECONDS
+)
+from backends import create_backend, BackendUnsupported
+from tracing import get_tracer, traced
+from routing import get_router, parse_model_list, DEFAULT_SLOW_SECONDS, DEFAULT_COOLDOWN_SECONDS
+from deadletter import (
+    DeadLetterQueue, retry_dead_letters, failed_text, error_message, FAILED_TITLE, MAX_CONSECUTIVE_FAILURES,
+    DEFAULT_RETRY_ROUNDS, DEFAULT_RETRY_BACKOFF_SECONDS
+)
+from archive import ShownotesArchive, file_digest, text_digest, DEFAULT_ARCHIVE_PATH, DEFAULT_SEARCH_LIMIT
+from segmentation import topic_boundaries, MIN_LENGTH_RATIO, MAX_LENGTH_RATIO
+import segmentation
+from punctuation import (
+    prepunctuate, join_punctuated, gap_punctuation, replace_pause_spaces, clean_score, DEFAULT_COMMA_GAP_MS,
+    DEFAULT_PERIOD_GAP_MS, DEFAULT_SKIP_SCORE
+)
+from budget import (
+    Budget, BudgetExceeded, StepEstimate, count_tokens, count_message_tokens, call_with_budget,
+    RetryBudget, estimate_step, format_estimates, save_pending, load_pending,
+    TITLE_COMPLETION_TOKENS, PROOFREAD_COMPLETION_RATIO, ESTIMATE_DEFAULT_RPM, ESTIMATE_DEFAULT_TPM
+)
+
+
+MAX_RATE_LIMIT_RETRIES = 300         # 同一请求触发 429 后退避重试的最多次数（改用备用模型不计）
+RATE_LIMIT_DEADLINE_SECONDS = 1800.0  # 同一请求从第一次申请起超过这个时间仍被限流即放弃
+
+
+class RateLimitExhausted(Exception):
+    """同一请求多次触发 429 后仍未成功，由调用方记入死信队列"""
 
 
-def kimi_rpm_handle(call_func, *args, **kwargs):
+def _log_kimi(message: str):
+    print(f"[Kimi] {message}")
+
+
+def kimi_rpm_handle(call_func, *args, job_class=None, task=TASK_PROOFREAD, tokens=0, job=None, cancel=None,
+                    log=_log_kimi, on_rate_limited=None, on_success=None, **kwargs):
     """
-    通用Kimi速率限制处理，call_func为API调用函数。
+    通用Kimi速率限制处理，命令行和 GUI 的所有逐条请求都经过这里。call_func(model, ...)为API调用函数，model由模型路由按任务选择。
+    每次调用前向调度器申请时机（job_class/job 默认为本进程的 run_priority/run_job，cancel 被设置时抛出 AcquireCancelled），
+    触发429时若还有可用的备用模型则立即改用，否则由调度器统一退避后重试；
+    退避 MAX_RATE_LIMIT_RETRIES 次或超过 RATE_LIMIT_DEADLINE_SECONDS 后抛出 RateLimitExhausted。
+    log(message) 输出进度和错误；on_rate_limited(delay) 在每次退避时回调；
+    on_success(model, seconds, completion) 在调用成功并向调度器、模型路由报告用量后回调
     """
+    scheduler = get_scheduler()
+    router = get_router()
+    tracer = get_tracer()
+    deadline = time.time() + RATE_LIMIT_DEADLINE_SECONDS
+    retries = 0
     while True:
+        if retries >= MAX_RATE_LIMIT_RETRIES or time.time() >= deadline:
+            raise RateLimitExhausted(f"触发速率限制 {retries} 次后仍未成功，放弃本次请求")
+        model = router.choose(task)
+        with tracer.span("调度等待", "scheduler", tokens=tokens):
+            grant = scheduler.acquire(run_priority if job_class is None else job_class, task,
+                                      job=run_job if job is None else job, tokens=tokens, cancel=cancel)
+        started = time.time()
         try:
-            return call_func(*args, **kwargs)
+            with tracer.span(f"API {model}", "api", model=model):
+                result = call_func(model, *args, **kwargs)
         except Exception as e:
             if hasattr(e, 'status_code') and e.status_code == 429:
-                print("[Kimi] 触发速率限制，等待1.2秒后重试...")
-                time.sleep(1.2)
+                tracer.instant("429", "api", model=model)
+                fallback = router.report_rate_limited(task, model)
+                if fallback:
+                    log(f"模型 {model} 触发速率限制，改用 {fallback} 重试...")
+                    continue
+                delay = scheduler.report_rate_limited()
+                retries += 1
+                if on_rate_limited:
+                    on_rate_limited(delay)
+                log(f"触发速率限制，等待{delay:.1f}秒后重试...（{retries}/{MAX_RATE_LIMIT_RETRIES}）")
             else:
-                print(f"[Kimi] 发生错误：{e}")
+                log(f"发生错误：{e}")
                 raise
+        else:
+            scheduler.report_success(grant, completion_total_tokens(result))
+            seconds = time.time() - started
+            fallback = router.report_call(task, model, seconds, completion_total_tokens(result) or tokens)
+            if fallback:
+                log(f"模型 {model} 本次耗时{seconds:.1f}秒，后续请求改用 {fallback}")
+            if on_success:
+                on_success(model, seconds, result)
+            return result
+
+
+def completion_total_tokens(completion) -> int:
+    """响应中的 total_tokens，没有 usage 时返回 0"""
+    usage = getattr(completion, "usage", None)
+    return int(getattr(usage, "total_tokens", 0) or 0) if usage else 0
+
+
+PROOFREAD_CHUNK_TOKENS = 600  # 超过此 token 数的段落按句子拆成多块并行校对，见 split_for_proofread()
 
 
 # 从配置文件读取大模型相关配置
@@ -30,96 +126,903 @@ def load_config(config_path="kimi_config.ini"):
     section = config["kimi"]
     return section["api_key"], section["base_url"], section["model"]
 
-# 加载配置
-api_key, base_url, model_name = load_config()
 
-# 配置 Moonshot Kimi API
-client = OpenAI(
-    api_key=api_key,
-    base_url=base_url,
-)
+def _config_bool(value) -> bool:
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
 
-def kimi_generate_titles(text_list):
+
+def load_limits(config_path="kimi_config.ini"):
+    """
+    读取速率限制、预算和价格配置（均为可选项）
+    rpm/tpm: 每分钟请求数/token数，0为不限（只靠429退避）；max_tokens_per_run/max_tokens_per_day: 预算上限，0为不限
+    shared_rate_limit: 是否与同一 API Key 的其他进程共享调度状态
+    price_per_1k_prompt/price_per_1k_completion: 每千token价格（元），仅用于预估费用
+    dead_letter_retries/dead_letter_backoff_seconds: 失败段落在本阶段结束后的重试轮数和第一轮前的等待秒数
+    dead_letter_max_tokens: 重试合计的 token 上限，0为只受运行预算限制
+    proofread_chunk_tokens: 超过此 token 数的段落拆成多块并行校对，0为不拆分
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding="utf-8")
+    section = config["kimi"] if "kimi" in config else {}
+    return {
+        "rpm": int(section.get("rpm", 0)),
+        "tpm": int(section.get("tpm", 0)),
+        "shared_rate_limit": _config_bool(section.get("shared_rate_limit", "true")),
+        "max_tokens_per_run": int(section.get("max_tokens_per_run", 0)),
+        "max_tokens_per_day": int(section.get("max_tokens_per_day", 0)),
+        "price_per_1k_prompt": float(section.get("price_per_1k_prompt", 0)),
+        "price_per_1k_completion": float(section.get("price_per_1k_completion", 0)),
+        "dead_letter_retries": int(section.get("dead_letter_retries", DEFAULT_RETRY_ROUNDS)),
+        "dead_letter_backoff_seconds": float(section.get("dead_letter_backoff_seconds", DEFAULT_RETRY_BACKOFF_SECONDS)),
+        "dead_letter_max_tokens": int(section.get("dead_letter_max_tokens", 0)),
+        "proofread_chunk_tokens": int(section.get("proofread_chunk_tokens", PROOFREAD_CHUNK_TOKENS)),
+    }
+
+
+def load_punctuation_options(config_path="kimi_config.ini"):
+    """
+    读取本地预加标点配置（均为可选项）
+    pre_punctuate: 合并前按字幕间隔加标点；comma_gap_ms/period_gap_ms: 加逗号/句号的最短停顿（毫秒）
+    skip_confident_proofread: 清洁度得分达到 skip_score 的段落不再请求校对
+    skip_score: 跳过校对的清洁度阈值（0~1），见 punctuation.clean_score()
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding="utf-8")
+    section = config["kimi"] if "kimi" in config else {}
+    return {
+        "pre_punctuate": _config_bool(section.get("pre_punctuate", "false")),
+        "comma_gap_ms": int(section.get("comma_gap_ms", DEFAULT_COMMA_GAP_MS)),
+        "period_gap_ms": int(section.get("period_gap_ms", DEFAULT_PERIOD_GAP_MS)),
+        "skip_confident_proofread": _config_bool(section.get("skip_confident_proofread", "false")),
+        "skip_score": float(section.get("skip_score", DEFAULT_SKIP_SCORE)),
+    }
+
+
+SEGMENTERS = ("length", "topic")
+
+
+def load_segmentation_options(config_path="kimi_config.ini"):
+    """
+    读取分段配置（均为可选项）
+    segmenter: length 按累计字数合并，topic 按话题切分（需要 numpy）
+    topic_min_length/topic_max_length: 按话题切分时每段的最短/最长字数，0为目标长度的 0.5/2 倍
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding="utf-8")
+    section = config["kimi"] if "kimi" in config else {}
+    return {
+        "segmenter": section.get("segmenter", "length").strip().lower() or "length",
+        "topic_min_length": int(section.get("topic_min_length", 0)),
+        "topic_max_length": int(section.get("topic_max_length", 0)),
+    }
+
+
+def load_model_routing(config_path="kimi_config.ini"):
+    """
+    读取按任务选择模型的配置（均为可选项）
+    title_model/proofread_model: 标题/校对使用的主模型，未设置时使用 model
+    fallback_models: 逗号分隔的备用模型，主模型被限流或过慢时按顺序改用
+    fallback_slow_seconds: 单次调用超过此秒数视为过慢，0 为只在限流时改用备用模型
+    fallback_cooldown_seconds: 被限流或过慢的模型暂停使用的秒数
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding="utf-8")
+    section = config["kimi"] if "kimi" in config else {}
+    model = section.get("model", "moonshot-v1-8k")
+    return {
+        "title_model": section.get("title_model", "").strip() or model,
+        "proofread_model": section.get("proofread_model", "").strip() or model,
+        "fallback_models": parse_model_list(section.get("fallback_models", "")),
+        "fallback_slow_seconds": float(section.get("fallback_slow_seconds", DEFAULT_SLOW_SECONDS)),
+        "fallback_cooldown_seconds": float(section.get("fallback_cooldown_seconds", DEFAULT_COOLDOWN_SECONDS)),
+    }
+
+
+def load_backend_options(config_path="kimi_config.ini"):
+    """
+    读取补全后端配置（均为可选项）
+    backend: openai（Moonshot 等 OpenAI 兼容接口，默认）、llamacpp（llama.cpp server）或 vllm
+    max_concurrency: 同时进行的请求数，0 为后端的默认值（openai 为 1，llamacpp 为服务端槽位数，vllm 为 64）
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding="utf-8")
+    section = config["kimi"] if "kimi" in config else {}
+    return {
+        "backend": section.get("backend", "openai"),
+        "max_concurrency": int(section.get("max_concurrency", 0)),
+    }
+
+
+def load_archive_options(config_path="kimi_config.ini"):
+    """
+    读取归档配置（均为可选项）
+    archive_path: 归档文件路径，留空为不归档
+    reuse_archived: 处理前沿用归档中原文、模型和提示词版本都相同的段落的结果（默认关闭，命令行 --reuse 可开启）
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding="utf-8")
+    section = config["kimi"] if "kimi" in config else {}
+    return {
+        "archive_path": section.get("archive_path", DEFAULT_ARCHIVE_PATH).strip(),
+        "reuse_archived": _config_bool(section.get("reuse_archived", "false")),
+    }
+
+
+# 命令行使用的补全后端，默认为 Moonshot Kimi API；导入本模块时不创建（llamacpp 等后端会探测服务端）
+_backend = None
+
+
+def get_backend():
+    """本进程的补全后端，第一次使用时按配置创建"""
+    global _backend
+    if _backend is None:
+        key, url, _ = load_config()
+        options = load_backend_options()
+        _backend = create_backend(options["backend"], key, url, options["max_concurrency"])
+    return _backend
+
+
+def configure_scheduler(key: str, limits: dict):
+    """按配置设置调度器；共享时同一 API Key 的所有进程使用同一个状态文件"""
+    state_path = default_state_path(key) if limits["shared_rate_limit"] else None
+    get_scheduler().configure(limits["rpm"], limits["tpm"], state_path)
+
+
+def configure_router(routing: dict):
+    """按配置设置本进程的模型路由"""
+    get_router().configure({TASK_TITLE: routing["title_model"], TASK_PROOFREAD: routing["proofread_model"]},
+                           routing["fallback_models"], routing["fallback_slow_seconds"],
+                           routing["fallback_cooldown_seconds"])
+
+
+def print_rate_status():
+    """--rate-status：共享调度状态的快照"""
+    status = get_scheduler().status()
+    labels = {PRIORITY_INTERACTIVE: "交互", PRIORITY_BATCH: "批处理"}
+    waiting = "，".join(f"{labels.get(job_class, job_class)} {count} 个"
+                       for job_class, count in sorted(status["waiting"].items())) or "无"
+    print(f"[调度] 状态文件: {status['state_path'] or '（未共享，仅本进程）'}")
+    print(f"[调度] 配置上限: RPM={status['rpm'] or '不限'}，TPM={status['tpm'] or '不限'}")
+    if status["learned_rpm"]:
+        print(f"[调度] 按 429 学到的 RPM 上限: {status['learned_rpm']}（之后逐步放宽）")
+    print(f"[调度] 最近一分钟: {status['calls_last_minute']} 次调用，{status['tokens_last_minute']} tokens")
+    print(f"[调度] 等待中的调用: {waiting}（来自 {status['waiting_processes']} 个进程）")
+    if status["blocked_seconds"] > 0:
+        print(f"[调度] 429 退避中，还需 {status['blocked_seconds']:.1f} 秒（连续 {status['consecutive_429']} 次）")
+
+
+def print_model_report():
+    """运行报告：各模型承担的请求数和 token 数"""
+    for line in get_router().summary():
+        print(f"[Kimi] 模型用量 {line}")
+
+
+configure_router(load_model_routing())
+
+# 命令行默认按后台批处理优先级调度；共享调度状态和任务编号在命令行入口配置，导入本模块时不创建
+run_priority = PRIORITY_BATCH
+run_job = None
+# 开启跳过校对时，清洁度达到此值的段落不请求校对；命令行 --skip-score 可覆盖
+skip_score = load_punctuation_options()["skip_score"]
+
+KIMI_SYSTEM_PROMPT = "你是 Kimi，由 Moonshot AI 提供的人工智能助手。"
+
+
+def build_messages(prompt: str) -> list:
+    """对话消息列表"""
+    return [
+        {"role": "system", "content": KIMI_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def estimate_title_tokens(text: str):
+    """预估一次标题请求的 (提示词tokens, 输出tokens)"""
+    return count_message_tokens(build_messages(build_title_prompt(text))), TITLE_COMPLETION_TOKENS
+
+
+def estimate_proofread_tokens(text: str, failure_reason: str = None):
+    """预估一次校对请求的 (提示词tokens, 输出tokens)"""
+    prompt_tokens = count_message_tokens(build_messages(build_proofread_prompt(text, failure_reason)))
+    return prompt_tokens, int(count_tokens(text) * PROOFREAD_COMPLETION_RATIO) + 1
+
+
+def is_clean(text: str) -> bool:
+    """段落的清洁度得分达到 skip_score，可以不经校对直接使用"""
+    return clean_score(text) >= skip_score
+
+
+def needs_proofread(texts: List[str], skip_confident: bool) -> List[str]:
+    """需要请求校对的段落：开启 skip_confident 时去掉清洁度达到阈值的段落"""
+    if not skip_confident:
+        return list(texts)
+    return [text for text in texts if not is_clean(text)]
+
+
+def print_skip_report(texts: List[str], skip_confident: bool, label: str = "[Kimi]"):
+    """运行报告：开启跳过校对时，清洁度达到阈值而跳过的段数和需要校对的段数"""
+    if skip_confident:
+        skipped = sum(1 for text in texts if is_clean(text))
+        print(f"{label} 请求校对 {len(texts) - skipped} 段，跳过 {skipped} 段（清洁度 ≥ {skip_score:.2f}）。")
+
+
+def estimate_run(title_texts, proofread_texts, limits=None) -> List[StepEstimate]:
+    """预估标题和校对步骤的请求数、token数和耗时（不调用API），列表为空的步骤跳过"""
+    limits = limits or load_limits()
+    estimates = []
+    for name, texts, estimator in (("标题", title_texts, estimate_title_tokens),
+                                   ("校对", proofread_texts, estimate_proofread_tokens)):
+        if not texts:
+            continue
+        pairs = [estimator(text) for text in texts]
+        estimates.append(estimate_step(name, [p for p, _ in pairs], [c for _, c in pairs],
+                                       limits["rpm"] or ESTIMATE_DEFAULT_RPM, limits["tpm"] or ESTIMATE_DEFAULT_TPM))
+    return estimates
+
+
+MAP_PREFETCH = 4  # map_in_order 排队的调用数为并发数的倍数，慢的调用不会让其他工作线程空等
+
+
+def map_in_order(func, items, workers=1, stop=None):
+    """
+    最多 workers 个调用同时执行 func(item)，按 items 的顺序逐个产出 (item, 结果, 异常)
+    最多提前提交 workers * MAP_PREFETCH 个调用：排在前面的调用较慢时，其他工作线程继续处理后面的
+    stop() 返回 True 后不再发起新的调用，已提交但未开始的调用取消，已开始的照常等待完成
+    """
+    items = list(items)
+    if workers <= 1:
+        for item in items:
+            if stop and stop():
+                return
+            try:
+                yield item, func(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+    # 工作线程以调用方线程命名，时间线中每个线程一条轨道
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{threading.current_thread().name} 请求") as pool:
+        pending = collections.deque()
+        position = 0
+        while True:
+            if stop and stop():
+                # 线程池按提交顺序开始执行，未开始的调用都在队尾
+                while pending and pending[-1][1].cancel():
+                    pending.pop()
+                position = len(items)
+            while position < len(items) and len(pending) < workers * MAP_PREFETCH:
+                pending.append((items[position], pool.submit(func, items[position])))
+                position += 1
+            if not pending:
+                return
+            item, future = pending.popleft()
+            error = future.exception()
+            yield item, None if error else future.result(), error
+
+
+def map_chunks_in_order(func, chunk_counts: List[int], workers=1, stop=None):
+    """
+    段落拆成多块校对时，把所有段落的块展开后一起交给 map_in_order 执行 func(段落序号, 块序号)，
+    长段落的各块并行处理，不会让整个运行等它一段。
+    每段的块全部完成后按段落顺序产出 (段落序号, [各块结果], 异常)，异常为第一个失败块的异常（预算用尽优先）；
+    stop() 返回 True 后未全部完成的段落不产出
+    """
+    items = [(idx, k) for idx, count in enumerate(chunk_counts) for k in range(count)]
+    results, errors = [], []
+    for (idx, k), result, error in map_in_order(lambda item: func(*item), items, workers, stop):
+        if k == 0:
+            results, errors = [], []
+        results.append(result)
+        errors.append(error)
+        if k == chunk_counts[idx] - 1:
+            error = next((e for e in errors if isinstance(e, BudgetExceeded)), None) or \
+                next((e for e in errors if e), None)
+            yield idx, results, error
+
+
+def _retry_budget(budget, limits):
+    """死信重试使用的预算，dead_letter_max_tokens 为 0 且没有运行预算时不限制"""
+    if budget is None and not limits["dead_letter_max_tokens"]:
+        return None
+    return RetryBudget(budget, limits["dead_letter_max_tokens"])
+
+
+def _retry_failed(dead_letters, task, func, budget, limits):
+    """本阶段结束后重试死信队列中 task 类型的条目，func(index, 预算) 返回结果"""
+    if not dead_letters.indices(task):
+        return {}
+    retry_budget = _retry_budget(budget, limits)
+    return retry_dead_letters(dead_letters, task, lambda idx: func(idx, retry_budget),
+                              limits["dead_letter_retries"], limits["dead_letter_backoff_seconds"],
+                              log=lambda msg: print(f"[Kimi] {msg}"))
+
+
+def _stop_reason(exhausted, streak):
+    if exhausted:
+        return str(exhausted[0])
+    return f"连续 {streak[0]} 段请求失败，接口可能不可用（{streak[1]}）"
+
+
+def kimi_generate_titles(text_list, budget=None, existing=None, dead_letters=None, limits=None, backend=None):
     """
     为每段文本单独生成标题，返回标题列表，自动处理速率限制，并输出进度日志。
+    existing 中已有的标题直接沿用；预算用尽后不再发起请求，未完成的条目为 None。
+    单段失败时记入死信队列 dead_letters 并继续，全部段落请求过后按退避间隔重试，仍失败的条目为 None。
+    同时发出的请求数不超过后端的 max_concurrency。
     """
-    titles = []
+    titles = list(existing) if existing else [None] * len(text_list)
     total = len(text_list)
-    for idx, text in enumerate(text_list, 1):
-        print(f"[Kimi] 正在生成第 {idx}/{total} 段标题...")
-        prompt = (
-            "你现在是一个专业的内容标题生成专家。我会给你一些文本片段，请你为每个片段生成标题。\n"
-            "要求：\n"
-            "1. 标题长度：5-15字\n"
-            "2. 风格要求：\n   - 新闻式标题\n   - 简洁明了\n   - 包含核心信息\n   - 避免过于笼统的表述\n"
-            "3. 内容要求：\n   - 准确反映文本主题\n   - 突出重要信息\n   - 保持客观性\n   - 符合上下文连贯性\n"
-            "格式要求：\n- 输入：文本片段\n- 输出：仅返回标题，不需要解释\n"
-            f"请为以下文本生成标题：\n{text}\n"
-        )
-        def call():
-            return client.chat.completions.create(
-                model = model_name,
-                messages = [
-                    {"role": "system", "content": "你是 Kimi，由 Moonshot AI 提供的人工智能助手。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature = 0.6,
-            )
-        completion = kimi_rpm_handle(call)
-        title = completion.choices[0].message.content.strip().split('\n')[0].strip()
-        titles.append(title)
-        print(f"[Kimi] 第 {idx} 段标题生成完成：{title}")
-    print("[Kimi] 所有标题生成完毕。\n")
+    dead_letters = DeadLetterQueue() if dead_letters is None else dead_letters
+    limits = limits or load_limits()
+    backend = backend or get_backend()
+    exhausted = []
+    streak = [0, ""]  # 连续失败的段数和最近一次的原因
+
+    def generate(idx, request_budget=budget):
+        with get_tracer().span("标题", "title", segment=idx + 1):
+            text = text_list[idx]
+            prompt = build_title_prompt(text)
+            prompt_tokens, completion_tokens = estimate_title_tokens(text)
+            print(f"[Kimi] 正在生成第 {idx + 1}/{total} 段标题...")
+            completion = call_with_budget(
+                request_budget, prompt_tokens, completion_tokens,
+                lambda: kimi_rpm_handle(lambda model: backend.complete(model, build_messages(prompt)),
+                                        task=TASK_TITLE, tokens=prompt_tokens + completion_tokens))
+            title = completion.choices[0].message.content.strip().split('\n')[0].strip()
+            if not title:
+                raise ValueError("返回的标题为空")
+            return title
+
+    todo = [idx for idx in range(total) if titles[idx] is None]
+    for idx, title, error in map_in_order(generate, todo, backend.max_concurrency,
+                                          stop=lambda: bool(exhausted) or streak[0] >= MAX_CONSECUTIVE_FAILURES):
+        if isinstance(error, BudgetExceeded):
+            exhausted.append(error)
+            continue
+        if error:
+            attempts = dead_letters.add(TASK_TITLE, idx, error)
+            streak[0] += 1
+            streak[1] = error_message(error)
+            print(f"[Kimi] 第 {idx + 1} 段标题生成失败（已尝试 {attempts} 次），记入死信队列：{error_message(error)}")
+            continue
+        streak[0] = 0
+        dead_letters.remove(TASK_TITLE, idx)
+        titles[idx] = title
+        print(f"[Kimi] 第 {idx + 1} 段标题生成完成：{title}")
+    for idx, title in _retry_failed(dead_letters, TASK_TITLE, generate, budget, limits).items():
+        titles[idx] = title
+        print(f"[Kimi] 第 {idx + 1} 段标题生成完成：{title}")
+    unfinished = sum(1 for idx, title in enumerate(titles) if title is None and not dead_letters.failed(TASK_TITLE, idx))
+    if unfinished and (exhausted or streak[0] >= MAX_CONSECUTIVE_FAILURES):
+        print(f"[Kimi] {_stop_reason(exhausted, streak)}，剩余 {unfinished} 段标题记为待处理。")
+    failed = dead_letters.indices(TASK_TITLE)
+    if failed:
+        print(f"[Kimi] {len(failed)} 段标题重试后仍失败，输出中标注为{FAILED_TITLE}。")
+    if None not in titles:
+        print("[Kimi] 所有标题生成完毕。\n")
     return titles
 
-def kimi_proofread_segments(text_list):
+def kimi_proofread_segments(text_list, on_result=None, budget=None, existing=None, skip_confident=False,
+                            dead_letters=None, limits=None, backend=None, verified=None):
     """
     为每段文本单独校对，返回校对后文本列表，自动处理速率限制，并输出进度日志。
+    校对结果经本地校验，不合格的段落使用更严格的提示词重新请求，多次失败则保留原文。
+    on_result(index, text) 在每段校对完成后按段落顺序立即回调，用于逐段写出结果；
+    请求失败的段落记入死信队列 dead_letters，回调的 text 为 None，后面的段落照常处理。
+    全部段落请求过后按退避间隔重试死信，重试成功的结果只写入返回值，不再回调。
+    existing 中已有的结果直接沿用；预算用尽后不再发起请求，未完成和仍失败的条目为 None。
+    skip_confident 为 True 时，清洁度达到阈值的段落直接使用原文，不发起请求，结束时报告跳过和校对的段数。
+    超过 limits["proofread_chunk_tokens"] 的段落按句子拆成多块，与其他段落的块一起并行校对，完成后按顺序拼接。
+    同时发出的请求数不超过后端的 max_concurrency。
+    verified 为集合时，加入每块都由模型校对、通过校验且有改动的段落编号（跳过校对、保留原文的不加入），
+    只有这些段落的校对结果写入归档供以后沿用。
     """
-    proofread = []
+    proofread = list(existing) if existing else [None] * len(text_list)
     total = len(text_list)
-    for idx, text in enumerate(text_list, 1):
-        print(f"[Kimi] 正在校对第 {idx}/{total} 段正文...")
-        print(f"校对文本：{text}")
-        prompt = (
-            "你现在是一个专业的口播稿校对专家。我将提供一段口播稿，请你对其进行校对。\n\n"
-            "核心原则：\n"
-            "- 严格禁止删除或裁剪任何内容\n"
-            "- 必须保持原文的每一句话\n"
-            "- 禁止对文本进行重写或改写\n"
-            "- 禁止对文本进行总结或精简\n\n"
-            "允许的修改仅限于：\n"
-            "1. 标点符号处理：\n"
-            "   - 在语意完整处添加标点符号\n"
-            "   - 使用常见中文标点（，。；：""《》？！）\n"
-            "2. 错别字修正：\n"
-            "   - 仅修正明确的错别字\n"
-            "   - 保持专有名词的准确性\n\n"
-            "警告：\n"
-            "- 如果输出的文本字数与输入的文本字数（不计标点）不一致，则视为失败\n"
-            "- 除标点和错别字外，严禁改动原文的任何部分\n\n"
-            "请对以下口播稿进行校对，并确保输出的是完整的、未经删减的文本：\n"
-            f"{text}\n"
-        )
+    dead_letters = DeadLetterQueue() if dead_letters is None else dead_letters
+    limits = limits or load_limits()
+    backend = backend or get_backend()
+    skipped = requested = 0
+    exhausted = []
+    streak = [0, ""]
+
+    # 需要请求的段落按 token 上限拆成校对块；已有结果和跳过校对的段落只有一块，直接返回
+    chunk_tokens = limits.get("proofread_chunk_tokens", PROOFREAD_CHUNK_TOKENS)
+    chunks = [[text] if proofread[idx] is not None or (skip_confident and is_clean(text))
+              else split_for_proofread(text, chunk_tokens) for idx, text in enumerate(text_list)]
+
+    def proofread_chunk(idx, k, request_budget=budget):
+        """
+        校对第 idx 段的第 k 块，返回 (结果, 来源)，来源为 existing/skipped/proofread，
+        结果与原文相同（包括多次未通过校验保留原文）时为 unchanged
+        """
+        text = text_list[idx]
+        if proofread[idx] is not None:
+            return proofread[idx], "existing"
+        if skip_confident and is_clean(text):
+            return text, "skipped"
+        chunk = chunks[idx][k]
+        part = f"第 {k + 1}/{len(chunks[idx])} 块" if len(chunks[idx]) > 1 else ""
+        if k == 0:
+            split = f"，分 {len(chunks[idx])} 块并行校对" if part else ""
+            print(f"[Kimi] 正在校对第 {idx + 1}/{total} 段正文{split}...")
+            print(f"校对文本：{text}")
 
-        def call():
-            return client.chat.completions.create(
-                model = model_name,
-                messages = [
-                    {"role": "system", "content": "你是 Kimi，由 Moonshot AI 提供的人工智能助手。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature = 0.6,
-            )
-        completion = kimi_rpm_handle(call)
-        text_out = completion.choices[0].message.content.strip().split('\n')[0].strip()
-        proofread.append(text_out)
-        print(f"[Kimi] 第 {idx} 段正文校对完成：{text_out}")
-        print(f"[Kimi] 第 {idx} 段正文校对完成。")
-    print("[Kimi] 所有正文校对完毕。\n")
+        def request(prompt, failure_reason=None):
+            with get_tracer().span("校对请求", "proofread", segment=idx + 1, retry_reason=failure_reason):
+                prompt_tokens, completion_tokens = estimate_proofread_tokens(chunk, failure_reason)
+                completion = call_with_budget(
+                    request_budget, prompt_tokens, completion_tokens,
+                    lambda: kimi_rpm_handle(lambda model: backend.complete(model, build_messages(prompt)),
+                                            task=TASK_PROOFREAD, tokens=prompt_tokens + completion_tokens))
+                return completion.choices[0].message.content
+
+        with get_tracer().span("校对", "proofread", segment=idx + 1, chunk=k + 1):
+            result = proofread_with_validation(chunk, request,
+                                               log=lambda msg: print(f"[Kimi] 第 {idx + 1} 段{part}{msg}"))
+        return result, "proofread" if result != chunk else "unchanged"
+
+    def stitch(idx, results):
+        """各块的 (结果, 来源) 拼接为整段的 (结果, 来源)，有一块未改动即为 unchanged"""
+        if len(results) == 1:
+            return results[0]
+        text_out = stitch_proofread(text_list[idx], chunks[idx], [text for text, _ in results],
+                                    log=lambda msg: print(f"[Kimi] 第 {idx + 1} 段{msg}"))
+        changed = text_out != text_list[idx] and all(source == "proofread" for _, source in results)
+        return text_out, "proofread" if changed else "unchanged"
+
+    def proofread_one(idx, request_budget=budget):
+        """重试死信时整段重新校对，各块并行"""
+        results = []
+        for _, result, error in map_in_order(lambda k: proofread_chunk(idx, k, request_budget),
+                                             range(len(chunks[idx])), backend.max_concurrency):
+            if error:
+                raise error
+            results.append(result)
+        return stitch(idx, results)
+
+    for idx, results, error in map_chunks_in_order(
+            proofread_chunk, [len(parts) for parts in chunks], backend.max_concurrency,
+            stop=lambda: bool(exhausted) or streak[0] >= MAX_CONSECUTIVE_FAILURES):
+        if isinstance(error, BudgetExceeded):
+            exhausted.append(error)
+            continue
+        if error:
+            attempts = dead_letters.add(TASK_PROOFREAD, idx, error)
+            requested += 1
+            streak[0] += 1
+            streak[1] = error_message(error)
+            print(f"[Kimi] 第 {idx + 1} 段正文校对失败（已尝试 {attempts} 次），记入死信队列：{error_message(error)}")
+            if on_result:
+                on_result(idx, None)
+            continue
+        text_out, source = stitch(idx, results)
+        proofread[idx] = text_out
+        if source != "existing":
+            streak[0] = 0
+            dead_letters.remove(TASK_PROOFREAD, idx)
+        if source == "proofread" and verified is not None:
+            verified.add(idx)
+        if on_result:
+            on_result(idx, text_out)
+        if source == "skipped":
+            skipped += 1
+            print(f"[Kimi] 第 {idx + 1}/{total} 段清洁度 {clean_score(text_out):.2f}，跳过校对。")
+        elif source != "existing":
+            requested += 1
+            print(f"[Kimi] 第 {idx + 1} 段正文校对完成：{text_out}")
+            print(f"[Kimi] 第 {idx + 1} 段正文校对完成。")
+    for idx, (text_out, source) in _retry_failed(dead_letters, TASK_PROOFREAD, proofread_one, budget, limits).items():
+        proofread[idx] = text_out
+        if source == "proofread" and verified is not None:
+            verified.add(idx)
+        print(f"[Kimi] 第 {idx + 1} 段正文校对完成：{text_out}")
+    unfinished = sum(1 for idx, text in enumerate(proofread)
+                     if text is None and not dead_letters.failed(TASK_PROOFREAD, idx))
+    if unfinished and (exhausted or streak[0] >= MAX_CONSECUTIVE_FAILURES):
+        print(f"[Kimi] {_stop_reason(exhausted, streak)}，剩余 {unfinished} 段正文记为待处理。")
+    failed = dead_letters.indices(TASK_PROOFREAD)
+    if failed:
+        print(f"[Kimi] {len(failed)} 段正文重试后仍失败，输出原文并标注{failed_text('')}。")
+    if skip_confident and total > 1:
+        print(f"[Kimi] 请求校对 {requested} 段，跳过 {skipped} 段（清洁度 ≥ {skip_score:.2f}）。")
+    if None not in proofread:
+        print("[Kimi] 所有正文校对完毕。\n")
     return proofread
 
 
+BATCH_ROUNDS = 3  # 批量模式下失败或未通过校验的请求最多提交的轮数（含第一轮）
+BATCH_TASKS = {"t": TASK_TITLE, "p": TASK_PROOFREAD}  # custom_id 中的请求类型
+
+
+def kimi_batch_process(text_lists, batch_client, work_dir, prefix, budget=None, skip_confident=False,
+                       enable_titles=True, enable_proofread=True, poll_seconds=BATCH_POLL_SECONDS, max_batch=0):
+    """
+    批量模式：把一个或多个文件所有段落的标题和校对请求写成批量文件一次提交（每个任务最多 max_batch 个请求，0 为不限），
+    按 custom_id（文件序号-t/p-段落序号）取回结果，只重新提交失败或未通过校验的请求。
+    text_lists 为每个文件的段落正文列表，返回每个文件的 (标题列表, 校对列表)，未完成的条目为 None。
+    校对结果多轮未通过校验时保留原文；请求本身失败或预算用尽的条目保持 None，留待 --resume。
+    """
+    titles = [[None] * len(texts) for texts in text_lists]
+    proofread = [[None] * len(texts) for texts in text_lists]
+    failure_reasons = {}  # 校对 custom_id -> 上一轮未通过校验的原因，重新提交时使用更严格的提示词
+    router = get_router()
+    models = {kind: router.primary(task) for kind, task in BATCH_TASKS.items()}  # 批量模式没有限流，不使用备用模型
+    for f, texts in enumerate(text_lists):
+        for i, text in enumerate(texts):
+            if not enable_titles:
+                titles[f][i] = f"段落{i + 1}"
+            if not enable_proofread or (skip_confident and is_clean(text)):
+                proofread[f][i] = text
+
+    for round_number in range(1, BATCH_ROUNDS + 1):
+        requests, reservations = {}, {}
+        remaining = [(f, kind, i) for f, texts in enumerate(text_lists) for i in range(len(texts))
+                     for kind, done in (("t", titles[f][i]), ("p", proofread[f][i])) if done is None]
+        for f, kind, i in remaining:
+            text = text_lists[f][i]
+            custom_id = f"{f}-{kind}-{i}"
+            if kind == "t":
+                prompt = build_title_prompt(text)
+                prompt_tokens, completion_tokens = estimate_title_tokens(text)
+            else:
+                reason = failure_reasons.get(custom_id)
+                prompt = build_proofread_prompt(text, reason)
+                prompt_tokens, completion_tokens = estimate_proofread_tokens(text, reason)
+            if budget:
+                try:
+                    reservations[custom_id] = budget.check(prompt_tokens + completion_tokens)
+                except BudgetExceeded as e:
+                    print(f"[批量] {e}，其余 {len(remaining) - len(requests)} 个请求记为待处理。")
+                    break
+            requests[custom_id] = build_messages(prompt)
+        if not requests:
+            break
+
+        # 一个批量任务只能使用一个模型，标题和校对的主模型不同时分别提交；超过后端的单次上限时再拆分
+        groups = {}
+        for custom_id, messages in requests.items():
+            groups.setdefault(models[custom_id.split("-")[1]], {})[custom_id] = messages
+        parts = []
+        for model, group in groups.items():
+            ids = list(group)
+            size = max_batch or len(ids)
+            for start in range(0, len(ids), size):
+                parts.append((model, {custom_id: group[custom_id] for custom_id in ids[start:start + size]}))
+        results, errors, stopped = {}, {}, False
+        for part, (model, group) in enumerate(parts, 1):
+            try:
+                with get_tracer().span("批量任务", "batch", round=round_number, part=part, requests=len(group)):
+                    group_results, group_errors = run_batch(
+                        batch_client, group, model,
+                        batch_input_path(work_dir, prefix, round_number, part if len(parts) > 1 else None),
+                        poll_seconds)
+            except BatchFailed as e:
+                print(f"[批量] {e}，未完成的段落记为待处理。")
+                stopped = True
+                continue
+            results.update(group_results)
+            errors.update(group_errors)
+        for custom_id, body in results.items():
+            if custom_id not in requests:
+                continue
+            f, kind, i = custom_id.split("-")
+            f, i = int(f), int(i)
+            text = text_lists[f][i]
+            used = completion_tokens_used(body) or sum(
+                estimate_title_tokens(text) if kind == "t" else estimate_proofread_tokens(text))
+            router.record(BATCH_TASKS[kind], models[kind], used)
+            if budget:
+                budget.charge(used, reservations.pop(custom_id, None))
+            content = completion_content(body)
+            if kind == "t":
+                title = content.strip().split('\n')[0].strip()
+                if title:
+                    titles[f][i] = title
+                else:
+                    errors[custom_id] = "标题为空"
+                continue
+            result, reason = check_proofread_output(text, content)
+            if reason is None:
+                proofread[f][i] = result
+            else:
+                failure_reasons[custom_id] = reason
+                errors[custom_id] = f"校对结果未通过校验：{reason}"
+        if budget:
+            # 没有取回结果的请求（任务失败、过期）退回预留
+            for reservation in reservations.values():
+                budget.release(reservation)
+        for custom_id, error in sorted(errors.items())[:MAX_PARSE_WARNINGS_SHOWN]:
+            print(f"[批量] {custom_id} 失败：{error}")
+        if errors:
+            print(f"[批量] 第 {round_number} 轮共 {len(errors)} 个请求失败"
+                  f"{'，重新提交' if round_number < BATCH_ROUNDS else ''}")
+        else:
+            break
+        if stopped:
+            break
+
+    # 与逐条模式一致：校对多次未通过校验的段落保留原文
+    for custom_id in failure_reasons:
+        f, _, i = custom_id.split("-")
+        f, i = int(f), int(i)
+        if proofread[f][i] is None:
+            proofread[f][i] = text_lists[f][i]
+            print(f"[批量] 文件 {f + 1} 第 {i + 1} 段多次校对未通过校验，保留原文")
+    return [list(pair) for pair in zip(titles, proofread)]
+
+
+# 校对结果校验：去掉标点和空白后与原文比较，编辑距离超过上限视为失败
+PROOFREAD_MAX_EDIT_RATIO = 0.05
+PROOFREAD_MIN_EDIT_ALLOWANCE = 2
+PROOFREAD_RETRIES = 2
+
+# 拆分校对块的断点：先按句末标点，单句仍过长时按分句标点或字幕之间的空格
+_SENTENCE_BREAK_RE = re.compile(r"[。！？!?…]+[”’」』）)]*\s*|\.\s+")
+_CLAUSE_BREAK_RE = re.compile(r"[，；：、,;:]\s*|\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[，。！？；：、,.!?;:…]+$")
+_LEADING_PUNCT_RE = re.compile(r"^[，。！？；：、,.!?;:…]+")
+
+_PUNCT_RE = re.compile(
+    r"[\s!-/:-@\[-`{-~\u00a0-\u00bf\u2000-\u206f\u3000-\u303f"
+    r"\uff00-\uff0f\uff1a-\uff20\uff3b-\uff40\uff5b-\uff65\ufe10-\ufe6f]"
+)
+
+
+# 模型常附加的说明文字：开头的“以下是校对后的文本：”及结尾的“注：……”
+_LEADING_COMMENTARY_RE = re.compile(
+    r"^(?:好的[，,]?)?(?:以下是|下面是|这是)?(?:校对|修改|修正)(?:后|过)?的?(?:文本|结果|内容|正文|口播稿)?[:：]\s*"
+)
+_TRAILING_COMMENTARY_RE = re.compile(r"^[（(]?(?:注|说明|备注|修改说明)[:：]")
+
+
+def build_title_prompt(text: str) -> str:
+    """标题生成提示词"""
+    return (
+        "你现在是一个专业的内容标题生成专家。我会给你一些文本片段，请你为每个片段生成标题。\n"
+        "要求：\n"
+        "1. 标题长度：5-15字\n"
+        "2. 风格要求：\n   - 新闻式标题\n   - 简洁明了\n   - 包含核心信息\n   - 避免过于笼统的表述\n"
+        "3. 内容要求：\n   - 准确反映文本主题\n   - 突出重要信息\n   - 保持客观性\n   - 符合上下文连贯性\n"
+        "格式要求：\n- 输入：文本片段\n- 输出：仅返回标题，不需要解释\n"
+        f"请为以下文本生成标题：\n{text}\n"
+    )
+
+
+def build_proofread_prompt(text: str, failure_reason: str = None) -> str:
+    """
+    校对提示词
+    failure_reason 非空时生成更严格的提示词，用于重新请求未通过校验的段落
+    """
+    prompt = (
+        "你现在是一个专业的口播稿校对专家。我将提供一段口播稿，请你对其进行校对。\n\n"
+        "核心原则：\n"
+        "- 严格禁止删除或裁剪任何内容\n"
+        "- 必须保持原文的每一句话\n"
+        "- 禁止对文本进行重写或改写\n"
+        "- 禁止对文本进行总结或精简\n\n"
+        "允许的修改仅限于：\n"
+        "1. 标点符号处理：\n"
+        "   - 在语意完整处添加标点符号\n"
+        "   - 使用常见中文标点（，。；：""《》？！）\n"
+        "2. 错别字修正：\n"
+        "   - 仅修正明确的错别字\n"
+        "   - 保持专有名词的准确性\n\n"
+        "警告：\n"
+        "- 如果输出的文本字数与输入的文本字数（不计标点）不一致，则视为失败\n"
+        "- 除标点和错别字外，严禁改动原文的任何部分\n\n"
+    )
+    if failure_reason:
+        prompt += (
+            f"注意：上一次的校对结果未通过校验（{failure_reason}）。\n"
+            "本次请严格遵守：\n"
+            "- 只输出校对后的正文本身，不要添加任何说明、标题、引号或前后缀\n"
+            "- 不要换行，不要分段\n"
+            "- 逐字保留原文，只允许增加标点和修正明确的错别字\n\n"
+        )
+    prompt += (
+        "请对以下口播稿进行校对，并确保输出的是完整的、未经删减的文本：\n"
+        f"{text}\n"
+    )
+    return prompt
+
+
+def prompt_version() -> str:
+    """标题和校对提示词（含系统提示词）的摘要，记入归档；提示词改动后此前的结果不再沿用"""
+    templates = [KIMI_SYSTEM_PROMPT, build_title_prompt("{text}"), build_proofread_prompt("{text}"),
+                 build_proofread_prompt("{text}", "{reason}")]
+    return text_digest("\n".join(templates))[:16]
+
+
+def strip_punctuation(text: str) -> str:
+    """去掉标点符号和空白，用于比较校对前后的正文"""
+    return _PUNCT_RE.sub('', text)
+
+
+def bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    计算编辑距离，只在宽度为 limit 的对角带内计算
+    超过 limit 时直接返回 limit + 1
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+    over = limit + 1
+    prev = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        lo = max(1, i - limit)
+        hi = min(len(b), i + limit)
+        cur = [over] * (len(b) + 1)
+        cur[0] = i if i <= limit else over
+        ca = a[i - 1]
+        row_min = cur[0] if lo == 1 else over
+        for j in range(lo, hi + 1):
+            cost = prev[j - 1] + (ca != b[j - 1])
+            if prev[j] + 1 < cost:
+                cost = prev[j] + 1
+            if cur[j - 1] + 1 < cost:
+                cost = cur[j - 1] + 1
+            cur[j] = cost if cost <= limit else over
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return over
+        prev = cur
+    return prev[len(b)]
+
+
+def _join_lines(lines: List[str]) -> str:
+    """拼接多行输出，只在英文单词之间保留空格"""
+    result = ''
+    for line in lines:
+        if result and result[-1].isascii() and result[-1].isalnum() and line[0].isascii() and line[0].isalnum():
+            result += ' '
+        result += line
+    return result
+
+
+def validate_proofread(original: str, result: str) -> str:
+    """
+    校验校对结果，通过返回 None，否则返回失败原因
+    去掉标点后与原文比较：检测截断、改写以及附加的说明文字
+    """
+    src = strip_punctuation(original)
+    out = strip_punctuation(result)
+    if not out:
+        return "输出为空"
+    limit = max(PROOFREAD_MIN_EDIT_ALLOWANCE, int(len(src) * PROOFREAD_MAX_EDIT_RATIO))
+    if len(out) < len(src) - limit:
+        return f"内容被截断（{len(out)}/{len(src)}字）"
+    if len(out) > len(src) + limit:
+        return f"附加了原文以外的内容（{len(out)}/{len(src)}字）"
+    distance = bounded_edit_distance(src, out, limit)
+    if distance > limit:
+        return f"内容被改写（差异超过{limit}字）"
+    return None
+
+
+def check_proofread_output(original: str, content: str):
+    """
+    从模型返回内容中提取校对正文并校验
+    返回 (正文, 失败原因)，校验通过时失败原因为 None
+    """
+    lines = [line.strip() for line in (content or '').strip().split('\n') if line.strip()]
+    src = strip_punctuation(original)
+    # 原文本身就以“修改：”之类开头或以“注：”结尾时不能当作说明文字去掉
+    if lines:
+        match = _LEADING_COMMENTARY_RE.match(lines[0])
+        if match and not src.startswith(strip_punctuation(match.group())):
+            lines[0] = lines[0][match.end():]
+    while (len(lines) > 1 and _TRAILING_COMMENTARY_RE.match(lines[-1])
+           and strip_punctuation(lines[-1]) not in src):
+        lines.pop()
+    lines = [line for line in lines if line]
+    result = _join_lines(lines)
+    reason = validate_proofread(original, result)
+    if reason is None or len(lines) < 2:
+        return result, reason
+    # 多行输出时，说明文字和正文通常分行，尝试找出唯一通过校验的那一行
+    passed = [line for line in lines if validate_proofread(original, line) is None]
+    if len(passed) == 1:
+        return passed[0], None
+    return result, reason
+
+
+def proofread_with_validation(text: str, request, log=print) -> str:
+    """
+    校对单段文本，request(prompt, failure_reason) 返回模型输出内容
+    校验失败时使用更严格的提示词重新请求，仍失败则保留原文
+    """
+    reason = None
+    for attempt in range(PROOFREAD_RETRIES + 1):
+        content = request(build_proofread_prompt(text, reason), reason)
+        result, reason = check_proofread_output(text, content)
+        if reason is None:
+            return result
+        log(f"校对结果未通过校验：{reason}（第 {attempt + 1} 次）")
+    log("多次校对未通过校验，保留原文")
+    return text
+
+
+
+def _split_after(text: str, pattern) -> List[str]:
+    """在 pattern 的每个匹配之后切开，各部分依次拼接即为原文"""
+    pieces, start = [], 0
+    for match in pattern.finditer(text):
+        if match.end() > start:
+            pieces.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+def split_for_proofread(text: str, max_tokens: int = PROOFREAD_CHUNK_TOKENS) -> List[str]:
+    """
+    把过长的段落拆成不超过 max_tokens 的校对块，各块依次拼接即为原文
+    优先在句末标点处断开，单句过长时在分句标点或字幕之间的空格处断开，仍过长的片段按字数切开；
+    块数确定后按平均大小装块，各块的校对耗时相近。max_tokens 为 0 或段落不超过上限时不拆分
+    """
+    total = count_tokens(text)
+    if max_tokens <= 0 or total <= max_tokens:
+        return [text]
+    target = -(-total // -(-total // max_tokens))  # 按块数平均后的每块 token 数
+    pieces = []
+    for sentence in _split_after(text, _SENTENCE_BREAK_RE):
+        if count_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        for clause in _split_after(sentence, _CLAUSE_BREAK_RE):
+            tokens = count_tokens(clause)
+            if tokens <= max_tokens:
+                pieces.append(clause)
+                continue
+            size = max(1, len(clause) * target // tokens)
+            pieces.extend(clause[i:i + size] for i in range(0, len(clause), size))
+    chunks, current, current_tokens = [], "", 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and (current_tokens + tokens > max_tokens or current_tokens >= target):
+            chunks.append(current)
+            current, current_tokens = "", 0
+        current += piece
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def stitch_proofread(text: str, chunks: List[str], results: List[str], log=print) -> str:
+    """
+    按顺序拼接各块的校对结果，并检查块之间的边界：
+    - 原文块尾的标点保持原样（模型只看到半句时常把逗号改成句号）；在空格处切开时模型补的标点只留一个，
+      在词中间切开时去掉模型补的标点
+    - 前一块以标点结尾时，去掉后一块开头多出的标点
+    - 中文之间不留空格，英文单词之间保留空格
+    拼接结果整体再校验一次，未通过时保留原文
+    """
+    parts = []
+    for i, (chunk, result) in enumerate(zip(chunks, results)):
+        result = result.strip()
+        if i < len(chunks) - 1:
+            original_end = _TRAILING_PUNCT_RE.search(chunk.rstrip())
+            if original_end:
+                result = _TRAILING_PUNCT_RE.sub("", result) + original_end.group()
+            elif chunk[-1:].isspace():
+                # 在字幕之间的空格处切开：模型补的标点可以保留，但只留一个
+                result = _TRAILING_PUNCT_RE.sub(lambda match: match.group()[0], result)
+            else:
+                result = _TRAILING_PUNCT_RE.sub("", result)
+        if parts and _TRAILING_PUNCT_RE.search(parts[-1]) and not _LEADING_PUNCT_RE.match(chunk.lstrip()):
+            result = _LEADING_PUNCT_RE.sub("", result)
+        parts.append(result)
+    stitched = join_punctuated(parts)
+    reason = validate_proofread(text, stitched)
+    if reason:
+        log(f"分块校对拼接后未通过校验：{reason}，保留原文")
+        return text
+    return stitched
+
 
 # 主要数据结构和类型说明
 class SubtitleItem:
@@ -131,40 +1034,260 @@ class SubtitleItem:
 
 
 class MergedSegment:
-    def __init__(self, time: str, text: str):
+    def __init__(self, time: str, text: str, start_ms: int = 0, end_ms: int = 0):
         self.time = time
         self.text = text
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+
+# SRT 编码识别：先看 BOM，再按内容推测
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+ENCODING_SAMPLE_SIZE = 64 * 1024
+MAX_PARSE_WARNINGS_SHOWN = 20
+PARSE_WARNINGS_PER_KIND = 3  # 同类警告只列出前几处，其余汇总为一条
+
+# 时间行：允许 . 或 , 作为毫秒分隔符、省略小时或毫秒，以及行尾的位置参数；前一行的纯数字为序号
+# 两段时间（如 01:02）视为 分:秒，三段视为 时:分:秒
+_SRT_TIME = r"((?:\d{1,3}:)?\d{1,2}:\d{1,2}(?:[,.]\d{1,3})?)"
+_SRT_CUE_RE = re.compile(
+    rf"^(?:[ \t]*(\d+)[ \t]*\r?\n)?[ \t]*{_SRT_TIME}[ \t]*-->[ \t]*{_SRT_TIME}[^\n]*$",
+    re.M,
+)
+_SRT_TIME_PARTS_RE = re.compile(r"(?:(\d+):)?(\d+):(\d+)(?:[,.](\d+))?")
+# 标准字幕块：序号行、标准时间轴行、若干非空正文行
+_SRT_FAST_CUE_RE = re.compile(
+    r"^[ \t]*(\d+)[ \t]*\n(\d\d:\d\d:\d\d,\d\d\d) --> (\d\d:\d\d:\d\d,\d\d\d)[^\n]*\n"
+    r"((?:[ \t]*\S[^\n]*(?:\n|\Z))*)",
+    re.M,
+)
+# 形似时间轴但无法解析的行，如 "00:00:06,000 -> 00:00:07,000"
+_SRT_BAD_TIMING_RE = re.compile(r"-->|\d:\d{1,2}[,.:]?\d*\s*-+>")
+
+
+def detect_encoding(data) -> str:
+    """
+    识别SRT文件编码，返回可用于解码的编码名
+    BOM 优先；没有 BOM 时根据零字节分布判断 UTF-16，再依次尝试 UTF-8 和 GB18030（兼容GBK）
+    """
+    head = bytes(data[:4])
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    sample = bytes(data[:ENCODING_SAMPLE_SIZE])
+    if len(sample) >= 2:
+        even_zeros = sample[0::2].count(0)
+        odd_zeros = sample[1::2].count(0)
+        half = len(sample) // 2
+        if odd_zeros > half * 0.3 and even_zeros < half * 0.05:
+            return 'utf-16-le'
+        if even_zeros > half * 0.3 and odd_zeros < half * 0.05:
+            return 'utf-16-be'
+    try:
+        # 截断处可能落在多字节字符中间，只要错误位置在末尾就视为 UTF-8
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        if len(sample) == ENCODING_SAMPLE_SIZE and e.start >= len(sample) - 3:
+            return 'utf-8'
+    try:
+        sample.decode('gb18030')
+        return 'gb18030'
+    except UnicodeDecodeError:
+        return 'utf-8'
+
+
+@traced("read_srt")
+def read_srt_text(file_path: str):
+    """
+    读取SRT文件并自动识别编码，返回 (文本, 编码名)
+    通过 mmap 直接解码，不额外复制整个文件
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return '', 'utf-8'
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            encoding = detect_encoding(mm)
+            try:
+                text = codecs.decode(memoryview(mm), encoding)
+            except UnicodeDecodeError:
+                if encoding != 'utf-8':
+                    raise
+                # 推测为 UTF-8 但后段出现非法字节时改用 GB18030，仍失败则替换非法字符
+                try:
+                    text, encoding = codecs.decode(memoryview(mm), 'gb18030'), 'gb18030'
+                except UnicodeDecodeError:
+                    text = codecs.decode(memoryview(mm), 'utf-8', 'replace')
+    return text.lstrip('\ufeff'), encoding
+
 
 def read_srt(file_path: str) -> List[str]:
-    """读取SRT文件，返回原始文本行列表"""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return f.readlines()
-
-def parse_srt(srt_lines: List[str]) -> List[SubtitleItem]:
-    """解析SRT格式，返回结构化的字幕数据"""
-    items = []
-    idx = 0
-    while idx < len(srt_lines):
-        line = srt_lines[idx].strip()
-        if line.isdigit():
-            index = int(line)
-            idx += 1
-            if idx >= len(srt_lines): break
-            time_line = srt_lines[idx].strip()
-            if '-->' not in time_line:
-                idx += 1
-                continue
-            start_time, end_time = [t.strip() for t in time_line.split('-->')]
-            idx += 1
-            text_lines = []
-            while idx < len(srt_lines) and srt_lines[idx].strip() != '':
-                text_lines.append(srt_lines[idx].strip())
-                idx += 1
-            text = ' '.join(text_lines)
-            items.append(SubtitleItem(index, start_time, end_time, text))
-        idx += 1
+    """读取SRT文件（自动识别编码），返回原始文本行列表"""
+    return read_srt_text(file_path)[0].splitlines(keepends=True)
+
+
+def _normalize_srt_time(value: str):
+    """统一为 HH:MM:SS,mmm；标准格式直接返回，无法识别时返回 None"""
+    if len(value) == 12 and value[2] == ':' and value[5] == ':' and value[8] == ',':
+        return value
+    match = _SRT_TIME_PARTS_RE.fullmatch(value)
+    if not match:
+        return None
+    hours, minutes, seconds, millis = match.groups()
+    millis = (millis or '0').ljust(3, '0')[:3]
+    return f"{int(hours or 0):02d}:{int(minutes):02d}:{int(seconds):02d},{millis}"
+
+
+def _has_millis(value: str) -> bool:
+    return ',' in value or '.' in value
+
+
+def _split_timing(line: str):
+    """拆分时间轴行，返回 (开始, 结束)，格式错误时返回 (None, None)"""
+    start, _, end = line.partition('-->')
+    end = end.strip()
+    space = end.find(' ')
+    if space >= 0:
+        end = end[:space]  # 行尾的位置参数
+    return _normalize_srt_time(start.strip()), _normalize_srt_time(end)
+
+
+class _SrtParseState:
+    """解析过程中的共享状态"""
+    __slots__ = ("text", "items", "warnings", "prev_index", "kind_counts", "newlines")
+
+    def __init__(self, text: str, warnings: List[str]):
+        self.text = text
+        self.items = []
+        self.warnings = warnings
+        self.prev_index = 0
+        self.kind_counts = {}
+        self.newlines = None
+
+    def warn(self, pos: int, kind: str, detail: str = ""):
+        """记录警告，同类警告只保留前 PARSE_WARNINGS_PER_KIND 条"""
+        count = self.kind_counts.get(kind, 0) + 1
+        self.kind_counts[kind] = count
+        if count > PARSE_WARNINGS_PER_KIND:
+            return
+        if self.newlines is None:
+            # 第一次警告时才建立换行位置表，之后按二分查找计算行号
+            self.newlines = [m.start() for m in re.finditer('\n', self.text)]
+        line = bisect.bisect_left(self.newlines, pos) + 1
+        self.warnings.append(f"第{line}行: {kind}{'：' + detail if detail else ''}")
+
+    def finish(self):
+        for kind, count in self.kind_counts.items():
+            if count > PARSE_WARNINGS_PER_KIND:
+                self.warnings.append(f"“{kind}”共 {count} 处，仅列出前 {PARSE_WARNINGS_PER_KIND} 处")
+
+    def add(self, pos: int, index_str, start_time: str, end_time: str, text_lines: List[str]):
+        index = int(index_str) if index_str else self.prev_index + 1
+        if not index_str:
+            self.warn(pos, "字幕块缺少序号")
+        elif index != self.prev_index + 1:
+            self.warn(pos, "序号不连续", f"{self.prev_index} -> {index}")
+        self.prev_index = index
+        if not text_lines:
+            self.warn(pos, "字幕没有文本，已跳过", f"第{index}条")
+            return
+        # 统一格式后的时间字符串等宽，可直接比较
+        if end_time < start_time:
+            self.warn(pos, "结束时间早于开始时间", f"第{index}条")
+        self.items.append(SubtitleItem(index, start_time, end_time, ' '.join(text_lines)))
+
+
+@traced("parse_srt")
+def parse_srt(srt_lines, warnings: List[str] = None, prev_index: int = 0) -> List[SubtitleItem]:
+    """
+    解析SRT格式，返回结构化的字幕数据
+    srt_lines 可以是行列表或完整文本。标准字幕块由一个正则单次扫描识别；
+    两个标准字幕块之间多出的内容（缺少空行、缺少序号、时间格式不规范等）交给慢速路径逐行识别。
+    warnings 不为 None 时，解析中发现的问题会追加到该列表
+    prev_index 为前一条字幕的序号，分段解析（跟随模式）时用于检查序号是否连续
+    """
+    if isinstance(srt_lines, str):
+        text = srt_lines
+    else:
+        text = ''.join(line if line.endswith('\n') else line + '\n' for line in srt_lines)
+    text = text.lstrip('\ufeff')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    state = _SrtParseState(text, warnings if warnings is not None else [])
+    state.prev_index = prev_index
+    items = state.items
+
+    prev_end = 0
+    for match in _SRT_FAST_CUE_RE.finditer(text):
+        start = match.start()
+        if start - prev_end > 1 and text[prev_end:start].strip():
+            _parse_srt_region(state, text[prev_end:start], prev_end)
+        prev_end = match.end()
+        index_str, start_time, end_time, body = match.groups()
+        if '-->' in body:
+            # 下一条字幕前缺少空行，被并入了正文
+            _parse_srt_region(state, text[start:prev_end], start)
+            continue
+        index = int(index_str)
+        body = body.strip()
+        if not body or index != state.prev_index + 1 or end_time < start_time:
+            state.add(start, index_str, start_time, end_time, [line.strip() for line in body.split('\n') if line.strip()])
+            continue
+        state.prev_index = index
+        if '\n' in body:
+            body = ' '.join(line.strip() for line in body.split('\n') if line.strip())
+        items.append(SubtitleItem(index, start_time, end_time, body))
+    if text[prev_end:].strip():
+        _parse_srt_region(state, text[prev_end:], prev_end)
+    state.finish()
     return items
 
+
+def _parse_srt_region(state: _SrtParseState, block: str, pos: int):
+    """慢速路径：在字幕块内用正则定位所有时间轴行"""
+    matches = list(_SRT_CUE_RE.finditer(block))
+    if not matches:
+        if _SRT_BAD_TIMING_RE.search(block):
+            state.warn(pos, "无法解析的时间轴行，该字幕块已跳过", block.strip().splitlines()[0])
+        elif state.items:
+            # 字幕正文中间多出的空行：并入上一条字幕
+            extra = ' '.join(line.strip() for line in block.split('\n') if line.strip())
+            state.items[-1].text += ' ' + extra
+            state.warn(pos, "字幕块中间有空行，之后的内容已并入上一条字幕")
+        else:
+            state.warn(pos, "第一条字幕之前有无法识别的内容，已忽略")
+        return
+    if block[:matches[0].start()].strip():
+        state.warn(pos, "时间轴行之前有无法识别的内容，已忽略")
+    for n, match in enumerate(matches):
+        index_str, start_raw, end_raw = match.groups()
+        start_time, end_time = _split_timing(f"{start_raw} --> {end_raw}")
+        if not _has_millis(start_raw) or not _has_millis(end_raw):
+            state.warn(pos + match.start(), "时间缺少毫秒，按 .000 处理（两段时间按 分:秒 理解）",
+                       f"{start_raw} --> {end_raw}")
+        body_end = matches[n + 1].start() if n + 1 < len(matches) else len(block)
+        text_lines = []
+        skipping = False
+        for line in block[match.end():body_end].split('\n'):
+            line = line.strip()
+            if not line or skipping:
+                continue
+            if '>' in line and _SRT_BAD_TIMING_RE.search(line):
+                # 时间轴行格式错误：之后的内容属于无法解析的字幕块，连同已被当作正文的序号行一起跳过
+                state.warn(pos + match.end(), "无法解析的时间轴行，该字幕块已跳过", line)
+                if text_lines and text_lines[-1].isdigit():
+                    text_lines.pop()
+                skipping = True
+                continue
+            text_lines.append(line)
+        state.add(pos + match.start(), index_str, start_time, end_time, text_lines)
+
+
 def convert_time_format(time_str: str) -> str:
     """
     将SRT时间格式转换为目标格式
@@ -176,30 +1299,502 @@ def convert_time_format(time_str: str) -> str:
     return f"{int(h):02d}:{int(m):02d}:{int(s):02d}"
 
 
-def merge_subtitles(subtitles: List[SubtitleItem], target_length: int = 500) -> List[MergedSegment]:
+def srt_time_to_ms(time_str: str) -> int:
+    """
+    将SRT时间转换为毫秒
+    输入: "00:01:02,500"
+    输出: 62500
+    """
+    h, m, s_ms = time_str.strip().split(":")
+    s, _, ms = s_ms.replace(".", ",").partition(",")
+    return ((int(h) * 60 + int(m)) * 60 + int(s)) * 1000 + int(ms or 0)
+
+
+@traced("prepunctuate_subtitles")
+def prepunctuate_subtitles(subtitles: List[SubtitleItem], comma_gap_ms: int = DEFAULT_COMMA_GAP_MS,
+                           period_gap_ms: int = DEFAULT_PERIOD_GAP_MS) -> List[SubtitleItem]:
+    """按相邻字幕的停顿加标点，返回新的字幕列表（原列表不变），合并时应使用 punctuated=True"""
+    ends = [srt_time_to_ms(item.end_time) for item in subtitles]
+    gaps = [srt_time_to_ms(nxt.start_time) - end for end, nxt in zip(ends, subtitles[1:])]
+    texts, added = prepunctuate([item.text for item in subtitles], gaps, comma_gap_ms, period_gap_ms)
+    print(f"[标点] 按字幕间隔添加了 {added} 个标点")
+    return [SubtitleItem(item.index, item.start_time, item.end_time, text) for item, text in zip(subtitles, texts)]
+
+
+@traced("merge_subtitles")
+def merge_subtitles(subtitles: List[SubtitleItem], target_length: int = 500, punctuated: bool = False) -> List[MergedSegment]:
     """
     合并字幕文本到指定长度
+    punctuated 为 True 时字幕已加标点，中文之间不再插入空格
     返回: 包含时间戳和合并文本的列表
     """
+    join = join_punctuated if punctuated else ' '.join
     segments = []
     buffer = []
     buffer_len = 0
     start_time = None
+    start_ms = end_ms = 0
     for item in subtitles:
         if not buffer:
             start_time = convert_time_format(item.start_time)
+            start_ms = srt_time_to_ms(item.start_time)
         buffer.append(item.text)
         buffer_len += len(item.text)
+        end_ms = srt_time_to_ms(item.end_time)
         if buffer_len >= target_length:
-            merged_text = ' '.join(buffer)
-            segments.append(MergedSegment(start_time, merged_text))
+            merged_text = join(buffer)
+            segments.append(MergedSegment(start_time, merged_text, start_ms, end_ms))
             buffer = []
             buffer_len = 0
     if buffer:
-        merged_text = ' '.join(buffer)
-        segments.append(MergedSegment(start_time, merged_text))
+        merged_text = join(buffer)
+        segments.append(MergedSegment(start_time, merged_text, start_ms, end_ms))
+    return segments
+
+def _merged_segment(items: List[SubtitleItem], punctuated: bool) -> MergedSegment:
+    join = join_punctuated if punctuated else ' '.join
+    return MergedSegment(convert_time_format(items[0].start_time), join([item.text for item in items]),
+                         srt_time_to_ms(items[0].start_time), srt_time_to_ms(items[-1].end_time))
+
+
+@traced("topic_merge_subtitles")
+def topic_merge_subtitles(subtitles: List[SubtitleItem], target_length: int = 500, punctuated: bool = False,
+                          min_length: int = 0, max_length: int = 0) -> List[MergedSegment]:
+    """
+    按话题切分字幕（见 segmentation.py），每段字数在 min_length 与 max_length 之间
+    min_length/max_length 为 0 时取 target_length 的 0.5/2 倍
+    """
+    if not subtitles:
+        return []
+    min_length = min_length or int(target_length * MIN_LENGTH_RATIO)
+    max_length = max(max_length or int(target_length * MAX_LENGTH_RATIO), min_length)
+    starts = topic_boundaries([item.text for item in subtitles],
+                              [srt_time_to_ms(item.start_time) for item in subtitles],
+                              [srt_time_to_ms(item.end_time) for item in subtitles], min_length, max_length)
+    ends = starts[1:] + [len(subtitles)]
+    return [_merged_segment(subtitles[start:end], punctuated) for start, end in zip(starts, ends)]
+
+
+def segment_subtitles(subtitles: List[SubtitleItem], target_length: int = 500, punctuated: bool = False,
+                      segmentation_options: dict = None) -> List[MergedSegment]:
+    """按配置的分段方式合并字幕，segmentation_options 为 load_segmentation_options() 的结果，默认按长度合并"""
+    options = segmentation_options or {}
+    if options.get("segmenter", "length") == "topic":
+        return topic_merge_subtitles(subtitles, target_length, punctuated,
+                                     options.get("topic_min_length", 0), options.get("topic_max_length", 0))
+    return merge_subtitles(subtitles, target_length=target_length, punctuated=punctuated)
+
+class SrtTail:
+    """
+    跟随模式：读取持续追加的SRT文件中新增的完整字幕块
+    只解析到最后一个空行为止，写了一半的字幕块留到下次读取；文件变短（被截断或重新开始）时从头读取
+    """
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.offset = 0
+        self.encoding = None
+        self.prev_index = 0
+        self._decoder = None
+        self._pending = ''
+        self._raw = b''
+
+    def read(self, final: bool = False, warnings: List[str] = None) -> List[SubtitleItem]:
+        """返回新增的字幕；final 为 True 时（直播结束）最后一个没有空行结尾的字幕块也一并解析"""
+        try:
+            size = os.path.getsize(self.file_path)
+        except OSError:
+            return []
+        if size < self.offset:
+            print(f"[跟随] {self.file_path} 变短了，从头重新读取")
+            self.offset, self.encoding, self._decoder, self._pending, self._raw = 0, None, None, '', b''
+        if size > self.offset:
+            with open(self.file_path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read(size - self.offset)
+            self.offset = size
+            if self._decoder is None:
+                # 纯 ASCII 的内容各编码解码结果相同，出现非 ASCII 字节后再识别编码，
+                # 并且只用到最后一个换行为止的完整内容识别
+                self._raw += data
+                if self._raw.isascii() and b'\x00' not in self._raw:
+                    self._pending += self._raw.decode('ascii')
+                    self._raw = b''
+                    data = b''
+                else:
+                    newline = self._raw.rfind(b'\n')
+                    sample = self._raw[:newline + 1] if newline >= 0 else self._raw
+                    if not final and (newline < 0 or sample.isascii()):
+                        return []
+                    self.encoding = detect_encoding(sample)
+                    self._decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+                    data, self._raw = self._raw, b''
+            if self._decoder is not None:
+                self._pending += self._decoder.decode(data, final=final)
+        elif final and self._decoder is not None:
+            self._pending += self._decoder.decode(b'', final=True)
+        text = self._pending
+        held = ''
+        if not final and text.endswith('\r'):
+            # \r\n 可能被分在两次读取中，末尾的 \r 留到下次
+            text, held = text[:-1], '\r'
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if final:
+            complete, self._pending = text, ''
+        else:
+            end = text.rfind('\n\n')
+            if end < 0:
+                self._pending = text + held
+                return []
+            complete, self._pending = text[:end + 2], text[end + 2:] + held
+        if not complete.strip():
+            return []
+        items = parse_srt(complete, warnings, prev_index=self.prev_index)
+        if items:
+            self.prev_index = items[-1].index
+        return items
+
+
+class LiveMerger:
+    """
+    跟随模式的段落合并：与 merge_subtitles 的切分规则相同，另外在长停顿处提前结束段落
+    达到目标长度的段落在下一条字幕到来时结束（以便按停顿给最后一条加标点），
+    没有新字幕时最多等待 READY_HOLD_SECONDS；任何字幕从读到到段落结束不超过 max_latency 秒
+    punctuate 为 (逗号停顿, 句号停顿) 毫秒时按停顿加标点，为 None 时与 merge_subtitles 相同用空格连接
+    """
+    READY_HOLD_SECONDS = 5.0
+
+    def __init__(self, target_length: int = 500, pause_ms: int = 3000, max_latency: float = 120.0, punctuate=None):
+        self.target_length = target_length
+        self.pause_ms = pause_ms
+        self.max_latency = max_latency
+        self.punctuate = punctuate
+        self.buffer: List[SubtitleItem] = []
+        self.buffer_len = 0
+        self.first_seen = 0.0  # 段落第一条字幕读到的时间
+        self.last_seen = 0.0
+
+    def add(self, item: SubtitleItem, now: float = None) -> List[MergedSegment]:
+        """加入一条新字幕，返回因此结束的段落"""
+        now = time.time() if now is None else now
+        done = []
+        if self.buffer:
+            gap = srt_time_to_ms(item.start_time) - srt_time_to_ms(self.buffer[-1].end_time)
+            if self.punctuate:
+                last = self.buffer[-1]
+                mark = gap_punctuation(last.text, gap, *self.punctuate)
+                self.buffer[-1] = SubtitleItem(last.index, last.start_time, last.end_time, last.text + mark)
+                self.buffer_len += len(mark)
+            if self.buffer_len >= self.target_length or (self.pause_ms and gap >= self.pause_ms):
+                done.append(self._finish(close=False))
+        if not self.buffer:
+            self.first_seen = now
+        if self.punctuate:
+            item = SubtitleItem(item.index, item.start_time, item.end_time, replace_pause_spaces(item.text)[0])
+        self.buffer.append(item)
+        self.buffer_len += len(item.text)
+        self.last_seen = now
+        return done
+
+    def due(self, now: float = None) -> List[MergedSegment]:
+        """按等待时间结束段落：达到目标长度后等待超过 READY_HOLD_SECONDS，或第一条字幕已等待超过 max_latency"""
+        now = time.time() if now is None else now
+        if not self.buffer:
+            return []
+        ready = self.buffer_len >= self.target_length and now - self.last_seen >= self.READY_HOLD_SECONDS
+        if ready or (self.max_latency and now - self.first_seen >= self.max_latency):
+            return [self._finish(close=True)]
+        return []
+
+    def flush(self) -> List[MergedSegment]:
+        """直播结束，输出剩余内容"""
+        return [self._finish(close=True)] if self.buffer else []
+
+    def _finish(self, close: bool) -> MergedSegment:
+        items = self.buffer
+        if close and self.punctuate:
+            # 没有下一条字幕可以判断停顿，按句末处理
+            last = items[-1]
+            items[-1] = SubtitleItem(last.index, last.start_time, last.end_time,
+                                     last.text + gap_punctuation(last.text, self.punctuate[1], *self.punctuate))
+        self.buffer, self.buffer_len = [], 0
+        return merge_subtitles(items, target_length=sys.maxsize, punctuated=bool(self.punctuate))[0]
+
+
+def load_segments(file_path: str, target_length: int = 500, pre_punctuate: bool = False,
+                  comma_gap_ms: int = DEFAULT_COMMA_GAP_MS, period_gap_ms: int = DEFAULT_PERIOD_GAP_MS,
+                  segmentation_options: dict = None) -> List[MergedSegment]:
+    """读取（自动识别编码）、解析并合并一个SRT文件，解析警告打印到控制台"""
+    srt_text, encoding = read_srt_text(file_path)
+    parse_warnings = []
+    subtitles = parse_srt(srt_text, parse_warnings)
+    print(f"[SRT] 编码: {encoding}，共解析 {len(subtitles)} 条字幕")
+    for warning in parse_warnings[:MAX_PARSE_WARNINGS_SHOWN]:
+        print(f"[SRT] 警告: {warning}")
+    if len(parse_warnings) > MAX_PARSE_WARNINGS_SHOWN:
+        print(f"[SRT] ……共 {len(parse_warnings)} 条警告")
+    if pre_punctuate:
+        subtitles = prepunctuate_subtitles(subtitles, comma_gap_ms, period_gap_ms)
+    segments = segment_subtitles(subtitles, target_length, pre_punctuate, segmentation_options)
+    if segmentation_options and segmentation_options.get("segmenter") == "topic":
+        print(f"[分段] 按话题切分为 {len(segments)} 段")
     return segments
 
+
+def run_batch_mode(file_paths, args, formats, limits, pre_punctuate=False, skip_confident=False,
+                   comma_gap_ms=DEFAULT_COMMA_GAP_MS, period_gap_ms=DEFAULT_PERIOD_GAP_MS, segmentation_options=None,
+                   archive=None, backend=None):
+    """
+    命令行 --batch：所有文件的请求一起提交，完成后每个文件各自写出结果并写入归档 archive，
+    未完成的段落保存为待处理文件
+    """
+    files = []
+    for file_path in file_paths:
+        print(f"[批量] 读取 {file_path}")
+        files.append((file_path, load_segments(file_path, args.target_length, pre_punctuate,
+                                               comma_gap_ms, period_gap_ms, segmentation_options)))
+    budget = Budget(limits["max_tokens_per_run"], limits["max_tokens_per_day"])
+    try:
+        if args.batch_local:
+            batch_client, max_batch = LocalBatchClient(), 0
+        else:
+            backend = backend or get_backend()
+            batch_client, max_batch = backend.batch_client(), backend.max_batch
+    except BackendUnsupported as e:
+        print(f"[批量] {e}")
+        sys.exit(1)
+    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    results = kimi_batch_process([[seg.text for seg in segments] for _, segments in files], batch_client,
+                                 args.output_dir, f"kimi_batch_{ts}", budget=budget, skip_confident=skip_confident,
+                                 poll_seconds=0 if args.batch_local else args.batch_poll_seconds,
+                                 max_batch=max_batch)
+    for (file_path, segments), (titles, proofread) in zip(files, results):
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        with open_writers(formats, args.output_dir, f"kimi_output_{ts}_{stem}") as writer:
+            run_id = start_archive_run(archive, file_path, args.target_length, writer.paths, "[批量]")
+            for idx, (seg, title, text) in enumerate(zip(segments, titles, proofread)):
+                if title is not None and text is not None:
+                    writer.write_segment(MergedSegment(seg.time, text, seg.start_ms, seg.end_ms), title)
+                    archive_segment(archive, run_id, idx, seg, title, text, "[批量]")
+        for path in writer.paths:
+            print(f"[已保存到 {path}]")
+        if None in titles or None in proofread:
+            pending_path = os.path.join(args.output_dir, f"kimi_pending_{ts}_{stem}.json")
+            save_pending(pending_path, file_path, args.target_length, segments, titles, proofread)
+            print(f"[批量] {file_path} 有未完成的段落，已保存到 {pending_path}，"
+                  f"可使用 python main.py --resume {pending_path} 继续处理")
+    print(f"[批量] 本次运行共 {budget.run_requests} 个请求，约 {budget.run_tokens} tokens。")
+    print_skip_report([seg.text for _, segments in files for seg in segments], skip_confident, "[批量]")
+    print_model_report()
+
+
+def run_follow_mode(file_path, args, formats, limits, pre_punctuate=False, skip_confident=False,
+                    comma_gap_ms=DEFAULT_COMMA_GAP_MS, period_gap_ms=DEFAULT_PERIOD_GAP_MS, archive=None):
+    """
+    命令行 --follow：跟随直播转写持续追加的SRT文件，每结束一段立即生成标题、校对，追加到输出文件并写入归档 archive
+    按 Ctrl+C 或文件超过 --follow-idle-exit 秒没有新内容时结束，输出剩余内容
+    """
+    tail = SrtTail(file_path)
+    merger = LiveMerger(args.target_length, args.follow_pause_ms, args.follow_max_latency,
+                        (comma_gap_ms, period_gap_ms) if pre_punctuate else None)
+    budget = Budget(limits["max_tokens_per_run"], limits["max_tokens_per_day"])
+    segments, titles, proofread = [], [], []
+    dead_letters = DeadLetterQueue()
+    # 跟随模式不等待重试，失败的段落标注后写出，留给 --resume 重试
+    stream_limits = dict(limits, dead_letter_retries=0)
+    exhausted = []
+    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    print(f"[跟随] 正在跟随 {file_path}，按 Ctrl+C 结束")
+
+    def process(segment, first_seen):
+        idx = len(segments)
+        segments.append(segment)
+        print(f"[跟随] 第 {idx + 1} 段（{segment.time}，{len(segment.text)} 字）")
+        title = text = None
+        verified = set()
+        if not exhausted:
+            failures = DeadLetterQueue()
+            title = kimi_generate_titles([segment.text], budget=budget, dead_letters=failures,
+                                         limits=stream_limits)[0]
+            if title is not None or failures.failed(TASK_TITLE, 0):
+                text = kimi_proofread_segments([segment.text], budget=budget, skip_confident=skip_confident,
+                                               dead_letters=failures, limits=stream_limits, verified=verified)[0]
+            dead_letters.extend(failures, idx)
+        titles.append(title)
+        proofread.append(text)
+        output = output_segment(idx, segment, title, text, dead_letters)
+        if output is None:
+            exhausted.append(idx)
+            print(f"[跟随] 预算已用尽，第 {idx + 1} 段记为待处理")
+            return
+        done, shown_title = output
+        writer.write_segment(done, shown_title)
+        if title is not None and text is not None:
+            archive_segment(archive, run_id, idx, segment, title, text, "[跟随]", verified=0 in verified)
+        print(f"\n[输出] {format_output([done], [shown_title])}\n")
+        print(f"[跟随] 第 {idx + 1} 段从读到字幕到写出用时 {time.time() - first_seen:.1f} 秒")
+
+    with open_writers(formats, args.output_dir, f"kimi_output_{ts}") as writer:
+        # 文件仍在增长，登记的摘要是开始跟随时的内容
+        run_id = start_archive_run(archive, file_path, args.target_length, writer.paths, "[跟随]")
+        last_data = time.time()
+        try:
+            while True:
+                parse_warnings = []
+                items = tail.read(warnings=parse_warnings)
+                for warning in parse_warnings[:MAX_PARSE_WARNINGS_SHOWN]:
+                    print(f"[SRT] 警告: {warning}")
+                now = time.time()
+                if items:
+                    last_data = now
+                for item in items:
+                    first_seen = merger.first_seen
+                    for segment in merger.add(item, now):
+                        process(segment, first_seen)
+                first_seen = merger.first_seen
+                for segment in merger.due():
+                    process(segment, first_seen)
+                if args.follow_idle_exit and time.time() - last_data >= args.follow_idle_exit:
+                    print(f"[跟随] {args.follow_idle_exit:.0f} 秒没有新字幕，结束跟随")
+                    break
+                time.sleep(args.follow_poll_seconds)
+        except KeyboardInterrupt:
+            print("[跟随] 收到中断，输出剩余内容")
+        for item in tail.read(final=True):
+            first_seen = merger.first_seen
+            for segment in merger.add(item):
+                process(segment, first_seen)
+        first_seen = merger.first_seen
+        for segment in merger.flush():
+            process(segment, first_seen)
+    for path in writer.paths:
+        print(f"\n[已保存到 {path}]")
+    print(f"[Kimi] 本次运行共 {budget.run_requests} 次请求，约 {budget.run_tokens} tokens。")
+    print_skip_report([segment.text for segment in segments], skip_confident, "[跟随]")
+    print_model_report()
+    if None in titles or None in proofread:
+        save_unfinished(args.output_dir, ts, file_path, args.target_length, segments, titles, proofread, dead_letters)
+
+
+def open_archive(path: str, label: str = "[归档]"):
+    """打开归档文件，未配置或打不开时返回 None（只提示，不影响处理）"""
+    if not path:
+        return None
+    try:
+        return ShownotesArchive(path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"{label} 无法打开归档文件 {path}：{e}，本次结果不归档")
+        return None
+
+
+def start_archive_run(archive, file_path: str, target_length: int, outputs, label: str = "[归档]"):
+    """在归档中登记本次运行，返回运行编号；没有归档或登记失败时返回 None"""
+    if archive is None:
+        return None
+    routing = load_model_routing()
+    try:
+        source_hash = file_digest(file_path) if os.path.isfile(file_path) else ""
+        return archive.start_run(file_path, source_hash, target_length, routing["title_model"],
+                                 routing["proofread_model"], outputs, prompt_version())
+    except (OSError, sqlite3.Error) as e:
+        print(f"{label} 登记运行失败：{e}，本次结果不归档")
+        return None
+
+
+def archive_segment(archive, run_id, idx: int, segment: MergedSegment, title, text, label: str = "[归档]",
+                    verified: bool = True):
+    """
+    段落完成后写入归档；写入失败只提示，不影响输出
+    校对结果未经模型校对（verified 为 False：跳过校对、未通过校验保留原文）或与原文相同时不保存，以后不会被沿用
+    """
+    if run_id is None:
+        return
+    proofread = text if verified and text != segment.text else None
+    try:
+        archive.add_segment(run_id, idx, segment, title, segment.text, proofread)
+    except sqlite3.Error as e:
+        print(f"{label} 第 {idx + 1} 段写入归档失败：{e}")
+
+
+def reuse_archived(archive, texts: List[str], existing_titles=None, existing_proofread=None):
+    """
+    按原文从归档中查找此前由相同模型、相同提示词版本生成的结果，填入 existing 中没有结果的段落，
+    返回 (标题列表, 校对结果列表)；没有可沿用的结果时原样返回
+    """
+    if archive is None:
+        return existing_titles, existing_proofread
+    routing = load_model_routing()
+    titles, proofread = archive.prior_results(texts, routing["title_model"], routing["proofread_model"],
+                                              prompt_version())
+    reused_titles = sum(1 for i, title in enumerate(titles)
+                        if title is not None and (not existing_titles or existing_titles[i] is None))
+    reused_proofread = sum(1 for i, text in enumerate(proofread)
+                           if text is not None and (not existing_proofread or existing_proofread[i] is None))
+    if not reused_titles and not reused_proofread:
+        return existing_titles, existing_proofread
+    print(f"[归档] 沿用此前原文相同的段落的结果：标题 {reused_titles} 段，校对 {reused_proofread} 段")
+    merged_titles = [old if old is not None else new for old, new in zip(existing_titles or titles, titles)]
+    merged_proofread = [old if old is not None else new
+                        for old, new in zip(existing_proofread or proofread, proofread)]
+    return merged_titles, merged_proofread
+
+
+def print_search_results(archive, query: str, limit: int = DEFAULT_SEARCH_LIMIT):
+    """--search：在归档中按标题、原文或校对结果检索段落"""
+    started = time.perf_counter()
+    results = archive.search(query, limit)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"[归档] 「{query}」找到 {len(results)} 段，用时 {elapsed:.1f} 毫秒")
+    for result in results:
+        when = datetime.datetime.fromtimestamp(result["started_at"]).strftime("%Y-%m-%d %H:%M")
+        print(f"\n{result['source']}（{when} 第 {result['idx'] + 1} 段）")
+        print(f"{result['time']} {result['title'] or '（无标题）'}")
+        print(f"  {result['snippet']}")
+
+
+def print_archive_lookup(archive, file_path: str):
+    """--lookup：同一 SRT 文件（按内容摘要，与路径无关）此前的运行和已有的结果"""
+    runs = archive.runs_for(file_digest(file_path))
+    if not runs:
+        print(f"[归档] {file_path} 没有处理记录")
+        return
+    print(f"[归档] {file_path} 共有 {len(runs)} 次处理记录（最近的在前）：")
+    for run in runs:
+        when = datetime.datetime.fromtimestamp(run["started_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"  {when} 目标长度 {run['target_length']}，{run['segment_count']} 段"
+              f"（标题 {run['title_count'] or 0} 段，校对 {run['proofread_count'] or 0} 段），"
+              f"模型 {run['title_model']}/{run['proofread_model']}")
+        print(f"    源文件: {run['source']}")
+        if run["outputs"]:
+            print(f"    输出: {run['outputs']}")
+
+
+def output_segment(idx: int, segment: MergedSegment, title, text, dead_letters: DeadLetterQueue):
+    """
+    第 idx 段写出时的 (段落, 标题)：多次重试仍失败的标题和正文加上失败标注，正文使用原文；
+    因预算用尽等原因尚未请求的段落返回 None，留待恢复后输出
+    """
+    if title is None and not dead_letters.failed(TASK_TITLE, idx):
+        return None
+    if text is None and not dead_letters.failed(TASK_PROOFREAD, idx):
+        return None
+    body = failed_text(segment.text) if text is None else text
+    return MergedSegment(segment.time, body, segment.start_ms, segment.end_ms), title or FAILED_TITLE
+
+
+def save_unfinished(output_dir, ts, file_path, target_length, segments, titles, proofread,
+                    dead_letters: DeadLetterQueue):
+    """保存待处理文件，列出仍失败的请求"""
+    pending_path = os.path.join(output_dir, f"kimi_pending_{ts}.json")
+    save_pending(pending_path, file_path, target_length, segments, titles, proofread, dead_letters.to_list())
+    if len(dead_letters):
+        print(f"[Kimi] {len(dead_letters)} 个请求重试后仍失败：")
+        for line in dead_letters.summary():
+            print(f"  {line}")
+    print(f"[Kimi] 未完成（预算用尽或请求失败）的段落已保存到 {pending_path}")
+    print(f"[Kimi] 可使用 python main.py --resume {pending_path} 继续处理")
+
+
 def format_output(segments: List[MergedSegment], titles: List[str]) -> str:
     """
     格式化输出
@@ -214,31 +1809,246 @@ def format_output(segments: List[MergedSegment], titles: List[str]) -> str:
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("用法: python main.py <srt文件路径>")
-        sys.exit(1)
-    file_path = sys.argv[1]
-    # 1. 读取文件
-    srt_lines = read_srt(file_path)
-    # 2. 解析格式
-    subtitles = parse_srt(srt_lines)
-    # 3. 时间转换（合并时已用）
-    # 4. 文本合并
-    segments = merge_subtitles(subtitles, target_length=500)
-    # 5. 格式化输出前，先生成标题
+    parser = argparse.ArgumentParser(description="将SRT字幕转换为带标题的Shownotes",
+                                     usage="python main.py <srt文件路径> [选项]\n       python main.py --batch <srt文件路径>... [选项]")
+    parser.add_argument("srt_file", nargs="*", help="SRT文件路径（--batch 模式可指定多个）")
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS),
+                        help=f"输出格式，逗号分隔，可选: {', '.join(WRITERS)}（默认: txt）")
+    parser.add_argument("--output-dir", default=".", help="输出目录（默认: 当前目录）")
+    parser.add_argument("--target-length", type=int, default=500, help="段落合并的目标长度（默认: 500）")
+    parser.add_argument("--segmenter", choices=SEGMENTERS,
+                        help="分段方式：length 按累计字数合并，topic 按话题切分，需要 numpy"
+                             "（默认: length，也可在配置文件中设置 segmenter）")
+    parser.add_argument("--min-length", type=int, help="按话题切分时每段的最短字数（默认: 目标长度的一半）")
+    parser.add_argument("--max-length", type=int, help="按话题切分时每段的最长字数（默认: 目标长度的两倍）")
+    parser.add_argument("--dry-run", action="store_true", help="只解析和合并字幕，预估请求数、token数和耗时，不调用API")
+    parser.add_argument("--resume", metavar="PENDING_JSON", help="从预算用尽时保存的待处理文件继续")
+    parser.add_argument("--priority", choices=list(PRIORITY_NAMES),
+                        help="调度优先级：interactive 先于 batch（默认: batch，--follow 时为 interactive）")
+    parser.add_argument("--rate-status", action="store_true",
+                        help="显示同一 API Key 各进程共享的调度状态（最近一分钟的调用、等待和退避），然后退出")
+    parser.add_argument("--search", metavar="QUERY",
+                        help="在归档中按标题、原文或校对结果检索此前处理过的段落（空格分隔的关键词需全部出现），然后退出")
+    parser.add_argument("--search-limit", type=int, default=DEFAULT_SEARCH_LIMIT,
+                        help=f"--search 最多显示的段落数（默认: {DEFAULT_SEARCH_LIMIT}）")
+    parser.add_argument("--lookup", metavar="SRT",
+                        help="列出归档中同一SRT文件（按内容识别，与路径无关）此前的处理记录，然后退出")
+    parser.add_argument("--reuse", action="store_true",
+                        help="沿用归档中原文相同、模型和提示词也相同的段落的结果，不再请求（也可在配置文件中设置 reuse_archived）")
+    parser.add_argument("--pre-punctuate", action="store_true",
+                        help="合并前按字幕之间的停顿加逗号/句号（也可在配置文件中设置 pre_punctuate）")
+    parser.add_argument("--comma-gap-ms", type=int, help=f"加逗号的最短停顿，毫秒（默认: {DEFAULT_COMMA_GAP_MS}）")
+    parser.add_argument("--period-gap-ms", type=int, help=f"加句号的最短停顿，毫秒（默认: {DEFAULT_PERIOD_GAP_MS}）")
+    parser.add_argument("--skip-confident", action="store_true",
+                        help="清洁度（标点密度、句长分布、常见错别字）达到阈值的段落不请求校对"
+                             "（也可在配置文件中设置 skip_confident_proofread）")
+    parser.add_argument("--skip-score", type=float,
+                        help=f"跳过校对的清洁度阈值 0~1，指定时即开启跳过（默认: {DEFAULT_SKIP_SCORE}，"
+                             "也可在配置文件中设置 skip_score）")
+    parser.add_argument("--follow", action="store_true",
+                        help="跟随模式：持续读取直播转写追加的SRT文件，每结束一段立即处理并追加到输出文件")
+    parser.add_argument("--follow-pause-ms", type=int, default=3000,
+                        help="跟随模式下停顿达到此值（毫秒）时提前结束当前段落，0为不按停顿分段（默认: 3000）")
+    parser.add_argument("--follow-max-latency", type=float, default=120.0,
+                        help="跟随模式下字幕从读到到所在段落开始处理的最长等待秒数（默认: 120）")
+    parser.add_argument("--follow-poll-seconds", type=float, default=1.0, help="跟随模式检查文件的间隔秒数（默认: 1）")
+    parser.add_argument("--follow-idle-exit", type=float, default=0,
+                        help="跟随模式下文件超过此秒数没有新字幕时结束，0为一直等待直到 Ctrl+C（默认: 0）")
+    parser.add_argument("--batch", action="store_true",
+                        help="批量模式：所有请求写成 JSONL 通过 /v1/batches 异步提交，适合不着急的夜间批处理")
+    parser.add_argument("--batch-local", action="store_true",
+                        help="批量模式使用本地替身代替真实接口（离线测试，标题取正文开头，校对原样返回）")
+    parser.add_argument("--batch-poll-seconds", type=float, default=BATCH_POLL_SECONDS,
+                        help=f"批量模式查询任务状态的间隔秒数（默认: {BATCH_POLL_SECONDS:.0f}）")
+    parser.add_argument("--profile", action="store_true",
+                        help="记录性能分析数据，结束时在输出目录保存 .pstats/.folded 文件并打印耗时汇总")
+    parser.add_argument("--trace", action="store_true",
+                        help="记录运行时间线，结束时在输出目录保存 Chrome Trace 格式的 kimi_trace_时间戳.json"
+                             "（chrome://tracing 或 ui.perfetto.dev 打开）")
+    args = parser.parse_args()
+    # 本进程的调用共享同一个调度器，每次运行对应调度器中的一个任务
+    configure_scheduler(load_config()[0], load_limits())
+    run_job = get_scheduler().new_job()
+    if args.rate_status:
+        print_rate_status()
+        sys.exit(0)
+    archive_options = load_archive_options()
+    if args.search is not None or args.lookup:
+        if not archive_options["archive_path"] or not os.path.exists(archive_options["archive_path"]):
+            parser.error(f"归档文件不存在: {archive_options['archive_path'] or '（未配置 archive_path）'}")
+        with ShownotesArchive(archive_options["archive_path"]) as archive:
+            if args.search is not None:
+                print_search_results(archive, args.search, args.search_limit)
+            if args.lookup:
+                print_archive_lookup(archive, args.lookup)
+        sys.exit(0)
+    if args.profile or args.trace or not args.dry_run:
+        os.makedirs(args.output_dir, exist_ok=True)
+    if args.trace:
+        trace_path = os.path.join(args.output_dir,
+                                  f"kimi_trace_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        atexit.register(lambda: print(f"[时间线] 已保存: {get_tracer().stop(trace_path)}"))
+        get_tracer().start()
+    if args.profile:
+        # 退出时（包括 --dry-run 和异常退出）保存分析结果
+        profiler = RunProfiler(os.path.join(
+            args.output_dir, f"kimi_profile_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"))
+
+        def report_profile():
+            print(f"\n[性能分析]\n{profiler.stop()}")
+            print(f"[性能分析] 已保存: {', '.join(profiler.paths)}")
+
+        atexit.register(report_profile)
+        profiler.start()
+    run_priority = PRIORITY_NAMES[args.priority or ("interactive" if args.follow else "batch")]
+    try:
+        formats = parse_formats(args.formats)
+    except ValueError as e:
+        parser.error(str(e))
+    limits = load_limits()
+    punctuation = load_punctuation_options()
+    pre_punctuate = args.pre_punctuate or punctuation["pre_punctuate"]
+    skip_confident = args.skip_confident or args.skip_score is not None or punctuation["skip_confident_proofread"]
+    if args.skip_score is not None:
+        skip_score = args.skip_score
+    comma_gap_ms = args.comma_gap_ms if args.comma_gap_ms is not None else punctuation["comma_gap_ms"]
+    period_gap_ms = args.period_gap_ms if args.period_gap_ms is not None else punctuation["period_gap_ms"]
+    segmentation_options = load_segmentation_options()
+    if args.segmenter:
+        segmentation_options["segmenter"] = args.segmenter
+    if args.min_length is not None:
+        segmentation_options["topic_min_length"] = args.min_length
+    if args.max_length is not None:
+        segmentation_options["topic_max_length"] = args.max_length
+    if segmentation_options["segmenter"] not in SEGMENTERS:
+        parser.error(f"未知的分段方式: {segmentation_options['segmenter']}，可选: {', '.join(SEGMENTERS)}")
+    if segmentation_options["segmenter"] == "topic" and not segmentation.available():
+        parser.error("按话题切分需要安装 numpy（pip install numpy）")
+    if args.follow:
+        if args.batch or args.resume or args.dry_run:
+            parser.error("--follow 不能与 --batch、--resume、--dry-run 同时使用")
+        if len(args.srt_file) != 1:
+            parser.error("--follow 需要指定一个SRT文件")
+        if args.segmenter == "topic":
+            parser.error("--follow 按停顿和字数实时分段，不能与 --segmenter topic 同时使用")
+        archive = open_archive(archive_options["archive_path"], "[跟随]")
+        try:
+            run_follow_mode(args.srt_file[0], args, formats, limits, pre_punctuate, skip_confident,
+                            comma_gap_ms, period_gap_ms, archive)
+        finally:
+            if archive:
+                archive.close()
+        sys.exit(0)
+    if args.batch:
+        if args.resume or args.dry_run:
+            parser.error("--batch 不能与 --resume、--dry-run 同时使用")
+        if not args.srt_file:
+            parser.error("请指定至少一个SRT文件")
+        # --batch-local 的标题和校对结果是本地替身生成的，不归档
+        archive = None if args.batch_local else open_archive(archive_options["archive_path"], "[批量]")
+        try:
+            run_batch_mode(args.srt_file, args, formats, limits, pre_punctuate, skip_confident, comma_gap_ms,
+                           period_gap_ms, segmentation_options, archive)
+        finally:
+            if archive:
+                archive.close()
+        sys.exit(0)
+    if args.resume:
+        # 从待处理文件恢复，已完成的标题和校对结果直接沿用
+        state = load_pending(args.resume)
+        file_path = state["source"]
+        target_length = state["target_length"]
+        segments = [MergedSegment(s["time"], s["text"], s["start_ms"], s["end_ms"]) for s in state["segments"]]
+        existing_titles = state["titles"]
+        existing_proofread = state["proofread"]
+        dead_letters = DeadLetterQueue(state.get("dead_letters"))
+    else:
+        if not args.srt_file:
+            parser.error("请指定SRT文件路径，或使用 --resume 继续待处理任务")
+        if len(args.srt_file) > 1:
+            parser.error("一次只能处理一个SRT文件，多个文件请使用 --batch")
+        file_path = args.srt_file[0]
+        target_length = args.target_length
+        # 1-4. 读取（自动识别编码）、解析、合并
+        segments = load_segments(file_path, target_length, pre_punctuate, comma_gap_ms, period_gap_ms,
+                                 segmentation_options)
+        existing_titles = existing_proofread = None
+        dead_letters = DeadLetterQueue()
     merged_texts = [seg.text for seg in segments]
-    titles = kimi_generate_titles(merged_texts)
-    # 6. 校对正文
-    print("[Kimi] 正在校对所有正文内容...")
-    proofread_texts = kimi_proofread_segments(merged_texts)
-    print("[Kimi] 所有正文校对完毕。\n")
-    # 7. 输出：时间+标题+校对正文
-    output = format_output([MergedSegment(seg.time, txt) for seg, txt in zip(segments, proofread_texts)], titles)
-    print("\n[全部内容输出如下]\n")
-    print(output)
-    # 保存到以时间戳命名的txt文件
-    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    outname = f"kimi_output_{ts}.txt"
-    with open(outname, "w", encoding="utf-8") as f:
-        f.write(output)
-    print(f"\n[已保存到 {outname}]")
\ No newline at end of file
+    # 预估时不新建归档文件
+    archive = None if args.dry_run and not os.path.exists(archive_options["archive_path"]) else \
+        open_archive(archive_options["archive_path"])
+    try:
+        # 校对结果由模型校对且有改动的段落，只有这些段落的校对结果写入归档
+        verified = set()
+        if archive_options["reuse_archived"] or args.reuse:
+            # 请求 API 之前先查归档，原文相同的段落直接沿用此前的结果
+            before = existing_proofread
+            existing_titles, existing_proofread = reuse_archived(archive, merged_texts, existing_titles,
+                                                                 existing_proofread)
+            verified.update(i for i, text in enumerate(existing_proofread or [])
+                            if text is not None and (not before or before[i] is None))
+        if args.dry_run:
+            title_texts = [t for i, t in enumerate(merged_texts) if not existing_titles or existing_titles[i] is None]
+            proofread_texts = [t for i, t in enumerate(merged_texts) if not existing_proofread or existing_proofread[i] is None]
+            if skip_confident:
+                skipped = len(proofread_texts)
+                proofread_texts = needs_proofread(proofread_texts, True)
+                print(f"[预估] {skipped - len(proofread_texts)} 段清洁度 ≥ {skip_score:.2f}，不请求校对")
+            print(f"[预估] 共 {len(segments)} 段，RPM={limits['rpm'] or ESTIMATE_DEFAULT_RPM}，"
+                  f"TPM={limits['tpm'] or ESTIMATE_DEFAULT_TPM}（token数为本地估算值）")
+            print(format_estimates(estimate_run(title_texts, proofread_texts, limits),
+                                   limits["price_per_1k_prompt"], limits["price_per_1k_completion"]))
+            sys.exit(0)
+        print(f"[Kimi] 补全后端: {get_backend().describe()}")
+        budget = Budget(limits["max_tokens_per_run"], limits["max_tokens_per_day"])
+        # 先打开所有输出文件，路径有问题时在调用 API 之前报错
+        ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        with open_writers(formats, args.output_dir, f"kimi_output_{ts}") as writer:
+            run_id = start_archive_run(archive, file_path, target_length, writer.paths)
+            # 5. 格式化输出前，先生成标题
+            titles = kimi_generate_titles(merged_texts, budget=budget, existing=existing_titles,
+                                          dead_letters=dead_letters, limits=limits)
+            # 6. 校对正文，每段校对完成后立即写入所有输出格式
+            # 7. 输出：时间+标题+校对正文（标题未完成的段落留待恢复后输出，失败的段落加标注）
+            marked = []
+
+            def write_result(idx, text):
+                output = output_segment(idx, segments[idx], titles[idx], text, dead_letters)
+                if output is None:
+                    return
+                if titles[idx] is None or text is None:
+                    marked.append(idx)
+                done, title = output
+                writer.write_segment(done, title)
+                if titles[idx] is not None and text is not None:
+                    archive_segment(archive, run_id, idx, segments[idx], titles[idx], text, verified=idx in verified)
+                print(f"\n[输出] {format_output([done], [title])}\n")
+
+            print("[Kimi] 正在校对所有正文内容...")
+            proofread_texts = kimi_proofread_segments(merged_texts, on_result=write_result,
+                                                      budget=budget, existing=existing_proofread,
+                                                      skip_confident=skip_confident,
+                                                      dead_letters=dead_letters, limits=limits, verified=verified)
+        if any(proofread_texts[idx] is not None for idx in marked):
+            # 重试成功的段落此前以失败标注写出，按最终结果重新写出全部段落
+            with open_writers(formats, args.output_dir, f"kimi_output_{ts}") as writer:
+                for idx, seg in enumerate(segments):
+                    output = output_segment(idx, seg, titles[idx], proofread_texts[idx], dead_letters)
+                    if output:
+                        writer.write_segment(*output)
+            for idx in marked:
+                if titles[idx] is not None and proofread_texts[idx] is not None:
+                    archive_segment(archive, run_id, idx, segments[idx], titles[idx], proofread_texts[idx],
+                                    verified=idx in verified)
+            print("[Kimi] 重试成功的段落已更新到输出文件")
+    finally:
+        if archive:
+            archive.close()
+    for path in writer.paths:
+        print(f"\n[已保存到 {path}]")
+    print(f"[Kimi] 本次运行共 {budget.run_requests} 次请求，约 {budget.run_tokens} tokens。")
+    print_model_report()
+    if None in titles or None in proofread_texts:
+        save_unfinished(args.output_dir, ts, file_path, target_length, segments, titles, proofread_texts,
+                        dead_letters)
@@ -13,286 +13,420 @@ import io
 
 # 导入main.py中的功能函数
 from main import (
-    read_srt, parse_srt, merge_subtitles, convert_time_format,
+    read_srt, read_srt_text, parse_srt, merge_subtitles, convert_time_format, MAX_PARSE_WARNINGS_SHOWN,
     kimi_generate_titles, kimi_proofread_segments, format_output,
-    SubtitleItem, MergedSegment, load_config
+    SubtitleItem, MergedSegment, load_config,
+    build_title_prompt, proofread_with_validation, build_messages, load_limits,
+    estimate_run, estimate_title_tokens, estimate_proofread_tokens, configure_scheduler,
+    load_model_routing, configure_router, load_backend_options, map_in_order,
+    load_punctuation_options, prepunctuate_subtitles, needs_proofread, is_clean,
+    load_segmentation_options, segment_subtitles, completion_total_tokens, kimi_rpm_handle,
+    split_for_proofread, stitch_proofread, map_chunks_in_order,
+    load_archive_options, open_archive, start_archive_run, archive_segment
 )
+from budget import (
+    Budget, JobBudget, RetryBudget, BudgetExceeded, call_with_budget, format_estimates, format_seconds, save_pending, estimate_step,
+    ESTIMATE_DEFAULT_RPM, ESTIMATE_DEFAULT_TPM
+)
+from backends import create_backend
+from deadletter import (
+    DeadLetterQueue, retry_dead_letters, failed_text, error_message, FAILED_TITLE, MAX_CONSECUTIVE_FAILURES
+)
+from routing import get_router
+from textdiff import DiffCache
+import segmentation
+from tracing import get_tracer
+from scheduler import get_scheduler, AcquireCancelled, PRIORITY_INTERACTIVE, TASK_TITLE, TASK_PROOFREAD
+from writers import WRITERS, DEFAULT_FORMATS, open_writers
+from profiling import RunProfiler
+from progress import ProgressEstimator
+
+# 拖放文件到任务队列需要 tkinterdnd2，未安装时只能通过「添加文件」选择
+try:
+    from tkinterdnd2 import TkinterDnD, DND_FILES
+except ImportError:
+    TkinterDnD = None
+
+# 输出格式显示名称
+FORMAT_LABELS = {
+    "txt": "文本(txt)",
+    "md": "Markdown",
+    "json": "JSON",
+    "youtube": "YouTube章节",
+    "vtt": "WebVTT章节",
+}
 
 # 常量定义
-MAX_RETRIES = 300
+DIFF_RENDER_DELAY_MS = 50  # 滚动停下后再比较可见段落，连续滚动时只计算一次
+
+
+def _plan_task(texts, estimator):
+    """按本地预估给出步骤的 (段数, 单次调用耗时, 单次调用tokens)，作为剩余时间估算的初始值"""
+    if not texts:
+        return (0, 0.0, 0.0)
+    pairs = [estimator(text) for text in texts]
+    est = estimate_step("", [p for p, _ in pairs], [c for _, c in pairs], 0, 0)
+    return (len(texts), est.seconds / est.requests, est.total_tokens / est.requests)
+
+
+def _segmentation_options(topic: bool) -> dict:
+    """界面勾选「按话题分段」时按话题切分，最短/最长字数沿用配置文件"""
+    options = load_segmentation_options()
+    options["segmenter"] = "topic" if topic and segmentation.available() else "length"
+    return options
 
 
 class CancellableKimiWrapper:
     """可取消的Kimi API包装器"""
-    def __init__(self, cancel_flag, event_queue):
+    def __init__(self, cancel_flag, event_queue, backend, budget=None, job=None, dead_letters=None, limits=None):
         self.cancel_flag = cancel_flag
         self.event_queue = event_queue
+        # 补全后端，同时发出的请求数不超过它的 max_concurrency
+        self.backend = backend
+        self.budget = budget
+        # 调度器中的任务编号，GUI任务按交互优先级调度
+        self.job = job
+        # 失败的段落记入死信队列，本阶段结束后按退避间隔重试
+        self.dead_letters = DeadLetterQueue() if dead_letters is None else dead_letters
+        self.limits = limits or load_limits()
+    
+    def _stopped(self, exhausted):
+        return self.cancel_flag.is_set() or exhausted.is_set()
+    
+    def _log(self, message):
+        self.event_queue.put({"type": "log", "message": message})
+    
+    def _record_failure(self, task, idx, error, streak):
+        """失败的段落记入死信队列；连续失败达到上限时返回 True，不再发起新请求"""
+        attempts = self.dead_letters.add(task, idx, error)
+        name = "标题生成" if task == TASK_TITLE else "正文校对"
+        self._log(f"第{idx+1}段{name}失败（已尝试 {attempts} 次），记入死信队列: {error_message(error)}")
+        streak[0] += 1
+        if streak[0] < MAX_CONSECUTIVE_FAILURES:
+            return False
+        self._log(f"连续 {streak[0]} 段请求失败，接口可能不可用，剩余段落记为待处理")
+        return True
+    
+    def _retry_dead_letters(self, task, func):
+        """
+        本阶段结束后重试死信队列中 task 类型的段落，func(index) 返回结果
+        重试期间使用单独的重试预算，取消任务时立即停止等待；返回 段落序号 -> 结果
+        """
+        if self.cancel_flag.is_set() or not self.dead_letters.indices(task):
+            return {}
+        budget = self.budget
+        self.budget = RetryBudget(budget, self.limits["dead_letter_max_tokens"])
+        try:
+            return retry_dead_letters(self.dead_letters, task, func, self.limits["dead_letter_retries"],
+                                      self.limits["dead_letter_backoff_seconds"], wait=self.cancel_flag.wait,
+                                      log=self._log)
+        finally:
+            self.budget = budget
     
-    def generate_titles_with_progress(self, text_list):
-        """带进度显示和取消支持的标题生成"""
+    def generate_titles_with_progress(self, text_list, on_result=None):
+        """
+        带进度显示和取消支持的标题生成，on_result(index, title) 在每段完成后按顺序回调
+        失败的段落记入死信队列，回调的 title 为 None；本阶段结束后重试，仍失败的条目为 None
+        同时发出的请求数不超过后端的 max_concurrency
+        """
         titles = []
         total = len(text_list)
+        exhausted = threading.Event()
+        streak = [0]
         
-        for idx, text in enumerate(text_list):
-            if self.cancel_flag.is_set():
-                return None
-            
+        def generate(idx):
             self.event_queue.put({
                 "type": "step_progress", 
                 "name": "titles", 
                 "current": idx + 1, 
                 "total": total
             })
-            
-            # 调用单个文本的标题生成（模拟原始函数的单步调用）
-            try:
-                single_title = self._generate_single_title(text)
-                titles.append(single_title)
-                
+            with get_tracer().span("标题", "title", segment=idx + 1):
+                return self._generate_single_title(text_list[idx])
+        
+        for idx, single_title, error in map_in_order(generate, range(total), self.backend.max_concurrency,
+                                                     stop=lambda: self._stopped(exhausted)):
+            if self.cancel_flag.is_set() or isinstance(error, AcquireCancelled):
+                return None
+            if isinstance(error, BudgetExceeded):
+                # 已完成的标题保持连续，预算用尽之后的结果不再使用
+                exhausted.set()
+                self._log(f"{error}，剩余 {total - idx} 段标题记为待处理")
+                break
+            if error:
+                single_title = None
+                if self._record_failure(TASK_TITLE, idx, error, streak):
+                    exhausted.set()
+            else:
+                streak[0] = 0
                 self.event_queue.put({
                     "type": "title_generated", 
                     "index": idx, 
                     "title": single_title
                 })
-            except Exception as e:
-                self.event_queue.put({"type": "log", "message": f"第{idx+1}段标题生成失败: {e}"})
-                titles.append(f"标题{idx+1}")
+            titles.append(single_title)
+            
+            if on_result:
+                on_result(idx, titles[-1])
+            if exhausted.is_set():
+                break
         
+        try:
+            recovered = self._retry_dead_letters(TASK_TITLE, lambda idx: self._generate_single_title(text_list[idx]))
+        except AcquireCancelled:
+            return None
+        for idx, single_title in recovered.items():
+            titles[idx] = single_title
+            self.event_queue.put({"type": "title_generated", "index": idx, "title": single_title})
+        if self.cancel_flag.is_set():
+            return None
         return titles
     
-    def proofread_segments_with_progress(self, text_list):
-        """带进度显示和取消支持的正文校对"""
+    def proofread_segments_with_progress(self, text_list, on_result=None, skip_confident=False, verified=None):
+        """
+        带进度显示和取消支持的正文校对，on_result(index, text) 在每段完成后按顺序回调
+        失败的段落记入死信队列，回调的 text 为 None；本阶段结束后重试，仍失败的条目为 None
+        skip_confident 为 True 时，清洁度达到阈值的段落不请求校对，结束时在日志中报告跳过和校对的段数
+        超过 proofread_chunk_tokens 的段落按句子拆成多块并行校对，完成后按顺序拼接
+        同时发出的请求数不超过后端的 max_concurrency
+        verified 为集合时，加入每块都由模型校对且有改动的段落编号，与命令行一致，只有这些段落的校对结果写入归档
+        """
         proofread = []
         total = len(text_list)
+        exhausted = threading.Event()
+        streak = [0]
+        counts = {"skipped": 0, "requested": 0}
+        
+        # 超过 proofread_chunk_tokens 的段落拆成多块，与其他段落的块一起并行校对
+        chunk_tokens = self.limits["proofread_chunk_tokens"]
+        chunks = [[text] if skip_confident and is_clean(text) else split_for_proofread(text, chunk_tokens)
+                  for text in text_list]
+        
+        def proofread_chunk(idx, k):
+            """返回第 idx 段第 k 块的 (结果, 是否跳过校对)"""
+            text = text_list[idx]
+            if skip_confident and is_clean(text):
+                return text, True
+            if k == 0:
+                self.event_queue.put({
+                    "type": "step_progress", 
+                    "name": "proofread", 
+                    "current": idx + 1, 
+                    "total": total
+                })
+            with get_tracer().span("校对", "proofread", segment=idx + 1, chunk=k + 1):
+                return self._proofread_single_text(chunks[idx][k]), False
         
-        for idx, text in enumerate(text_list):
-            if self.cancel_flag.is_set():
+        for idx, results, error in map_chunks_in_order(proofread_chunk, [len(parts) for parts in chunks],
+                                                       self.backend.max_concurrency,
+                                                       stop=lambda: self._stopped(exhausted)):
+            if self.cancel_flag.is_set() or isinstance(error, AcquireCancelled):
                 return None
-            
-            self.event_queue.put({
-                "type": "step_progress", 
-                "name": "proofread", 
-                "current": idx + 1, 
-                "total": total
-            })
-            
-            try:
-                single_proofread = self._proofread_single_text(text)
+            if isinstance(error, BudgetExceeded):
+                exhausted.set()
+                self._log(f"{error}，剩余 {total - idx} 段正文记为待处理")
+                break
+            if error:
+                proofread.append(None)
+                counts["requested"] += 1
+                if self._record_failure(TASK_PROOFREAD, idx, error, streak):
+                    exhausted.set()
+            else:
+                single_proofread, skipped, changed = self._stitch_chunks(text_list[idx], chunks[idx], results)
+                if changed and verified is not None:
+                    verified.add(idx)
+                counts["skipped" if skipped else "requested"] += 1
+                if not skipped:
+                    streak[0] = 0
                 proofread.append(single_proofread)
-                
-                self.event_queue.put({
-                    "type": "proofread_generated", 
-                    "index": idx, 
-                    "text": single_proofread
-                })
-            except Exception as e:
-                self.event_queue.put({"type": "log", "message": f"第{idx+1}段正文校对失败: {e}"})
-                proofread.append(text)  # 保持原文
+                event = {"type": "proofread_generated", "index": idx, "text": single_proofread}
+                if skipped:
+                    event["skipped"] = True
+                self.event_queue.put(event)
+            
+            if on_result:
+                on_result(idx, proofread[-1])
+            if exhausted.is_set():
+                break
         
+        try:
+            recovered = self._retry_dead_letters(TASK_PROOFREAD, lambda idx: self._proofread_chunked(text_list[idx],
+                                                                                                     chunks[idx]))
+        except AcquireCancelled:
+            return None
+        for idx, (single_proofread, changed) in recovered.items():
+            proofread[idx] = single_proofread
+            if changed and verified is not None:
+                verified.add(idx)
+            self.event_queue.put({"type": "proofread_generated", "index": idx, "text": single_proofread})
+        if self.cancel_flag.is_set():
+            return None
+        if skip_confident:
+            self._log(f"请求校对 {counts['requested']} 段，跳过 {counts['skipped']} 段（清洁度达到阈值）")
         return proofread
     
+    def _stitch_chunks(self, text, chunks, results):
+        """各块的 (结果, 是否跳过校对) 拼接为整段的 (结果, 是否跳过校对, 是否每块都由模型校对且有改动)"""
+        changed = all(not skipped and result != chunk for (result, skipped), chunk in zip(results, chunks))
+        if len(results) == 1:
+            return results[0][0], results[0][1], changed
+        stitched = stitch_proofread(text, chunks, [result for result, _ in results], log=self._log)
+        return stitched, False, changed and stitched != text
+    
+    def _proofread_chunked(self, text, chunks):
+        """重试死信时整段重新校对，各块并行，返回 (结果, 是否每块都有改动)"""
+        results = []
+        for _, result, error in map_in_order(lambda chunk: (self._proofread_single_text(chunk), False), chunks,
+                                             self.backend.max_concurrency):
+            if error:
+                raise error
+            results.append(result)
+        stitched, _, changed = self._stitch_chunks(text, chunks, results)
+        return stitched, changed
+    
+    def _complete(self, task, prompt, estimated_tokens):
+        """
+        发出一次请求，调度、模型路由、429 退避和重试上限与命令行共用 kimi_rpm_handle；
+        以交互优先级调度，取消任务时停止等待，退避和用量发给界面，用于显示限流和估算剩余时间
+        """
+        def on_success(model, seconds, completion):
+            self.event_queue.put({"type": "api_call", "task": "title" if task == TASK_TITLE else "proofread",
+                                  "seconds": seconds, "tokens": completion_total_tokens(completion) or estimated_tokens})
+        
+        return kimi_rpm_handle(lambda model: self.backend.complete(model, build_messages(prompt)),
+                               task=task, tokens=estimated_tokens, job_class=PRIORITY_INTERACTIVE, job=self.job,
+                               cancel=self.cancel_flag, log=self._log,
+                               on_rate_limited=lambda delay: self.event_queue.put({"type": "rate_limited", "delay": delay}),
+                               on_success=on_success)
+    
     def _generate_single_title(self, text):
-        """生成单个标题（调用真实API）"""
-        try:
-            # 动态创建client
-            from openai import OpenAI
-            import configparser
-            
-            # 重新读取配置以确保使用最新设置
-            config = configparser.ConfigParser()
-            if os.path.exists("kimi_config.ini"):
-                config.read("kimi_config.ini", encoding="utf-8")
-                if "kimi" in config:
-                    section = config["kimi"]
-                    api_key = section.get("api_key", "")
-                    base_url = section.get("base_url", "https://api.moonshot.cn/v1")
-                    model_name = section.get("model", "moonshot-v1-8k")
-                else:
-                    raise Exception("配置文件中未找到[kimi]段")
-            else:
-                raise Exception("配置文件kimi_config.ini不存在")
-            
-            if not api_key:
-                raise Exception("API Key未设置")
-            
-            client = OpenAI(api_key=api_key, base_url=base_url)
-            
-            prompt = (
-                "你现在是一个专业的内容标题生成专家。我会给你一些文本片段，请你为每个片段生成标题。\n"
-                "要求：\n"
-                "1. 标题长度：5-15字\n"
-                "2. 风格要求：\n   - 新闻式标题\n   - 简洁明了\n   - 包含核心信息\n   - 避免过于笼统的表述\n"
-                "3. 内容要求：\n   - 准确反映文本主题\n   - 突出重要信息\n   - 保持客观性\n   - 符合上下文连贯性\n"
-                "格式要求：\n- 输入：文本片段\n- 输出：仅返回标题，不需要解释\n"
-                f"请为以下文本生成标题：\n{text}\n"
-            )
-            
-            def call():
-                return client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": "你是 Kimi，由 Moonshot AI 提供的人工智能助手。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.6,
-                )
-            
-            # 使用重试机制
-            import time
-            retry_count = 0
-            max_retries = MAX_RETRIES
-            
-            while retry_count < max_retries:
-                try:
-                    completion = call()
-                    title = completion.choices[0].message.content.strip().split('\n')[0].strip()
-                    return title
-                except Exception as e:
-                    if hasattr(e, 'status_code') and e.status_code == 429:
-                        self.event_queue.put({"type": "log", "message": f"API限流，等待重试... ({retry_count+1}/{max_retries})"})
-                        time.sleep(1.2)
-                        retry_count += 1
-                    else:
-                        raise e
-            
-            raise Exception("API调用重试次数超限")
-            
-        except Exception as e:
-            self.event_queue.put({"type": "log", "message": f"标题生成API调用失败: {e}"})
-            # 使用简单的标题生成逻辑作为备选
-            if "技术" in text or "科技" in text:
-                return "科技发展新动态"
-            elif "经济" in text or "市场" in text:
-                return "经济市场分析" 
-            elif "教育" in text or "学习" in text:
-                return "教育学习话题"
-            else:
-                import random
-                return f"内容摘要{random.randint(1, 999)}"
+        """生成单个标题（调用真实API），失败时抛出异常，由调用方记入死信队列"""
+        prompt = build_title_prompt(text)
+        prompt_tokens, completion_tokens = estimate_title_tokens(text)
+        completion = call_with_budget(self.budget, prompt_tokens, completion_tokens,
+                                      lambda: self._complete(TASK_TITLE, prompt, prompt_tokens + completion_tokens))
+        title = completion.choices[0].message.content.strip().split('\n')[0].strip()
+        if not title:
+            raise ValueError("返回的标题为空")
+        return title
     
     def _proofread_single_text(self, text):
-        """校对单个文本（调用真实API）"""
-        try:
-            # 动态创建client
-            from openai import OpenAI
-            import configparser
-            
-            # 重新读取配置以确保使用最新设置
-            config = configparser.ConfigParser()
-            if os.path.exists("kimi_config.ini"):
-                config.read("kimi_config.ini", encoding="utf-8")
-                if "kimi" in config:
-                    section = config["kimi"]
-                    api_key = section.get("api_key", "")
-                    base_url = section.get("base_url", "https://api.moonshot.cn/v1")
-                    model_name = section.get("model", "moonshot-v1-8k")
-                else:
-                    raise Exception("配置文件中未找到[kimi]段")
-            else:
-                raise Exception("配置文件kimi_config.ini不存在")
-            
-            if not api_key:
-                raise Exception("API Key未设置")
-            
-            client = OpenAI(api_key=api_key, base_url=base_url)
-            
-            prompt = (
-                "你现在是一个专业的口播稿校对专家。我将提供一段口播稿，请你对其进行校对。\n\n"
-                "核心原则：\n"
-                "- 严格禁止删除或裁剪任何内容\n"
-                "- 必须保持原文的每一句话\n"
-                "- 禁止对文本进行重写或改写\n"
-                "- 禁止对文本进行总结或精简\n\n"
-                "允许的修改仅限于：\n"
-                "1. 标点符号处理：\n"
-                "   - 在语意完整处添加标点符号\n"
-                "   - 使用常见中文标点（，。；：""《》？！）\n"
-                "2. 错别字修正：\n"
-                "   - 仅修正明确的错别字\n"
-                "   - 保持专有名词的准确性\n\n"
-                "警告：\n"
-                "- 如果输出的文本字数与输入的文本字数（不计标点）不一致，则视为失败\n"
-                "- 除标点和错别字外，严禁改动原文的任何部分\n\n"
-                "请对以下口播稿进行校对，并确保输出的是完整的、未经删减的文本：\n"
-                f"{text}\n"
-            )
-            
-            def call():
-                return client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": "你是 Kimi，由 Moonshot AI 提供的人工智能助手。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.6,
-                )
-            
-            # 使用重试机制
-            import time
-            retry_count = 0
-            max_retries = MAX_RETRIES
-            
-            while retry_count < max_retries:
-                try:
-                    completion = call()
-                    proofread_text = completion.choices[0].message.content.strip().split('\n')[0].strip()
-                    return proofread_text
-                except Exception as e:
-                    if hasattr(e, 'status_code') and e.status_code == 429:
-                        self.event_queue.put({"type": "log", "message": f"校对API限流，等待重试... ({retry_count+1}/{max_retries})"})
-                        time.sleep(1.2)
-                        retry_count += 1
-                    else:
-                        raise e
-            
-            raise Exception("校对API调用重试次数超限")
-            
-        except Exception as e:
-            self.event_queue.put({"type": "log", "message": f"校对API调用失败: {e}"})
-            # 简单的校对逻辑作为备选：添加标点符号
-            result = text.strip()
-            if not result.endswith(('。', '！', '？')):
-                result += '。'
-            return result
+        """校对单个文本（调用真实API），失败时抛出异常，由调用方记入死信队列"""
+        def request(prompt, failure_reason=None):
+            with get_tracer().span("校对请求", "proofread", retry_reason=failure_reason):
+                prompt_tokens, completion_tokens = estimate_proofread_tokens(text, failure_reason)
+                completion = call_with_budget(
+                    self.budget, prompt_tokens, completion_tokens,
+                    lambda: self._complete(TASK_PROOFREAD, prompt, prompt_tokens + completion_tokens))
+                return completion.choices[0].message.content
+        
+        # 本地校验校对结果，不合格时用更严格的提示词重新请求，多次失败保留原文
+        return proofread_with_validation(text, request, log=self._log)
 
 
 class LogCapture:
-    """捕获print输出并重定向到GUI"""
+    """
+    捕获print输出并重定向到GUI
+    按线程区分：并行的任务各自把输出发到自己的事件队列，其他线程的输出照常打印
+    """
+    _lock = threading.Lock()
+    _queues = {}  # 线程ID -> 事件队列
+    _original_stdout = None
+    
     def __init__(self, event_queue):
         self.event_queue = event_queue
-        self.original_stdout = sys.stdout
         
     def write(self, text):
-        if text.strip():  # 只记录非空内容
-            self.event_queue.put({"type": "log", "message": text.strip()})
+        event_queue = LogCapture._queues.get(threading.get_ident())
+        if event_queue is None:
+            LogCapture._original_stdout.write(text)
+        elif text.strip():  # 只记录非空内容
+            event_queue.put({"type": "log", "message": text.strip()})
         
     def flush(self):
-        pass
+        if threading.get_ident() not in LogCapture._queues and LogCapture._original_stdout:
+            LogCapture._original_stdout.flush()
     
     def __enter__(self):
-        sys.stdout = self
+        with LogCapture._lock:
+            if not LogCapture._queues:
+                LogCapture._original_stdout = sys.stdout
+                sys.stdout = self
+            LogCapture._queues[threading.get_ident()] = self.event_queue
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        sys.stdout = self.original_stdout
+        with LogCapture._lock:
+            LogCapture._queues.pop(threading.get_ident(), None)
+            if not LogCapture._queues:
+                sys.stdout = LogCapture._original_stdout
+
+
+class JobEvents:
+    """任务的事件出口：给每个事件加上任务编号后放入界面的事件队列"""
+    def __init__(self, event_queue, job_id):
+        self.event_queue = event_queue
+        self.job_id = job_id
+    
+    def put(self, event: Dict[str, Any]):
+        event["job"] = self.job_id
+        if get_tracer().enabled:
+            event["_trace"] = get_tracer().mark_sent()
+        self.event_queue.put(event)
+
+
+class QueueJob:
+    """队列中的一个文件任务，状态和结果只在界面线程中修改"""
+    def __init__(self, job_id: int, path: str, event_queue):
+        self.id = job_id
+        self.path = path
+        self.name = os.path.basename(path)
+        self.status = "排队中"
+        self.progress = 0.0
+        self.cancel_flag = threading.Event()
+        self.events = JobEvents(event_queue, job_id)
+        self.settings = {}
+        self.budget = None
+        self.backend = None
+        self.segments_data = []
+        self.steps = []  # 进度步骤记录，切换查看任务时重新显示
+        self.output_path = ""
+        self.estimator = None
+        self.error = ""
+        self.finished = False
+    
+    def send_event(self, event: Dict[str, Any]):
+        self.events.put(event)
 
 
 class MainWindow:
     """SRT ShowNotes 助手主窗口"""
     
     def __init__(self):
-        self.root = tk.Tk()
+        self.root = TkinterDnD.Tk() if TkinterDnD else tk.Tk()
         self.root.title("SRT ShowNotes 助手")
         self.root.geometry("1000x700")
         
         # --- 状态管理 ---
-        self.cancel_flag = threading.Event()
         self.is_running = False
         self.start_time = None
         self.event_queue = queue.Queue()
+        self.event_timings = None  # 性能分析时记录界面事件处理耗时：事件类型 -> [次数, 秒]
+        
+        # --- 任务队列 ---
+        self.jobs: List[QueueJob] = []
+        self.jobs_by_id: Dict[int, QueueJob] = {}
+        self._next_job_id = 1
+        self.current_job = None  # 进度、段落编辑和预览标签页显示的任务
+        self.run_jobs: List[QueueJob] = []  # 本次处理中结束的任务，用于最后的汇总
+        self.queue_budget = None  # 队列中所有任务共用的预算
+        self.queue_backend = None  # 队列中所有任务共用的补全后端
         
         # --- 数据存储 ---
         self.segments_data = []  # 处理后的段落数据
+        self.segment_views = []  # 段落编辑页每段的控件：frame、text_widget、diff_widget、diff_text
+        self.diff_cache = DiffCache()
+        self._diff_render_pending = False
         self.output_dir = os.getcwd()
         
         # --- 配置变量 ---
@@ -300,6 +434,16 @@ class MainWindow:
         self.target_length = tk.IntVar(value=500)
         self.enable_titles = tk.BooleanVar(value=True)
         self.enable_proofread = tk.BooleanVar(value=True)
+        self.enable_profile = tk.BooleanVar(value=False)
+        self.enable_trace = tk.BooleanVar(value=False)
+        self.show_diff = tk.BooleanVar(value=False)
+        punctuation = load_punctuation_options()
+        self.pre_punctuate = tk.BooleanVar(value=punctuation["pre_punctuate"])
+        self.skip_confident = tk.BooleanVar(value=punctuation["skip_confident_proofread"])
+        self.topic_segments = tk.BooleanVar(value=segmentation.available()
+                                            and load_segmentation_options()["segmenter"] == "topic")
+        self.max_parallel = tk.IntVar(value=2)
+        self.output_formats = {fmt: tk.BooleanVar(value=fmt in DEFAULT_FORMATS) for fmt in WRITERS}
         self.api_key = tk.StringVar()
         self.base_url = tk.StringVar(value="https://api.moonshot.cn/v1")
         self.model_name = tk.StringVar(value="moonshot-v1-8k")
@@ -331,12 +475,17 @@ class MainWindow:
     def save_config(self):
         """保存配置文件"""
         try:
+            # 保留配置文件中的其他选项（速率限制、预算等）
             config = configparser.ConfigParser()
-            config["kimi"] = {
+            if os.path.exists("kimi_config.ini"):
+                config.read("kimi_config.ini", encoding="utf-8")
+            if "kimi" not in config:
+                config["kimi"] = {}
+            config["kimi"].update({
                 "api_key": self.api_key.get(),
                 "base_url": self.base_url.get(),
                 "model": self.model_name.get()
-            }
+            })
             with open("kimi_config.ini", "w", encoding="utf-8") as f:
                 config.write(f)
         except Exception as e:
@@ -403,6 +552,25 @@ class MainWindow:
         
         ttk.Checkbutton(process_frame, text="生成标题", variable=self.enable_titles).pack(anchor=tk.W, padx=5, pady=2)
         ttk.Checkbutton(process_frame, text="校对正文", variable=self.enable_proofread).pack(anchor=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(process_frame, text="按停顿预加标点", variable=self.pre_punctuate).pack(anchor=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(process_frame, text="干净的段落跳过校对", variable=self.skip_confident).pack(anchor=tk.W, padx=5, pady=2)
+        # 按话题分段需要 numpy，未安装时不可选
+        ttk.Checkbutton(process_frame, text="按话题分段", variable=self.topic_segments,
+                        state=tk.NORMAL if segmentation.available() else tk.DISABLED).pack(anchor=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(process_frame, text="性能分析", variable=self.enable_profile).pack(anchor=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(process_frame, text="记录时间线", variable=self.enable_trace).pack(anchor=tk.W, padx=5, pady=2)
+        
+        parallel_frame = ttk.Frame(process_frame)
+        parallel_frame.pack(fill=tk.X, padx=5, pady=2)
+        ttk.Label(parallel_frame, text="并行文件数:").pack(side=tk.LEFT)
+        ttk.Spinbox(parallel_frame, from_=1, to=8, textvariable=self.max_parallel, width=5).pack(side=tk.LEFT, padx=(5, 0))
+        
+        ttk.Label(process_frame, text="输出格式:").pack(anchor=tk.W, padx=5, pady=(6, 2))
+        formats_frame = ttk.Frame(process_frame)
+        formats_frame.pack(fill=tk.X, padx=5, pady=2)
+        for i, fmt in enumerate(WRITERS):
+            ttk.Checkbutton(formats_frame, text=FORMAT_LABELS.get(fmt, fmt),
+                           variable=self.output_formats[fmt]).grid(row=i // 2, column=i % 2, sticky=tk.W)
         
         # --- API配置 ---
         api_frame = ttk.LabelFrame(parent, text="API配置")
@@ -435,6 +603,8 @@ class MainWindow:
         self.start_button = ttk.Button(control_frame, text="开始处理", command=self.start_processing)
         self.start_button.pack(fill=tk.X, padx=5, pady=2)
         
+        ttk.Button(control_frame, text="预估用量", command=self.estimate_usage).pack(fill=tk.X, padx=5, pady=2)
+        
         self.cancel_button = ttk.Button(control_frame, text="取消任务", command=self.cancel_processing, state=tk.DISABLED)
         self.cancel_button.pack(fill=tk.X, padx=5, pady=2)
         
@@ -451,6 +621,34 @@ class MainWindow:
     
     def create_notebook_tabs(self):
         """创建标签页"""
+        # --- Queue标签 ---
+        self.queue_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.queue_frame, text="任务队列")
+        
+        queue_button_frame = ttk.Frame(self.queue_frame)
+        queue_button_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        ttk.Button(queue_button_frame, text="添加文件", command=self.browse_queue_files).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(queue_button_frame, text="移除所选", command=self.remove_selected_jobs).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(queue_button_frame, text="取消所选", command=self.cancel_selected_jobs).pack(side=tk.LEFT)
+        hint = "可拖放SRT文件到列表" if TkinterDnD else "安装 tkinterdnd2 后可拖放文件"
+        ttk.Label(queue_button_frame, text=f"选中任务查看进度和结果，{hint}").pack(side=tk.RIGHT)
+        
+        columns = ("name", "status", "progress", "eta")
+        self.queue_tree = ttk.Treeview(self.queue_frame, columns=columns, show="headings", selectmode="extended")
+        for column, text, width in zip(columns, ("文件", "状态", "进度", "剩余时间"), (360, 80, 60, 80)):
+            self.queue_tree.heading(column, text=text)
+            self.queue_tree.column(column, width=width, stretch=column == "name")
+        queue_scroll = ttk.Scrollbar(self.queue_frame, orient=tk.VERTICAL, command=self.queue_tree.yview)
+        self.queue_tree.config(yscrollcommand=queue_scroll.set)
+        self.queue_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        queue_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.queue_tree.bind("<<TreeviewSelect>>", self.on_job_selected)
+        
+        if TkinterDnD:
+            self.queue_tree.drop_target_register(DND_FILES)
+            self.queue_tree.dnd_bind("<<Drop>>", self.on_files_dropped)
+        
         # --- Progress标签 ---
         self.progress_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.progress_frame, text="进度")
@@ -471,6 +669,9 @@ class MainWindow:
         
         ttk.Button(segments_button_frame, text="更新预览", command=self.update_preview).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(segments_button_frame, text="重置所有", command=self.reset_segments).pack(side=tk.LEFT)
+        ttk.Checkbutton(segments_button_frame, text="显示修改", variable=self.show_diff,
+                        command=self.toggle_diff_view).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Label(segments_button_frame, text="绿色为校对新增，红色删除线为校对删去").pack(side=tk.RIGHT)
         
         # 段落编辑区域
         self.segments_canvas = tk.Canvas(self.segments_frame)
@@ -483,7 +684,10 @@ class MainWindow:
         )
         
         self.segments_canvas.create_window((0, 0), window=self.segments_scrollable_frame, anchor="nw")
-        self.segments_canvas.configure(yscrollcommand=segments_scrollbar.set)
+        # 滚动或改变大小后比较新进入视野的段落
+        self.segments_canvas.configure(yscrollcommand=lambda *args: (segments_scrollbar.set(*args),
+                                                                     self.schedule_diff_render()))
+        self.segments_canvas.bind("<Configure>", lambda e: self.schedule_diff_render(), add="+")
         
         self.segments_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         segments_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
@@ -524,6 +728,9 @@ class MainWindow:
         
         self.time_label = ttk.Label(status_frame, text="")
         self.time_label.pack(side=tk.RIGHT)
+        
+        self.rate_label = ttk.Label(status_frame, text="")
+        self.rate_label.pack(side=tk.RIGHT, padx=(0, 15))
     
     def toggle_api_key_visibility(self):
         """切换API Key显示/隐藏"""
@@ -568,6 +775,8 @@ class MainWindow:
         # 清空现有组件
         for widget in self.segments_scrollable_frame.winfo_children():
             widget.destroy()
+        self.segment_views = []
+        self.diff_cache.clear()
         
         if not self.segments_data:
             ttk.Label(self.segments_scrollable_frame, text="暂无数据").pack(pady=20)
@@ -575,7 +784,7 @@ class MainWindow:
         
         for i, segment in enumerate(self.segments_data):
             # 段落框架
-            segment_frame = ttk.LabelFrame(self.segments_scrollable_frame, text=f"段落 {i+1} - {segment['time']}")
+            segment_frame = ttk.LabelFrame(self.segments_scrollable_frame, text=self.segment_title(i))
             segment_frame.pack(fill=tk.X, padx=5, pady=5)
             
             # 标题编辑
@@ -591,6 +800,88 @@ class MainWindow:
             text_widget.pack(fill=tk.X, padx=5, pady=2)
             text_widget.insert(tk.END, segment.get('text', ''))
             segment['text_widget'] = text_widget
+            text_widget.edit_modified(False)
+            text_widget.bind("<<Modified>>", lambda e, index=i: self.on_segment_text_modified(index))
+            self.segment_views.append({"frame": segment_frame, "text_widget": text_widget,
+                                       "diff_widget": None, "diff_text": None})
+        self.schedule_diff_render()
+    
+    def segment_title(self, index: int, ratio: float = None) -> str:
+        segment = self.segments_data[index]
+        title = f"段落 {index+1} - {segment['time']}"
+        return title if ratio is None else f"{title}（修改 {ratio:.1%}）"
+    
+    def toggle_diff_view(self):
+        """打开时比较可见段落；关闭时隐藏已生成的差异，缓存保留"""
+        if self.show_diff.get():
+            self.schedule_diff_render()
+            return
+        for index, view in enumerate(self.segment_views):
+            if view["diff_widget"] is not None:
+                view["diff_widget"].pack_forget()
+                view["diff_text"] = None
+                view["frame"].config(text=self.segment_title(index))
+    
+    def on_segment_text_modified(self, index: int):
+        view = self.segment_views[index] if index < len(self.segment_views) else None
+        if view is None:
+            return
+        view["text_widget"].edit_modified(False)
+        self.schedule_diff_render()
+    
+    def schedule_diff_render(self):
+        if self._diff_render_pending or not self.show_diff.get():
+            return
+        self._diff_render_pending = True
+        self.root.after(DIFF_RENDER_DELAY_MS, self.render_visible_diffs)
+    
+    def render_visible_diffs(self):
+        """
+        只比较滚动到视野中的段落：段落框架按顺序排列，
+        跳过视野上方的，遇到第一个在视野下方的即停止
+        """
+        self._diff_render_pending = False
+        if not self.show_diff.get() or not self.segment_views:
+            return
+        top = self.segments_canvas.canvasy(0)
+        bottom = top + self.segments_canvas.winfo_height()
+        for index, view in enumerate(self.segment_views):
+            frame = view["frame"]
+            y = frame.winfo_y()
+            if y > bottom:
+                break
+            if y + frame.winfo_height() >= top:
+                self.render_segment_diff(index)
+    
+    def render_segment_diff(self, index: int):
+        """在正文下方显示与原文的字符级差异，正文未变时沿用已显示的内容"""
+        view = self.segment_views[index]
+        text = view["text_widget"].get(1.0, tk.END).strip()
+        if view["diff_text"] == text:
+            return
+        original = self.segments_data[index].get('original_text', '')
+        opcodes, ratio = self.diff_cache.get(index, original, text)
+        widget = view["diff_widget"]
+        if widget is None:
+            widget = tk.Text(view["frame"], height=3, wrap=tk.WORD, background="#f7f7f7")
+            widget.tag_configure("insert", foreground="#106b21", background="#d8f5dc")
+            widget.tag_configure("delete", foreground="#b3261e", overstrike=True)
+            view["diff_widget"] = widget
+        if not widget.winfo_manager():
+            widget.pack(fill=tk.X, padx=5, pady=2)
+        widget.config(state=tk.NORMAL)
+        widget.delete(1.0, tk.END)
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                widget.insert(tk.END, text[j1:j2])
+                continue
+            if i2 > i1:
+                widget.insert(tk.END, original[i1:i2], "delete")
+            if j2 > j1:
+                widget.insert(tk.END, text[j1:j2], "insert")
+        widget.config(state=tk.DISABLED)
+        view["diff_text"] = text
+        view["frame"].config(text=self.segment_title(index, ratio))
     
     def update_preview(self):
         """更新预览内容"""
@@ -655,40 +946,89 @@ class MainWindow:
             title="导出文件",
             defaultextension=".txt",
             initialname=default_name,
-            filetypes=[("Text files", "*.txt"), ("All files", "*.*")]
+            filetypes=[("Text files", "*.txt"), ("Markdown", "*.md"), ("JSON", "*.json"),
+                       ("WebVTT chapters", "*.vtt"), ("All files", "*.*")]
         )
         
         if file_path:
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
+                # 按扩展名选择写入器，txt 及其他扩展名直接保存预览内容
+                writer_cls = next((cls for fmt, cls in WRITERS.items()
+                                   if fmt != "txt" and file_path.endswith(cls.extension)), None)
+                if writer_cls and self.segments_data:
+                    writer = writer_cls(file_path)
+                    try:
+                        for segment in self.segments_data:
+                            writer.write_segment(self._segment_from_data(segment), segment.get('title', ''))
+                    finally:
+                        writer.close()
+                else:
+                    with open(file_path, 'w', encoding='utf-8') as f:
+                        f.write(content)
                 messagebox.showinfo("成功", f"文件已保存到: {file_path}")
             except Exception as e:
                 messagebox.showerror("错误", f"保存文件失败: {e}")
     
-    def start_processing(self):
-        """开始处理"""
-        # 验证输入
-        if not self.srt_file_path.get():
+    def _segment_from_data(self, segment: Dict[str, Any]) -> MergedSegment:
+        """段落数据转为写入器使用的 MergedSegment"""
+        return MergedSegment(segment.get('time', ''), segment.get('text', ''),
+                             segment.get('start_ms', 0), segment.get('end_ms', 0))
+    
+    def estimate_usage(self):
+        """本地预估请求数、token数和耗时，不调用API"""
+        if not self.srt_file_path.get() or not os.path.exists(self.srt_file_path.get()):
             messagebox.showwarning("警告", "请选择SRT文件")
             return
         
-        if not os.path.exists(self.srt_file_path.get()):
-            messagebox.showerror("错误", "SRT文件不存在")
-            return
+        try:
+            subtitles = parse_srt(read_srt(self.srt_file_path.get()))
+            if self.pre_punctuate.get():
+                options = load_punctuation_options()
+                subtitles = prepunctuate_subtitles(subtitles, options["comma_gap_ms"], options["period_gap_ms"])
+            segments = segment_subtitles(subtitles, self.target_length.get(), self.pre_punctuate.get(),
+                                         _segmentation_options(self.topic_segments.get()))
+            texts = [seg.text for seg in segments]
+            limits = load_limits()
+            estimates = estimate_run(texts if self.enable_titles.get() else [],
+                                     needs_proofread(texts, self.skip_confident.get())
+                                     if self.enable_proofread.get() else [], limits)
+            report = format_estimates(estimates, limits["price_per_1k_prompt"], limits["price_per_1k_completion"])
+            self.add_log(f"用量预估（共{len(segments)}段，RPM={limits['rpm'] or ESTIMATE_DEFAULT_RPM}，"
+                         f"TPM={limits['tpm'] or ESTIMATE_DEFAULT_TPM}）:\n{report}")
+            messagebox.showinfo("用量预估", f"共{len(segments)}段，token数为本地估算值\n\n{report}")
+        except Exception as e:
+            messagebox.showerror("错误", f"预估失败: {e}")
+    
+    def start_processing(self):
+        """开始处理队列；队列为空时把当前选择的SRT文件加入队列"""
+        if not any(not job.finished for job in self.jobs):
+            if not self.srt_file_path.get():
+                messagebox.showwarning("警告", "请选择SRT文件，或在任务队列中添加文件")
+                return
+            if not os.path.exists(self.srt_file_path.get()):
+                messagebox.showerror("错误", "SRT文件不存在")
+                return
+            self.add_jobs([self.srt_file_path.get()])
         
         if not self.api_key.get():
             messagebox.showwarning("警告", "请输入API Key")
             return
         
+        # 队列中的任务共用一个补全后端
+        try:
+            options = load_backend_options()
+            self.queue_backend = create_backend(options["backend"], self.api_key.get(), self.base_url.get(),
+                                                options["max_concurrency"])
+        except Exception as e:
+            messagebox.showerror("错误", f"无法创建补全后端: {e}")
+            return
+        
         # 重置状态
-        self.cancel_flag.clear()
         self.is_running = True
         self.start_time = time.time()
+        self.run_jobs = []
         
-        # 清空之前的数据
-        self.segments_data = []
-        self.progress_listbox.delete(0, tk.END)
+        # 清空之前的日志
         self.logs_text.config(state=tk.NORMAL)
         self.logs_text.delete(1.0, tk.END)
         self.logs_text.config(state=tk.DISABLED)
@@ -699,48 +1039,231 @@ class MainWindow:
         self.status_text.set("处理中...")
         self.progress_var.set(0)
         
-        # 保存配置
+        # 保存配置；队列中的任务共用调度器和一份预算
         self.save_config()
-        
-        # 启动后台线程
-        worker_thread = threading.Thread(target=self.worker_thread, daemon=True)
-        worker_thread.start()
-        
-        self.add_log("开始处理任务")
+        limits = load_limits()
+        configure_scheduler(self.api_key.get(), limits)
+        configure_router(load_model_routing())
+        get_router().reset_stats()
+        self.queue_budget = Budget(limits["max_tokens_per_run"], limits["max_tokens_per_day"])
+        
+        if self.enable_trace.get():
+            get_tracer().start()
+        self.add_log(f"开始处理任务队列，补全后端: {self.queue_backend.describe()}")
+        self.dispatch_jobs()
+    
+    def current_settings(self) -> Dict[str, Any]:
+        """读取界面上的处理设置，任务开始时保存一份，之后修改设置不影响已开始的任务"""
+        return {
+            "target_length": self.target_length.get(),
+            "enable_titles": self.enable_titles.get(),
+            "enable_proofread": self.enable_proofread.get(),
+            "pre_punctuate": self.pre_punctuate.get(),
+            "skip_confident": self.skip_confident.get(),
+            "topic_segments": self.topic_segments.get(),
+            "formats": [fmt for fmt, var in self.output_formats.items() if var.get()] or list(DEFAULT_FORMATS),
+            "output_dir": self.output_dir,
+            "api_key": self.api_key.get(),
+        }
+    
+    def dispatch_jobs(self):
+        """在并行数允许的范围内启动排队中的任务"""
+        if not self.is_running:
+            return
+        try:
+            max_parallel = max(1, int(self.max_parallel.get()))
+        except (tk.TclError, ValueError):
+            max_parallel = 1
+        running = sum(1 for job in self.jobs if job.status not in ("排队中",) and not job.finished)
+        for job in self.jobs:
+            if running >= max_parallel:
+                break
+            if job.status != "排队中":
+                continue
+            job.status = "处理中"
+            job.settings = self.current_settings()
+            job.budget = self.queue_budget
+            job.backend = self.queue_backend
+            target = self.profiled_worker_thread if self.enable_profile.get() else self.worker_thread
+            if self.enable_profile.get() and self.event_timings is None:
+                self.event_timings = {}
+            threading.Thread(target=target, args=(job,), name=f"任务{job.id} {job.name}", daemon=True).start()
+            running += 1
+            self.refresh_job_row(job)
+            if self.current_job is None:
+                self.show_job(job)
+        if running == 0:
+            self.finish_processing()
     
     def cancel_processing(self):
-        """取消处理"""
-        self.cancel_flag.set()
+        """取消处理：正在处理和排队中的任务全部取消"""
+        for job in self.jobs:
+            if job.finished:
+                continue
+            job.cancel_flag.set()
+            if job.status == "排队中":
+                self.mark_job_finished(job, "已取消")
         self.add_log("用户请求取消任务")
     
-    def worker_thread(self):
-        """后台工作线程"""
+    def add_jobs(self, paths: List[str]):
+        """把SRT文件加入队列；处理进行中时新加入的文件会自动开始"""
+        for path in paths:
+            if not path:
+                continue
+            job = QueueJob(self._next_job_id, path, self.event_queue)
+            self._next_job_id += 1
+            self.jobs.append(job)
+            self.jobs_by_id[job.id] = job
+            self.queue_tree.insert("", tk.END, iid=str(job.id), values=(job.name, job.status, "", ""))
+        self.dispatch_jobs()
+    
+    def browse_queue_files(self):
+        """多选SRT文件加入队列"""
+        paths = filedialog.askopenfilenames(
+            title="添加SRT文件到队列",
+            filetypes=[("SRT files", "*.srt"), ("All files", "*.*")]
+        )
+        self.add_jobs(list(paths))
+    
+    def on_files_dropped(self, event):
+        """拖放文件到队列（需要安装 tkinterdnd2）"""
+        paths = [p for p in self.root.tk.splitlist(event.data) if os.path.isfile(p)]
+        self.add_jobs(paths)
+    
+    def remove_selected_jobs(self):
+        """从队列中移除所选任务，正在处理的任务先取消"""
+        for iid in self.queue_tree.selection():
+            job = self.jobs_by_id.get(int(iid))
+            if job is None:
+                continue
+            if not job.finished and job.status != "排队中":
+                messagebox.showwarning("警告", f"{job.name} 正在处理，请先取消")
+                continue
+            self.jobs.remove(job)
+            del self.jobs_by_id[job.id]
+            self.queue_tree.delete(iid)
+            if job is self.current_job:
+                self.current_job = None
+    
+    def cancel_selected_jobs(self):
+        """取消所选任务"""
+        for iid in self.queue_tree.selection():
+            job = self.jobs_by_id.get(int(iid))
+            if job is None or job.finished:
+                continue
+            job.cancel_flag.set()
+            if job.status == "排队中":
+                self.mark_job_finished(job, "已取消")
+    
+    def on_job_selected(self, event=None):
+        selection = self.queue_tree.selection()
+        if selection:
+            job = self.jobs_by_id.get(int(selection[0]))
+            if job is not None and job is not self.current_job:
+                self.show_job(job)
+    
+    def show_job(self, job: QueueJob):
+        """在进度、段落编辑和预览标签页中显示某个任务，其他任务继续在后台处理"""
+        self.store_segment_edits()
+        self.current_job = job
+        self.segments_data = job.segments_data
+        self.progress_listbox.delete(0, tk.END)
+        for step in job.steps:
+            self.progress_listbox.insert(tk.END, step)
+        self.progress_var.set(job.progress)
+        self.update_segments_display()
+        self.update_preview()
+        self.status_text.set(f"{job.name}: {job.status}")
+    
+    def store_segment_edits(self):
+        """切换任务前保存段落编辑区中的修改，并解除与编辑控件的关联"""
+        for segment in self.segments_data:
+            if 'title_widget' in segment:
+                segment['title'] = segment.pop('title_widget').get()
+            if 'text_widget' in segment:
+                segment['text'] = segment.pop('text_widget').get(1.0, tk.END).strip()
+    
+    def refresh_job_row(self, job: QueueJob):
+        if not self.queue_tree.exists(str(job.id)):
+            return
+        eta = job.estimator.eta() if job.estimator and not job.finished else None
+        self.queue_tree.item(str(job.id), values=(
+            job.name, job.status,
+            f"{job.progress:.0f}%" if job.status != "排队中" else "",
+            format_seconds(eta) if eta is not None else "",
+        ))
+    
+    def mark_job_finished(self, job: QueueJob, status: str):
+        job.status = status
+        job.finished = True
+        self.run_jobs.append(job)
+        self.refresh_job_row(job)
+        if job is self.current_job:
+            self.status_text.set(f"{job.name}: {status}")
+        self.dispatch_jobs()
+    
+    def profiled_worker_thread(self, job):
+        """记录性能分析数据的后台工作线程，同时采样界面线程"""
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        profiler = RunProfiler(os.path.join(job.settings["output_dir"], f"kimi_profile_{timestamp}_{job.id}"),
+                               {threading.main_thread().ident: "界面线程"})
+        try:
+            profiler.start()
+        except ValueError as e:
+            # 部分 Python 版本同一时间只允许一个 cProfile，并行任务中只分析第一个
+            job.send_event({"type": "log", "message": f"未能启动性能分析（{e}），本任务不记录"})
+            self.worker_thread(job)
+            return
+        try:
+            self.worker_thread(job)
+        finally:
+            try:
+                profiler.stop()
+            except Exception as e:
+                job.send_event({"type": "log", "message": f"性能分析结果保存失败: {e}"})
+                return
+        job.send_event({"type": "profile_saved", "summary": profiler.summary, "paths": profiler.paths})
+    
+    def worker_thread(self, job):
+        """后台工作线程，处理队列中的一个文件；设置在任务开始时已从界面读取到 job.settings"""
+        settings = job.settings
+        archive = None
         try:
             # 设置print输出重定向
-            with LogCapture(self.event_queue):
+            with LogCapture(job.events):
                 # 步骤1: 读取SRT文件
-                self.send_event({"type": "step_start", "name": "read_file"})
-                srt_lines = read_srt(self.srt_file_path.get())
+                job.send_event({"type": "step_start", "name": "read_file"})
+                srt_text, encoding = read_srt_text(job.path)
                 
-                if self.cancel_flag.is_set():
-                    self.send_event({"type": "cancelled"})
+                if job.cancel_flag.is_set():
+                    job.send_event({"type": "cancelled"})
                     return
                 
                 # 步骤2: 解析SRT
-                self.send_event({"type": "step_start", "name": "parse_srt"})
-                subtitles = parse_srt(srt_lines)
+                job.send_event({"type": "step_start", "name": "parse_srt"})
+                parse_warnings = []
+                subtitles = parse_srt(srt_text, parse_warnings)
+                job.send_event({"type": "log", "message": f"SRT编码: {encoding}，共解析 {len(subtitles)} 条字幕"})
+                for warning in parse_warnings[:MAX_PARSE_WARNINGS_SHOWN]:
+                    job.send_event({"type": "log", "message": f"SRT解析警告: {warning}"})
+                if len(parse_warnings) > MAX_PARSE_WARNINGS_SHOWN:
+                    job.send_event({"type": "log", "message": f"SRT解析共 {len(parse_warnings)} 条警告"})
                 
-                if self.cancel_flag.is_set():
-                    self.send_event({"type": "cancelled"})
+                if job.cancel_flag.is_set():
+                    job.send_event({"type": "cancelled"})
                     return
                 
                 # 步骤3: 合并字幕
-                self.send_event({"type": "step_start", "name": "merge_subtitles"})
-                segments = merge_subtitles(subtitles, self.target_length.get())
+                job.send_event({"type": "step_start", "name": "merge_subtitles"})
+                if settings["pre_punctuate"]:
+                    options = load_punctuation_options()
+                    subtitles = prepunctuate_subtitles(subtitles, options["comma_gap_ms"], options["period_gap_ms"])
+                segments = segment_subtitles(subtitles, settings["target_length"], settings["pre_punctuate"],
+                                             _segmentation_options(settings["topic_segments"]))
                 merged_texts = [seg.text for seg in segments]
                 
-                if self.cancel_flag.is_set():
-                    self.send_event({"type": "cancelled"})
+                if job.cancel_flag.is_set():
+                    job.send_event({"type": "cancelled"})
                     return
                 
                 # 初始化段落数据
@@ -749,97 +1272,199 @@ class MainWindow:
                     segments_data.append({
                         'index': i,
                         'time': segment.time,
+                        'start_ms': segment.start_ms,
+                        'end_ms': segment.end_ms,
                         'text': segment.text,
                         'title': f"段落{i+1}",
                         'original_text': segment.text,
                         'original_title': f"段落{i+1}"
                     })
                 
-                self.send_event({"type": "segments_ready", "segments": segments_data})
+                job.send_event({"type": "segments_ready", "segments": segments_data})
                 
-                # 步骤4: 生成标题（如果启用）
-                if self.enable_titles.get():
-                    self.send_event({"type": "step_start", "name": "generate_titles"})
-                    
-                    try:
-                        # 使用可取消的包装器
-                        wrapper = CancellableKimiWrapper(self.cancel_flag, self.event_queue)
-                        titles = wrapper.generate_titles_with_progress(merged_texts)
-                        
-                        if titles is None:  # 被取消
-                            self.send_event({"type": "cancelled"})
-                            return
-                        
-                        # 更新segments_data中的标题
-                        for i, title in enumerate(titles):
-                            if i < len(segments_data):
-                                segments_data[i]['title'] = title
-                                segments_data[i]['original_title'] = title
-                                
-                    except Exception as e:
-                        self.send_event({"type": "log", "message": f"标题生成失败: {e}"})
-                        # 使用默认标题
-                        for i in range(len(segments_data)):
-                            segments_data[i]['title'] = f"段落{i+1}"
-                            segments_data[i]['original_title'] = f"段落{i+1}"
+                # 打开选中格式的写入器，每段完成全部步骤后立即写出
+                formats = settings["formats"]
+                # 并行的任务可能在同一秒开始，文件名中加上任务编号和原文件名
+                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+                stem = f"{timestamp}_{job.id}_{os.path.splitext(job.name)[0]}"
+                os.makedirs(settings["output_dir"], exist_ok=True)
+                writer = open_writers(formats, settings["output_dir"], f"kimi_output_{stem}")
+                # 每段写出时同时写入归档，与命令行共用一个归档文件
+                archive = open_archive(load_archive_options()["archive_path"])
+                run_id = start_archive_run(archive, job.path, settings["target_length"], writer.paths)
+                written = 0
+                verified = set()  # 校对结果由模型校对且有改动的段落，只有这些写入归档
+                dead_letters = DeadLetterQueue()
+                marked = []  # 以失败标注写出的段落，重试成功后重新写出
                 
-                # 步骤5: 校对正文（如果启用）
-                if self.enable_proofread.get():
-                    self.send_event({"type": "step_start", "name": "proofread"})
-                    
-                    try:
-                        # 使用可取消的包装器
-                        wrapper = CancellableKimiWrapper(self.cancel_flag, self.event_queue)
-                        proofread_texts = wrapper.proofread_segments_with_progress(merged_texts)
-                        
-                        if proofread_texts is None:  # 被取消
-                            self.send_event({"type": "cancelled"})
-                            return
-                        
-                        # 更新segments_data中的正文
-                        for i, proofread_text in enumerate(proofread_texts):
-                            if i < len(segments_data):
-                                segments_data[i]['text'] = proofread_text
-                                
-                    except Exception as e:
-                        self.send_event({"type": "log", "message": f"正文校对失败: {e}"})
-                        # 保持原始正文
+                def writable(i):
+                    """已完成或多次重试仍失败（加标注输出）的段落"""
+                    return ((done_titles[i] is not None or dead_letters.failed(TASK_TITLE, i)) and
+                            (done_proofread[i] is not None or dead_letters.failed(TASK_PROOFREAD, i)))
                 
-                # 完成
-                if not self.cancel_flag.is_set():
-                    # 生成输出文件
-                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    output_path = os.path.join(self.output_dir, f"kimi_output_{timestamp}.txt")
-                    
-                    # 格式化输出
-                    lines = []
-                    for segment in segments_data:
-                        title = segment['title']
-                        text = segment['text']
-                        time_str = segment['time']
-                        lines.append(f"{time_str} {title}\n{text}")
-                    
-                    output_content = '\n\n'.join(lines)
+                def flush_segments(upto):
+                    """按顺序写出前 upto 段，预算用尽未完成的段落不写出（与命令行一致，留待 --resume）"""
+                    nonlocal written
+                    while written < min(upto, len(segments_data)):
+                        if writable(written):
+                            segment = segments_data[written]
+                            writer.write_segment(self._segment_from_data(segment), segment['title'])
+                            if dead_letters.failed(TASK_TITLE, written) or dead_letters.failed(TASK_PROOFREAD, written):
+                                marked.append(written)
+                            else:
+                                archive_segment(archive, run_id, written, segments[written],
+                                                segment['title'] if enable_titles else None,
+                                                segment['text'] if enable_proofread else None,
+                                                verified=written in verified)
+                        written += 1
+                
+                enable_titles = settings["enable_titles"]
+                enable_proofread = settings["enable_proofread"]
+                
+                def on_title(i, title):
+                    segments_data[i]['title'] = FAILED_TITLE if title is None else title
+                    if not enable_proofread:
+                        flush_segments(i + 1)
+                
+                def on_proofread(i, text):
+                    segments_data[i]['text'] = failed_text(merged_texts[i]) if text is None else text
+                    flush_segments(i + 1)
+                
+                # 预算控制：队列中的任务共用一份预算，用尽后不再发起请求，未完成的段落记为待处理（None）
+                limits = load_limits()
+                budget = JobBudget(job.budget)
+                backend = job.backend
+                done_titles = [segment['title'] for segment in segments_data]
+                done_proofread = list(merged_texts)
+                scheduler_job = get_scheduler().new_job()
+                job.send_event({
+                    "type": "work_planned",
+                    "rpm": limits["rpm"],
+                    "tpm": limits["tpm"],
+                    "tasks": {
+                        "title": _plan_task(merged_texts if enable_titles else [], estimate_title_tokens),
+                        "proofread": _plan_task(needs_proofread(merged_texts, settings["skip_confident"])
+                                                if enable_proofread else [], estimate_proofread_tokens),
+                    },
+                })
+                
+                try:
+                    # 步骤4: 生成标题（如果启用）
+                    if enable_titles:
+                        job.send_event({"type": "step_start", "name": "generate_titles"})
+                        
+                        try:
+                            # 使用可取消的包装器
+                            wrapper = CancellableKimiWrapper(job.cancel_flag, job.events, backend, budget, scheduler_job,
+                                                             dead_letters, limits)
+                            titles = wrapper.generate_titles_with_progress(merged_texts, on_result=on_title)
+                            
+                            if titles is None:  # 被取消
+                                job.send_event({"type": "cancelled"})
+                                return
+                            
+                            done_titles = titles + [None] * (len(merged_texts) - len(titles))
+                            
+                            # 更新segments_data中的标题
+                            for i, title in enumerate(titles):
+                                if i < len(segments_data):
+                                    segments_data[i]['title'] = FAILED_TITLE if title is None else title
+                                    segments_data[i]['original_title'] = segments_data[i]['title']
+                                    
+                        except Exception as e:
+                            job.send_event({"type": "log", "message": f"标题生成失败: {e}"})
+                            # 使用默认标题
+                            for i in range(written, len(segments_data)):
+                                segments_data[i]['title'] = f"段落{i+1}"
+                                segments_data[i]['original_title'] = f"段落{i+1}"
+                        job.send_event({"type": "step_done", "task": "title"})
                     
-                    with open(output_path, 'w', encoding='utf-8') as f:
-                        f.write(output_content)
+                    # 步骤5: 校对正文（如果启用）
+                    if enable_proofread:
+                        job.send_event({"type": "step_start", "name": "proofread"})
+                        
+                        try:
+                            # 使用可取消的包装器
+                            wrapper = CancellableKimiWrapper(job.cancel_flag, job.events, backend, budget, scheduler_job,
+                                                             dead_letters, limits)
+                            proofread_texts = wrapper.proofread_segments_with_progress(
+                                merged_texts, on_result=on_proofread, skip_confident=settings["skip_confident"],
+                                verified=verified)
+                            
+                            if proofread_texts is None:  # 被取消
+                                job.send_event({"type": "cancelled"})
+                                return
+                            
+                            done_proofread = proofread_texts + [None] * (len(merged_texts) - len(proofread_texts))
+                            
+                            # 更新segments_data中的正文
+                            for i, proofread_text in enumerate(proofread_texts):
+                                if i < len(segments_data):
+                                    segments_data[i]['text'] = (failed_text(merged_texts[i]) if proofread_text is None
+                                                                else proofread_text)
+                                    
+                        except Exception as e:
+                            job.send_event({"type": "log", "message": f"正文校对失败: {e}"})
+                            # 保持原始正文
+                        job.send_event({"type": "step_done", "task": "proofread"})
                     
-                    self.send_event({
+                    # 完成：写出剩余段落
+                    if not job.cancel_flag.is_set():
+                        flush_segments(len(segments_data))
+                finally:
+                    writer.close()
+                
+                if not job.cancel_flag.is_set() and any(writable(i) and not dead_letters.failed(TASK_TITLE, i) and
+                                                        not dead_letters.failed(TASK_PROOFREAD, i) for i in marked):
+                    # 重试成功的段落此前以失败标注写出，按最终结果重新写出全部段落
+                    with open_writers(formats, settings["output_dir"], f"kimi_output_{stem}") as writer:
+                        for i, segment in enumerate(segments_data):
+                            if writable(i):
+                                writer.write_segment(self._segment_from_data(segment), segment['title'])
+                    for i in marked:
+                        if not dead_letters.failed(TASK_TITLE, i) and not dead_letters.failed(TASK_PROOFREAD, i):
+                            archive_segment(archive, run_id, i, segments[i],
+                                            segments_data[i]['title'] if enable_titles else None,
+                                            segments_data[i]['text'] if enable_proofread else None,
+                                            verified=i in verified)
+                    job.send_event({"type": "log", "message": "重试成功的段落已更新到输出文件"})
+                
+                job.send_event({"type": "log", "message": f"本文件共 {budget.run_requests} 次请求，约 {budget.run_tokens} tokens"})
+                if None in done_titles or None in done_proofread:
+                    pending_path = os.path.join(settings["output_dir"], f"kimi_pending_{stem}.json")
+                    save_pending(pending_path, job.path, settings["target_length"],
+                                 segments, done_titles, done_proofread, dead_letters.to_list())
+                    for line in dead_letters.summary():
+                        job.send_event({"type": "log", "message": f"多次重试仍失败，已在输出中标注: {line}"})
+                    pending_count = sum(1 for i in range(len(segments)) if not writable(i))
+                    if pending_count:
+                        job.send_event({"type": "log", "message": f"预算已用尽，{pending_count} 段未完成，未写入输出文件"})
+                    job.send_event({"type": "log", "message": f"未完成和失败的段落已保存到 {pending_path}，"
+                                                               f"可使用 python main.py --resume {pending_path} 继续处理"})
+                
+                if not job.cancel_flag.is_set():
+                    job.send_event({
                         "type": "completed", 
                         "segments": segments_data,
-                        "output_path": output_path
+                        "output_path": ", ".join(writer.paths)
                     })
         
         except Exception as e:
             error_msg = f"处理过程中发生错误: {str(e)}"
-            self.send_event({
+            job.send_event({
                 "type": "error", 
                 "message": error_msg,
                 "traceback": traceback.format_exc()
             })
+        finally:
+            # 取消、出错时也关闭归档
+            if archive:
+                archive.close()
     
     def send_event(self, event: Dict[str, Any]):
         """发送事件到主线程"""
+        if get_tracer().enabled:
+            event["_trace"] = get_tracer().mark_sent()
         self.event_queue.put(event)
     
     def poll_events(self):
@@ -847,7 +1472,18 @@ class MainWindow:
         try:
             while True:
                 event = self.event_queue.get_nowait()
+                trace_mark = event.pop("_trace", None)
+                started = time.perf_counter()
                 self.handle_event(event)
+                # 完成/错误事件会弹出对话框，等待用户的时间不计入界面耗时
+                finished = started if event.get("type") in ("completed", "error") else time.perf_counter()
+                if trace_mark:
+                    get_tracer().mark_handled(event.get("type"), trace_mark, started, finished)
+                if self.event_timings is None or finished == started:
+                    continue
+                timing = self.event_timings.setdefault(event.get("type"), [0, 0.0])
+                timing[0] += 1
+                timing[1] += finished - started
         except queue.Empty:
             pass
         
@@ -855,13 +1491,18 @@ class MainWindow:
         if self.is_running and self.start_time:
             elapsed = time.time() - self.start_time
             self.time_label.config(text=f"已运行: {int(elapsed)}秒")
+            self.update_rate_display()
         
         # 继续轮询
         self.root.after(150, self.poll_events)
     
     def handle_event(self, event: Dict[str, Any]):
-        """处理事件"""
+        """处理事件；事件按任务编号更新对应任务，只有当前查看的任务会刷新进度和段落显示"""
         event_type = event.get("type")
+        job = self.jobs_by_id.get(event.get("job"))
+        if job is None:
+            return
+        current = job is self.current_job
         
         if event_type == "step_start":
             step_name = event.get("name")
@@ -873,75 +1514,165 @@ class MainWindow:
                 "proofread": "校对正文"
             }
             step_text = step_map.get(step_name, step_name)
-            self.add_progress_step(f"开始: {step_text}")
-            self.add_log(f"开始步骤: {step_text}")
+            self.add_job_step(job, f"开始: {step_text}")
+            self.add_log(f"[{job.name}] 开始步骤: {step_text}")
             
         elif event_type == "step_progress":
             name = event.get("name")
-            current = event.get("current")
+            current_count = event.get("current")
             total = event.get("total")
-            progress = (current / total) * 100
-            self.progress_var.set(progress)
-            self.add_log(f"{name}: {current}/{total}")
+            job.progress = (current_count / total) * 100
+            if current:
+                self.progress_var.set(job.progress)
+            self.refresh_job_row(job)
+            self.add_log(f"[{job.name}] {name}: {current_count}/{total}")
             
         elif event_type == "segments_ready":
-            self.segments_data = event.get("segments", [])
-            self.update_segments_display()
-            self.add_log(f"段落数据准备完成，共{len(self.segments_data)}段")
+            job.segments_data = event.get("segments", [])
+            if current:
+                self.store_segment_edits()
+                self.segments_data = job.segments_data
+                self.update_segments_display()
+            self.add_log(f"[{job.name}] 段落数据准备完成，共{len(job.segments_data)}段")
+            
+        elif event_type == "work_planned":
+            job.estimator = ProgressEstimator(event.get("rpm", 0), event.get("tpm", 0))
+            for task, (segments, latency, tokens) in event.get("tasks", {}).items():
+                job.estimator.plan(task, segments, latency, tokens)
+            
+        elif event_type == "api_call":
+            if job.estimator:
+                job.estimator.record_call(event.get("task"), event.get("seconds", 0), event.get("tokens", 0))
+            
+        elif event_type == "rate_limited":
+            if job.estimator:
+                job.estimator.record_backoff(event.get("delay", 0))
+            
+        elif event_type == "step_done":
+            if job.estimator:
+                job.estimator.skip_remaining(event.get("task"))
             
         elif event_type == "title_generated":
+            if job.estimator:
+                job.estimator.record_segment("title")
             index = event.get("index")
             title = event.get("title")
-            self.add_log(f"第{index+1}段标题生成: {title}")
+            self.add_log(f"[{job.name}] 第{index+1}段标题生成: {title}")
             
         elif event_type == "proofread_generated":
             index = event.get("index")
-            self.add_log(f"第{index+1}段正文校对完成")
+            if event.get("skipped"):
+                # 跳过的段落没有计入剩余时间估算
+                self.add_log(f"[{job.name}] 第{index+1}段清洁度达到阈值，跳过校对")
+                return
+            if job.estimator:
+                job.estimator.record_segment("proofread")
+            self.add_log(f"[{job.name}] 第{index+1}段正文校对完成")
             
         elif event_type == "completed":
-            self.segments_data = event.get("segments", [])
-            output_path = event.get("output_path", "")
-            
-            self.update_segments_display()
-            self.update_preview()
+            job.output_path = event.get("output_path", "")
+            if current:
+                self.store_segment_edits()
+            job.segments_data = event.get("segments", [])
+            job.progress = 100.0
+            if current:
+                self.segments_data = job.segments_data
+                self.update_segments_display()
+                self.update_preview()
             
-            self.add_progress_step("任务完成")
-            self.add_log(f"任务完成，文件已保存: {output_path}")
-            
-            self.finish_processing()
-            messagebox.showinfo("完成", f"任务已完成！\n文件保存到: {output_path}")
+            self.add_job_step(job, "任务完成")
+            self.add_log(f"[{job.name}] 任务完成，文件已保存: {job.output_path}")
+            self.mark_job_finished(job, "已完成")
             
         elif event_type == "error":
             message = event.get("message", "未知错误")
             traceback_info = event.get("traceback", "")
             
-            self.add_log(f"错误: {message}")
+            self.add_log(f"[{job.name}] 错误: {message}")
             if traceback_info:
                 self.add_log(f"详细信息: {traceback_info}")
-            
-            self.finish_processing()
-            messagebox.showerror("错误", message)
+            job.error = message
+            self.mark_job_finished(job, "出错")
             
         elif event_type == "cancelled":
-            self.add_progress_step("任务已取消")
-            self.add_log("任务已被用户取消")
-            self.finish_processing()
+            self.add_job_step(job, "任务已取消")
+            self.add_log(f"[{job.name}] 任务已被用户取消")
+            self.mark_job_finished(job, "已取消")
             
         elif event_type == "log":
             message = event.get("message", "")
-            self.add_log(message)
+            self.add_log(f"[{job.name}] {message}")
+            
+        elif event_type == "profile_saved":
+            self.add_log(f"[{job.name}] 性能分析汇总:\n{event.get('summary', '')}")
+            if self.event_timings:
+                lines = [f"  {name}: {count} 次，{seconds:.3f} 秒"
+                         for name, (count, seconds) in sorted(self.event_timings.items(), key=lambda item: -item[1][1])]
+                self.add_log("界面事件处理耗时:\n" + "\n".join(lines))
+            self.add_log(f"性能分析文件已保存: {', '.join(event.get('paths', []))}")
+            self.event_timings = None
+    
+    def add_job_step(self, job: QueueJob, step: str):
+        """记录任务的进度步骤，当前查看的任务同时显示在进度标签页"""
+        job.steps.append(step)
+        if job is self.current_job:
+            self.add_progress_step(step)
+    
+    def update_rate_display(self):
+        """状态栏显示当前查看任务的剩余时间，以及所有任务合计的请求速率"""
+        estimators = [job.estimator for job in self.jobs if job.estimator and not job.finished]
+        if not estimators:
+            self.rate_label.config(text="")
+            return
+        job = self.current_job
+        eta = job.estimator.eta() if job and job.estimator and not job.finished else None
+        rates = [estimator.rates() for estimator in estimators]
+        requests_per_min = sum(r for r, _ in rates)
+        tokens_per_min = sum(t for _, t in rates)
+        eta_text = "估算中" if eta is None else format_seconds(eta)
+        self.rate_label.config(text=f"剩余约: {eta_text} | {requests_per_min:.1f} 次/分 | {tokens_per_min:.0f} tokens/分")
+        for job in self.jobs:
+            if job.estimator and not job.finished:
+                self.refresh_job_row(job)
     
     def finish_processing(self):
-        """完成处理，恢复界面状态"""
+        """队列全部结束，恢复界面状态并汇总结果"""
         self.is_running = False
         self.start_button.config(state=tk.NORMAL)
         self.cancel_button.config(state=tk.DISABLED)
         self.status_text.set("就绪")
-        self.progress_var.set(0)
+        self.rate_label.config(text="")
         
         if self.start_time:
             elapsed = time.time() - self.start_time
             self.time_label.config(text=f"总耗时: {int(elapsed)}秒")
+        
+        # 汇总弹窗只出现一次，避免每个文件完成时都打断用户
+        counts = {}
+        for job in self.run_jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        summary = "，".join(f"{status} {count} 个" for status, count in counts.items())
+        self.add_log(f"任务队列处理结束：{summary}")
+        for line in get_router().summary():
+            self.add_log(f"模型用量 {line}")
+        if get_tracer().enabled:
+            tracer = get_tracer()
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            try:
+                path = tracer.stop(os.path.join(self.output_dir, f"kimi_trace_{timestamp}.json"))
+                self.add_log(f"时间线已保存: {path}（chrome://tracing 或 ui.perfetto.dev 打开）")
+                if tracer.event_waits:
+                    waits = tracer.event_waits
+                    self.add_log(f"界面事件排队延迟: {len(waits)} 个事件，平均 {sum(waits) / len(waits) * 1000:.1f} 毫秒，"
+                                 f"最长 {max(waits) * 1000:.1f} 毫秒")
+            except OSError as e:
+                self.add_log(f"时间线保存失败: {e}")
+        errors = [f"{job.name}: {job.error}" for job in self.run_jobs if job.error]
+        if errors:
+            messagebox.showerror("完成", f"任务队列处理结束：{summary}\n\n" + "\n".join(errors))
+        else:
+            messagebox.showinfo("完成", f"任务队列处理结束：{summary}\n"
+                                        f"文件保存到: {self.output_dir}")
     
     def run(self):
         """运行应用"""
@@ -0,0 +1,186 @@
+"""
+性能分析
+
+供 main.py --profile 和 GUI「性能分析」开关使用：
+- cProfile 记录处理线程的全部函数调用，保存为 .pstats（可用 snakeviz、gprof2dot、flameprof 查看）
+- 采样线程定时抓取处理线程（GUI 下还包括界面线程）的调用栈，保存为折叠栈 .folded，
+  flamegraph.pl、speedscope 可直接打开
+- 汇总最耗时的函数，并统计调度器等待、time.sleep、网络 I/O 和 API 调用各占多少时间
+"""
+import collections
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+SAMPLE_INTERVAL_SECONDS = 0.005
+TOP_FUNCTIONS = 15
+
+# 网络 I/O：socket/ssl 的底层读写、连接和域名解析
+_NETWORK_BUILTINS = ("_ssl._SSLSocket", "_socket.socket", "getaddrinfo", "of 'select.")
+
+
+def _is_scheduler_wait(func) -> bool:
+    filename, _, name = func
+    return name == "acquire" and filename.replace("\\", "/").endswith("/scheduler.py")
+
+
+def _is_sleep(func) -> bool:
+    return func[2] == "<built-in method time.sleep>"
+
+
+def _is_network(func) -> bool:
+    return func[0] == "~" and any(key in func[2] for key in _NETWORK_BUILTINS)
+
+
+def _is_api(func) -> bool:
+    # openai 的 create 方法是一次 API 调用的入口（含网络、客户端内部重试和解析响应），
+    # 库内部会多次回调自身代码，按整个库统计会重复计算
+    filename, _, name = func
+    return name == "create" and "/openai/resources/" in filename.replace("\\", "/")
+
+
+def _is_srt(func) -> bool:
+    filename, _, name = func
+    return (filename.replace("\\", "/").endswith("/main.py")
+            and name in ("read_srt_text", "parse_srt", "merge_subtitles"))
+
+
+# 分类统计，各项可能互相包含（如 API 调用包含网络 I/O）
+CATEGORIES = [
+    ("调度器等待（限流/429退避）", _is_scheduler_wait),
+    ("time.sleep 重试等待", _is_sleep),
+    ("网络 I/O（socket/ssl）", _is_network),
+    ("API 调用合计（openai 客户端）", _is_api),
+    ("SRT 读取、解析与合并", _is_srt),
+]
+
+
+def category_time(stats: pstats.Stats, predicate) -> float:
+    """
+    统计某类函数占用的时间：只累计从该类以外进入该类的调用，
+    避免同类函数互相调用时重复计算
+    """
+    total = 0.0
+    for func, (_, _, tt, ct, callers) in stats.stats.items():
+        if not predicate(func):
+            continue
+        if not callers:
+            total += ct
+            continue
+        for caller, caller_stats in callers.items():
+            if not predicate(caller):
+                total += caller_stats[3]
+    return total
+
+
+def _func_label(func) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def summarize(stats: pstats.Stats, wall_seconds: float, top: int = TOP_FUNCTIONS) -> str:
+    """生成文本汇总：分类耗时和自身耗时最多的函数"""
+    lines = [f"总耗时 {wall_seconds:.2f} 秒（cProfile 记录 {stats.total_tt:.2f} 秒）"]
+    for name, predicate in CATEGORIES:
+        seconds = category_time(stats, predicate)
+        share = seconds / wall_seconds * 100 if wall_seconds > 0 else 0.0
+        lines.append(f"  {name}: {seconds:.2f} 秒（{share:.1f}%）")
+    lines.append(f"自身耗时最多的 {top} 个函数:")
+    lines.append(f"  {'自身(秒)':>10}{'累计(秒)':>10}{'调用次数':>10}  函数")
+    ranked = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    for func, (_, nc, tt, ct, _) in ranked:
+        lines.append(f"  {tt:>10.3f}{ct:>10.3f}{nc:>10}  {_func_label(func)}")
+    return "\n".join(lines)
+
+
+class StackSampler:
+    """
+    定时采样指定线程的调用栈，按折叠栈格式累计（"线程;函数;函数 次数"）
+    threads 为 线程ID -> 名称
+    """
+    def __init__(self, threads: Dict[int, str], interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.threads = threads
+        self.interval = interval
+        self.counts: Dict[str, int] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, name in self.threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(name)
+                self.counts[";".join(reversed(stack))] += 1
+
+    def write_folded(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+
+class RunProfiler:
+    """
+    在当前线程中记录一次处理过程
+    output_prefix 为输出文件前缀，结束后生成 .pstats、.folded 和 .txt 汇总
+    extra_threads 为额外采样的线程（线程ID -> 名称），如 GUI 的界面线程
+    """
+    def __init__(self, output_prefix: str, extra_threads: Dict[int, str] = None):
+        self.output_prefix = output_prefix
+        threads = dict(extra_threads or {})
+        threads[threading.get_ident()] = threading.current_thread().name
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(threads)
+        self.started_at = 0.0
+        self.summary = ""
+        self.paths: List[str] = []
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self) -> str:
+        """停止记录并保存结果，返回文本汇总"""
+        self.profile.disable()
+        wall_seconds = time.perf_counter() - self.started_at
+        self.sampler.stop()
+        stats_path = self.output_prefix + ".pstats"
+        folded_path = self.output_prefix + ".folded"
+        summary_path = self.output_prefix + ".txt"
+        self.profile.dump_stats(stats_path)
+        self.sampler.write_folded(folded_path)
+        self.summary = summarize(pstats.Stats(stats_path), wall_seconds)
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(self.summary + "\n")
+        self.paths = [stats_path, folded_path, summary_path]
+        return self.summary
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
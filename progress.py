@@ -0,0 +1,134 @@
+"""
+处理进度与剩余时间估算
+
+根据已完成调用的实际耗时、每段平均调用次数（含校验重试）、并发数和当前限流状态，
+估算所有已启用步骤的剩余时间，并统计最近一分钟的请求数和 token 数。
+估算结果做指数平滑，避免界面上的数字来回跳动。
+"""
+import collections
+import math
+import time
+from typing import Deque, Dict, Optional, Tuple
+
+from budget import REQUEST_OVERHEAD_SECONDS
+
+RATE_WINDOW_SECONDS = 60.0
+LATENCY_SMOOTHING = 0.3   # 单次调用耗时的平滑系数
+ETA_SMOOTHING_SECONDS = 5.0  # 剩余时间的平滑时间常数，越大越稳定
+
+
+class _TaskStats:
+    """单个步骤的进度和观测值"""
+    __slots__ = ("remaining", "done", "calls", "latency", "tokens_per_call")
+
+    def __init__(self, segments: int, latency: float, tokens_per_call: float):
+        self.remaining = segments
+        self.done = 0
+        self.calls = 0
+        self.latency = latency
+        self.tokens_per_call = tokens_per_call
+
+    @property
+    def calls_per_segment(self) -> float:
+        return max(1.0, self.calls / self.done) if self.done else 1.0
+
+
+class ProgressEstimator:
+    """
+    剩余时间估算器，只在界面线程中使用
+    plan() 登记各步骤的段落数和预估值，之后随调用完成、段落完成和限流事件更新
+    """
+    def __init__(self, rpm: int = 0, tpm: int = 0, concurrency: int = 1):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.concurrency = max(1, concurrency)
+        self.tasks: Dict[str, _TaskStats] = {}
+        self.blocked_until = 0.0
+        self._window: Deque[Tuple[float, int]] = collections.deque()
+        self._eta: Optional[float] = None
+        self._eta_at = 0.0
+
+    def plan(self, task: str, segments: int, latency: float = REQUEST_OVERHEAD_SECONDS, tokens_per_call: float = 0):
+        """登记一个步骤；latency/tokens_per_call 为开始前的预估值，有实际调用后逐步被观测值取代"""
+        if segments > 0:
+            self.tasks[task] = _TaskStats(segments, latency, tokens_per_call)
+
+    def record_call(self, task: str, seconds: float, tokens: int, now: float = None):
+        """记录一次成功的 API 调用"""
+        now = time.time() if now is None else now
+        self._window.append((now, tokens))
+        stats = self.tasks.get(task)
+        if stats is None:
+            return
+        stats.calls += 1
+        if stats.calls == 1:
+            stats.latency, stats.tokens_per_call = seconds, tokens
+        else:
+            stats.latency += LATENCY_SMOOTHING * (seconds - stats.latency)
+            stats.tokens_per_call += LATENCY_SMOOTHING * (tokens - stats.tokens_per_call)
+
+    def record_segment(self, task: str):
+        """一段的某个步骤完成（无论是否调用成功）"""
+        stats = self.tasks.get(task)
+        if stats is not None and stats.remaining > 0:
+            stats.remaining -= 1
+            stats.done += 1
+
+    def skip_remaining(self, task: str):
+        """步骤提前结束（预算用尽、取消或出错），剩余段落不再计入"""
+        stats = self.tasks.get(task)
+        if stats is not None:
+            stats.remaining = 0
+
+    def record_backoff(self, delay: float, now: float = None):
+        """记录一次 429 退避"""
+        now = time.time() if now is None else now
+        self.blocked_until = max(self.blocked_until, now + delay)
+
+    def rates(self, now: float = None) -> Tuple[float, float]:
+        """最近一分钟的 (请求数/分钟, tokens/分钟)"""
+        now = time.time() if now is None else now
+        while self._window and self._window[0][0] <= now - RATE_WINDOW_SECONDS:
+            self._window.popleft()
+        if not self._window:
+            return 0.0, 0.0
+        # 刚开始运行不足一分钟时按实际经过的时间折算
+        span = max(now - self._window[0][0], 10.0)
+        span = min(span, RATE_WINDOW_SECONDS)
+        scale = 60.0 / span
+        return len(self._window) * scale, sum(t for _, t in self._window) * scale
+
+    def raw_eta(self, now: float = None) -> float:
+        """未平滑的剩余秒数：调用耗时、RPM、TPM 三者中最慢的约束，加上当前退避剩余时间"""
+        now = time.time() if now is None else now
+        calls = tokens = busy = 0.0
+        for stats in self.tasks.values():
+            remaining_calls = stats.remaining * stats.calls_per_segment
+            calls += remaining_calls
+            tokens += remaining_calls * stats.tokens_per_call
+            busy += remaining_calls * stats.latency
+        if calls <= 0:
+            return 0.0
+        eta = busy / self.concurrency
+        if self.rpm > 0:
+            eta = max(eta, calls / self.rpm * 60.0)
+        if self.tpm > 0:
+            eta = max(eta, tokens / self.tpm * 60.0)
+        return eta + max(0.0, self.blocked_until - now)
+
+    def eta(self, now: float = None) -> Optional[float]:
+        """平滑后的剩余秒数；还没有任何观测值时返回 None"""
+        now = time.time() if now is None else now
+        if not any(stats.calls or stats.done for stats in self.tasks.values()):
+            return None
+        raw = self.raw_eta(now)
+        if self._eta is None or raw == 0:
+            self._eta = raw
+        else:
+            # 上一次的估计值先按经过的时间递减，再向新的估计值靠拢
+            elapsed = now - self._eta_at
+            previous = max(0.0, self._eta - elapsed)
+            weight = 1.0 - math.exp(-elapsed / ETA_SMOOTHING_SECONDS)
+            self._eta = previous + weight * (raw - previous)
+        self._eta_at = now
+        return self._eta
@@ -0,0 +1,151 @@
+"""
+按字幕间隔预加标点
+
+ASR 字幕的断句位置和停顿长短本身就是很强的句子边界信号：
+- 相邻两条字幕之间停顿较短时加逗号，停顿较长时加句号
+- 同一条字幕内 ASR 用空格表示的停顿（两侧均为中文）改为逗号
+在调用 API 之前完成，校对只需修正本地标点和错别字；
+清洁度得分（标点密度、句长分布、常见错别字）达到阈值的段落可以直接跳过校对请求，
+人工校对过的字幕通常整段都能跳过。
+"""
+import re
+from typing import List, Optional
+
+DEFAULT_COMMA_GAP_MS = 300    # 停顿达到此值加逗号
+DEFAULT_PERIOD_GAP_MS = 800   # 停顿达到此值加句号
+MAX_CLAUSE_CHARS = 30         # 置信度检查：两个标点之间的最大字数，超过说明有漏掉的停顿
+MAX_SENTENCE_CHARS = 120      # 置信度检查：两个句末标点之间的最大字数
+DEFAULT_SKIP_SCORE = 0.8      # 清洁度得分达到此值的段落跳过校对
+CLEAN_CLAUSE_CHARS = (4, 20)  # 清洁度：分句平均字数（英文单词按 2 字计）在此范围内时标点密度得满分
+ISSUE_PENALTY = 0.25          # 清洁度：每 500 字中每个过长分句/句子或常见错别字扣的分数
+
+# 常见错别字（只收录几乎不会是正确用法的写法），命中说明段落仍需校对
+COMMON_TYPOS = (
+    "因该", "以经", "在次", "必竟", "一但", "按装", "好象", "渡假", "份外", "辨论", "既使",
+    "再接再励", "迫不急待", "甘败下风", "默守成规", "穿流不息", "谈笑风声", "一股作气", "世外桃园",
+    "莫不关心", "功亏一匮", "震耳欲胧", "直接了当", "变本加励",
+)
+
+_CJK = r"\u3400-\u9fff\uf900-\ufaff"
+_CJK_SPACE_RE = re.compile(rf"(?<=[{_CJK}])\s+(?=[{_CJK}])")
+_ENDS_WITH_PUNCT_RE = re.compile(r"[，。！？；：、,.!?;:…—\-\"'”’）)》」』]$")
+_QUESTION_END_RE = re.compile(r"(?:吗|么)$")
+_LATIN_PUNCT = ",.!?;:"
+_CLAUSE_SPLIT_RE = re.compile(r"[，。！？；：、,.!?;:…]+")
+_SENTENCE_SPLIT_RE = re.compile(r"[。！？.!?…]+")
+_TERMINAL_RE = re.compile(r"[。！？.!?…”’）)》」』]$")
+_REPEAT_RE = re.compile(rf"([{_CJK}]{{2,4}})\1")
+_FILLER_RE = re.compile(r"(?:^|[，。！？])(?:嗯|呃|啊|额|那个|就是说)+(?=[，。！？]|$)")
+_TYPO_RE = re.compile("|".join(map(re.escape, COMMON_TYPOS)))
+_LATIN_WORD_RE = re.compile(r"[A-Za-z0-9]+(?:['’][A-Za-z]+)?")
+
+
+def _is_latin_end(text: str) -> bool:
+    return text[-1].isascii() and text[-1].isalnum()
+
+
+def replace_pause_spaces(text: str):
+    """同一条字幕内中文之间的空格（ASR 的停顿）改为逗号，返回 (文本, 替换数)"""
+    return _CJK_SPACE_RE.subn('，', text.strip())
+
+
+def gap_punctuation(text: str, gap_ms: int, comma_gap_ms: int = DEFAULT_COMMA_GAP_MS,
+                    period_gap_ms: int = DEFAULT_PERIOD_GAP_MS) -> str:
+    """按停顿时长返回接在 text 后面的标点，text 已有标点或停顿不足时返回空字符串"""
+    if not text or _ENDS_WITH_PUNCT_RE.search(text) or gap_ms < comma_gap_ms:
+        return ''
+    latin = _is_latin_end(text)
+    if gap_ms < period_gap_ms:
+        return ',' if latin else '，'
+    if latin:
+        return '.'
+    return '？' if _QUESTION_END_RE.search(text) else '。'
+
+
+def prepunctuate(texts: List[str], gaps_ms: List[int], comma_gap_ms: int = DEFAULT_COMMA_GAP_MS,
+                 period_gap_ms: int = DEFAULT_PERIOD_GAP_MS):
+    """
+    按停顿给每条字幕加标点，gaps_ms[i] 为第 i 条结束到下一条开始的毫秒数，最后一条以句号结尾
+    返回 (加标点后的文本列表, 添加的标点数)
+    """
+    result = []
+    added = 0
+    for i, text in enumerate(texts):
+        text, count = replace_pause_spaces(text)
+        gap = gaps_ms[i] if i < len(gaps_ms) else period_gap_ms
+        mark = gap_punctuation(text, gap, comma_gap_ms, period_gap_ms)
+        result.append(text + mark)
+        added += count + bool(mark)
+    return result, added
+
+
+def join_punctuated(texts: List[str]) -> str:
+    """拼接已加标点的字幕：中文之间不留空格，英文单词之间和英文标点后保留空格"""
+    result = ''
+    for text in texts:
+        if result and text and not result[-1].isspace() and (
+                result[-1] in _LATIN_PUNCT or (result[-1].isascii() and text[0].isascii() and text[0].isalnum())):
+            result += ' '
+        result += text
+    return result
+
+
+def confidence_issue(text: str, max_clause_chars: int = MAX_CLAUSE_CHARS,
+                     max_sentence_chars: int = MAX_SENTENCE_CHARS) -> Optional[str]:
+    """
+    检查本地标点后的段落是否可以不经校对直接使用
+    通过返回 None，否则返回原因；只检查标点是否完整以及常见的 ASR 问题，无法发现错别字
+    """
+    text = text.strip()
+    if not text:
+        return "正文为空"
+    if _CJK_SPACE_RE.search(text):
+        return "中文之间仍有空格"
+    if not _TERMINAL_RE.search(text):
+        return "结尾缺少句末标点"
+    longest = max(len(clause) for clause in _CLAUSE_SPLIT_RE.split(text))
+    if longest > max_clause_chars:
+        return f"存在过长的无标点片段（{longest}字）"
+    longest = max(len(sentence) for sentence in _SENTENCE_SPLIT_RE.split(text))
+    if longest > max_sentence_chars:
+        return f"存在过长的句子（{longest}字）"
+    match = _REPEAT_RE.search(text)
+    if match:
+        return f"存在重复的词语（{match.group()}）"
+    if _FILLER_RE.search(text):
+        return "存在语气词或口头禅"
+    return None
+
+
+def _length(text: str) -> int:
+    """按字数计的长度：不计空白，英文单词按 2 字计"""
+    words = len(_LATIN_WORD_RE.findall(text))
+    return len("".join(_LATIN_WORD_RE.sub("", text).split())) + 2 * words
+
+
+def clean_score(text: str) -> float:
+    """
+    段落无需校对的程度，0~1，三项得分相乘：
+    - 标点密度：分句平均字数在 CLEAN_CLAUSE_CHARS 范围内为 1，标点过稀或过密按比例降低
+    - 句长分布：超过 MAX_CLAUSE_CHARS 的分句、超过 MAX_SENTENCE_CHARS 的句子（多为漏掉的停顿），按每 500 字的个数扣分
+    - 常见错别字：按每 500 字的命中次数扣分
+    默认阈值下，500 字以内出现一处过长分句或错别字即需要校对
+    confidence_issue() 中与长度无关的问题（中文之间有空格、结尾无句末标点、重复词语、语气词）直接记为 0
+    """
+    text = text.strip()
+    if confidence_issue(text, len(text) + 1, len(text) + 1) is not None:
+        return 0.0
+    clauses = [_length(clause) for clause in _CLAUSE_SPLIT_RE.split(text)]
+    sentences = [_length(sentence) for sentence in _SENTENCE_SPLIT_RE.split(text)]
+    clauses = [n for n in clauses if n]
+    chars = sum(clauses)
+    if not chars:
+        return 0.0
+    low, high = CLEAN_CLAUSE_CHARS
+    average = chars / len(clauses)
+    density = 1.0 if low <= average <= high else (average / low if average < low else high / average)
+    scale = 500 / max(chars, 500)
+    overlong = sum(1 for n in clauses if n > MAX_CLAUSE_CHARS) + sum(1 for n in sentences if n > MAX_SENTENCE_CHARS)
+    lengths = max(0.0, 1.0 - ISSUE_PENALTY * overlong * scale)
+    typo = max(0.0, 1.0 - ISSUE_PENALTY * len(_TYPO_RE.findall(text)) * scale)
+    return density * lengths * typo
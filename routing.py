@@ -0,0 +1,144 @@
+"""
+按任务选择模型
+
+标题很短，可以交给更快、更便宜的模型；校对需要更强的模型。每种调用有自己的主模型，
+后面跟着按顺序排列的备用模型：
+- 某个模型触发 429 或单次调用耗时超过阈值时暂停使用一段时间，后续请求转到下一个可用模型
+- 暂停结束后重新从主模型开始
+- 按调用类型和模型统计请求数、token 数和转移次数，运行结束时输出
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+from scheduler import TASK_TITLE, TASK_PROOFREAD
+
+DEFAULT_SLOW_SECONDS = 30.0      # 单次调用超过此耗时视为过慢，0 为不按耗时转移
+DEFAULT_COOLDOWN_SECONDS = 60.0  # 被限流或过慢的模型暂停使用的时间
+
+TASK_NAMES = {TASK_TITLE: "标题", TASK_PROOFREAD: "校对"}
+
+
+def parse_model_list(value: str) -> List[str]:
+    """逗号分隔的模型列表，忽略空项"""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+class _ModelStats:
+    __slots__ = ("requests", "tokens", "rate_limited", "slow")
+
+    def __init__(self):
+        self.requests = 0
+        self.tokens = 0
+        self.rate_limited = 0
+        self.slow = 0
+
+
+class ModelRouter:
+    """
+    模型路由，线程安全，同一进程中的所有调用共用
+    configure() 设置每种调用的主模型和共同的备用模型列表，choose() 返回当前应使用的模型
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chains: Dict[int, List[str]] = {}
+        self.slow_seconds = DEFAULT_SLOW_SECONDS
+        self.cooldown_seconds = DEFAULT_COOLDOWN_SECONDS
+        self._paused_until: Dict[str, float] = {}
+        self._stats: Dict[tuple, _ModelStats] = {}
+
+    def configure(self, models: Dict[int, str], fallbacks: List[str] = (),
+                  slow_seconds: float = DEFAULT_SLOW_SECONDS, cooldown_seconds: float = DEFAULT_COOLDOWN_SECONDS):
+        """models 为调用类型 -> 主模型；备用模型按顺序排在主模型之后，重复的只保留第一次"""
+        with self._lock:
+            self.chains = {task: list(dict.fromkeys([model, *fallbacks])) for task, model in models.items()}
+            self.slow_seconds = slow_seconds
+            self.cooldown_seconds = cooldown_seconds
+            self._paused_until.clear()
+
+    def reset_stats(self):
+        """开始新的一次运行，清空统计"""
+        with self._lock:
+            self._stats.clear()
+
+    def primary(self, task: int) -> str:
+        return self.chains[task][0]
+
+    def _available(self, task: int, now: float) -> List[str]:
+        return [model for model in self.chains[task] if self._paused_until.get(model, 0.0) <= now]
+
+    def choose(self, task: int, now: float = None) -> str:
+        """按顺序返回第一个未暂停的模型；全部暂停时返回最早恢复的模型"""
+        now = time.time() if now is None else now
+        with self._lock:
+            available = self._available(task, now)
+            if available:
+                return available[0]
+            return min(self.chains[task], key=lambda model: self._paused_until.get(model, 0.0))
+
+    def _pause(self, task: int, model: str, now: float) -> Optional[str]:
+        """暂停 model，返回接替它的模型；没有其他可用模型时返回 None"""
+        self._paused_until[model] = now + self.cooldown_seconds
+        available = self._available(task, now)
+        return available[0] if available else None
+
+    def report_rate_limited(self, task: int, model: str, now: float = None) -> Optional[str]:
+        """model 触发 429，返回可以立即改用的模型；没有时返回 None，由调用方按原方式退避"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._stats.setdefault((task, model), _ModelStats()).rate_limited += 1
+            return self._pause(task, model, now)
+
+    def report_call(self, task: int, model: str, seconds: float, tokens: int, now: float = None) -> Optional[str]:
+        """
+        记录一次成功的调用；耗时超过阈值且有其他可用模型时暂停 model，返回后续请求改用的模型
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            stats = self._stats.setdefault((task, model), _ModelStats())
+            stats.requests += 1
+            stats.tokens += tokens or 0
+            if not self.slow_seconds or seconds <= self.slow_seconds or len(self.chains[task]) < 2:
+                return None
+            stats.slow += 1
+            return self._pause(task, model, now)
+
+    def record(self, task: int, model: str, tokens: int):
+        """记录一次不经过 choose() 的调用（如批量模式）"""
+        with self._lock:
+            stats = self._stats.setdefault((task, model), _ModelStats())
+            stats.requests += 1
+            stats.tokens += tokens or 0
+
+    def summary(self) -> List[str]:
+        """按调用类型列出各模型的请求数和 token 数，备用模型注明承接的比例"""
+        with self._lock:
+            lines = []
+            for task, chain in self.chains.items():
+                rows = [(model, self._stats[(task, model)]) for model in chain if (task, model) in self._stats]
+                total = sum(stats.requests for _, stats in rows)
+                if not rows:
+                    continue
+                parts = []
+                for model, stats in rows:
+                    part = f"{model} {stats.requests} 次/{stats.tokens} tokens"
+                    if model != chain[0] and total:
+                        part += f"（转移 {stats.requests / total:.0%}）"
+                    notes = []
+                    if stats.rate_limited:
+                        notes.append(f"限流 {stats.rate_limited} 次")
+                    if stats.slow:
+                        notes.append(f"过慢 {stats.slow} 次")
+                    if notes:
+                        part += "，" + "，".join(notes)
+                    parts.append(part)
+                lines.append(f"{TASK_NAMES.get(task, task)}: " + "；".join(parts))
+            return lines
+
+
+_router = ModelRouter()
+
+
+def get_router() -> ModelRouter:
+    """本进程共用的模型路由"""
+    return _router
@@ -0,0 +1,276 @@
+"""
+请求调度器
+
+所有 API 调用在发出前向调度器申请时机，共享同一份速率预算（RPM/TPM）和 429 退避：
+- 优先级：交互任务（GUI）先于后台批处理，同一任务中标题先于校对
+- 同一优先级内按任务轮转，多个任务公平分享
+- 任一调用触发 429 后，所有调用方一起退避，避免各自盲目重试
+
+调度状态（调用窗口、等待队列、退避时间）保存在 SQLite 文件中，
+同一台机器上使用同一 API Key 的多个进程（如 GUI 与夜间批处理）共用一份状态，
+优先级和退避跨进程生效。未指定状态文件时只在本进程内共享。
+
+实际速率上限常比配置的低（或未配置 rpm）：触发 429 时，把此前一分钟内实际发出的调用数打折后记为
+学到的 RPM 上限，写入共享状态，所有进程按它放行，之后每隔一段时间没有 429 就放宽一次，
+避免各进程退避结束后同时恢复、再次一起触发 429。
+每次调用完成后把响应中的实际 token 数写回调用窗口，TPM 按实际用量而非预估值计算。
+"""
+import contextlib
+import hashlib
+import itertools
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# 任务类别
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# 调用类型
+TASK_TITLE = 0
+TASK_PROOFREAD = 1
+
+PRIORITY_NAMES = {"interactive": PRIORITY_INTERACTIVE, "batch": PRIORITY_BATCH}
+
+RATE_WINDOW_SECONDS = 60.0
+BACKOFF_SECONDS = 1.2
+MAX_BACKOFF_SECONDS = 30.0
+POLL_SECONDS = 0.2           # 等待时轮询共享状态的间隔，其他进程的变化最迟在这个时间后被发现
+STALE_WAITER_SECONDS = 10.0  # 等待者超过这个时间没有刷新即视为所在进程已退出
+STALE_JOB_SECONDS = 3600.0   # 超过这个时间没有调用的任务不再保留轮转位置
+DB_TIMEOUT_SECONDS = 30.0
+ADAPTIVE_DECREASE = 0.8          # 429 时学到的上限为此前一分钟调用数的这个比例
+ADAPTIVE_STEP_SECONDS = 30.0     # 每过这么久没有 429，学到的上限加 1
+ADAPTIVE_RESET_SECONDS = 600.0   # 这么久没有 429 后不再使用学到的上限
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS grants (granted_at REAL NOT NULL, tokens INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS waiters (
+    id TEXT PRIMARY KEY, job_class INTEGER NOT NULL, task INTEGER NOT NULL, job TEXT NOT NULL,
+    tokens INTEGER NOT NULL, enqueued_at REAL NOT NULL, heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (job TEXT PRIMARY KEY, last_grant REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value REAL NOT NULL);
+"""
+
+
+class AcquireCancelled(Exception):
+    """等待调用时机期间任务被取消"""
+
+
+def default_state_path(api_key: str) -> str:
+    """按 API Key 区分的共享状态文件，放在系统临时目录中，与工作目录无关"""
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"kimi_rate_state_{digest}.db")
+
+
+class RateScheduler:
+    """
+    按优先级分配调用时机的速率调度器，线程安全
+    rpm/tpm 为 0 表示不限制，只做优先级排序和共享退避
+    state_path 为共享状态文件，为 None 时状态只在本进程内有效
+    """
+    def __init__(self, rpm: int = 0, tpm: int = 0, state_path: str = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.state_path = None
+        self._cond = threading.Condition()
+        self._prefix = f"{os.getpid()}-{id(self):x}"
+        self._job_ids = itertools.count(1)
+        self._waiter_ids = itertools.count(1)
+        self._db = None
+        self._open(state_path)
+
+    def new_job(self) -> int:
+        """分配任务编号，同一任务的调用在同一优先级内共享一个轮转位置"""
+        return next(self._job_ids)
+
+    def configure(self, rpm: int, tpm: int, state_path: str = None):
+        """设置速率限制；state_path 不同时切换到新的共享状态文件"""
+        with self._cond:
+            self.rpm = rpm
+            self.tpm = tpm
+            if state_path != self.state_path:
+                self._open(state_path)
+            self._cond.notify_all()
+
+    def acquire(self, job_class: int = PRIORITY_BATCH, task: int = TASK_PROOFREAD, job=None, tokens: int = 0,
+                cancel: threading.Event = None):
+        """
+        阻塞直到轮到本次调用且速率预算允许；cancel 被设置时抛出 AcquireCancelled
+        返回本次调用在调用窗口中的记录，调用成功后传给 report_success() 写回实际 token 数
+        """
+        waiter = f"{self._prefix}-{next(self._waiter_ids)}"
+        with self._cond:
+            now = time.time()
+            with self._transaction() as db:
+                db.execute("INSERT INTO waiters VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (waiter, job_class, task, f"{self._prefix}-{job}", tokens, now, now))
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        raise AcquireCancelled("任务已取消")
+                    grant, wait = self._try_grant(waiter)
+                    if grant is not None:
+                        self._cond.notify_all()
+                        return grant
+                    self._cond.wait(timeout=wait)
+            except BaseException:
+                with self._transaction() as db:
+                    db.execute("DELETE FROM waiters WHERE id = ?", (waiter,))
+                self._cond.notify_all()
+                raise
+
+    def report_rate_limited(self) -> float:
+        """
+        报告一次 429，所有调用方（包括其他进程）共同退避，返回退避秒数；
+        同时按此前一分钟内的调用数降低学到的 RPM 上限
+        """
+        with self._cond:
+            with self._transaction() as db:
+                now = time.time()
+                count = int(self._get_state(db, "consecutive_429")) + 1
+                delay = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * (2 ** (count - 1)))
+                blocked_until = max(self._get_state(db, "blocked_until"), now + delay)
+                self._set_state(db, "consecutive_429", count)
+                self._set_state(db, "blocked_until", blocked_until)
+                recent = db.execute("SELECT COUNT(*) FROM grants WHERE granted_at > ?",
+                                    (now - RATE_WINDOW_SECONDS,)).fetchone()[0]
+                current = self._learned_rpm(db, now)
+                learned = max(1, int(recent * ADAPTIVE_DECREASE))
+                self._set_state(db, "learned_rpm", min(learned, current) if current else learned)
+                self._set_state(db, "learned_at", now)
+            self._cond.notify_all()
+            return delay
+
+    def report_success(self, grant=None, tokens: int = 0):
+        """调用成功；grant 为 acquire() 的返回值，tokens 为响应中的实际 token 数（0 为保留预估值）"""
+        with self._cond:
+            with self._transaction() as db:
+                self._set_state(db, "consecutive_429", 0)
+                if grant is not None and tokens > 0:
+                    # 按写入时间核对，调用超过一分钟时记录可能已被清除、编号被复用
+                    db.execute("UPDATE grants SET tokens = ? WHERE rowid = ? AND granted_at = ?",
+                               (tokens, grant[0], grant[1]))
+            self._cond.notify_all()
+
+    def status(self) -> dict:
+        """共享状态的当前快照，供 --rate-status 查看"""
+        with self._cond:
+            with self._transaction() as db:
+                now = time.time()
+                count, used = db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM grants WHERE granted_at > ?",
+                    (now - RATE_WINDOW_SECONDS,)).fetchone()
+                waiters = db.execute("SELECT job_class, COUNT(*) FROM waiters WHERE heartbeat >= ? GROUP BY job_class",
+                                     (now - STALE_WAITER_SECONDS,)).fetchall()
+                processes = db.execute("SELECT COUNT(DISTINCT substr(id, 1, instr(id, '-') - 1)) FROM waiters "
+                                       "WHERE heartbeat >= ?", (now - STALE_WAITER_SECONDS,)).fetchone()[0]
+                return {
+                    "state_path": self.state_path,
+                    "rpm": self.rpm,
+                    "tpm": self.tpm,
+                    "learned_rpm": self._learned_rpm(db, now),
+                    "calls_last_minute": count,
+                    "tokens_last_minute": used,
+                    "waiting": dict(waiters),
+                    "waiting_processes": processes,
+                    "blocked_seconds": max(0.0, self._get_state(db, "blocked_until") - now),
+                    "consecutive_429": int(self._get_state(db, "consecutive_429")),
+                }
+
+    def pending(self) -> int:
+        """当前等待中的调用数（包括其他进程）"""
+        with self._cond:
+            with self._transaction() as db:
+                return db.execute("SELECT COUNT(*) FROM waiters").fetchone()[0]
+
+    def _open(self, state_path):
+        if self._db is not None:
+            self._db.close()
+        self.state_path = state_path
+        self._db = sqlite3.connect(state_path or ":memory:", timeout=DB_TIMEOUT_SECONDS,
+                                   isolation_level=None, check_same_thread=False)
+        if state_path:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE 取得写锁，多个进程对共享状态的读改写互斥
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._db
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    @staticmethod
+    def _get_state(db, key: str) -> float:
+        row = db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0.0
+
+    @staticmethod
+    def _set_state(db, key: str, value: float):
+        db.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (key, value))
+
+    def _learned_rpm(self, db, now: float) -> int:
+        """当前生效的学到的 RPM 上限，0 为没有；最近一次 429 后每过 ADAPTIVE_STEP_SECONDS 加 1"""
+        learned = int(self._get_state(db, "learned_rpm"))
+        if not learned:
+            return 0
+        elapsed = now - self._get_state(db, "learned_at")
+        if elapsed >= ADAPTIVE_RESET_SECONDS:
+            return 0
+        return learned + int(elapsed // ADAPTIVE_STEP_SECONDS)
+
+    def _try_grant(self, waiter: str):
+        """
+        轮到 waiter 且预算允许时记录本次调用，返回 (调用记录, 0)；
+        否则返回 (None, 下次检查前的等待秒数)
+        """
+        with self._transaction() as db:
+            now = time.time()
+            db.execute("DELETE FROM grants WHERE granted_at <= ?", (now - RATE_WINDOW_SECONDS,))
+            db.execute("DELETE FROM waiters WHERE heartbeat < ?", (now - STALE_WAITER_SECONDS,))
+            db.execute("DELETE FROM jobs WHERE last_grant < ?", (now - STALE_JOB_SECONDS,))
+            db.execute("UPDATE waiters SET heartbeat = ? WHERE id = ?", (now, waiter))
+            blocked = self._get_state(db, "blocked_until") - now
+            if blocked > 0:
+                return None, min(blocked, POLL_SECONDS)
+            learned = self._learned_rpm(db, now)
+            rpm = min(self.rpm, learned) if self.rpm > 0 and learned else self.rpm or learned
+            count, used = db.execute("SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM grants").fetchone()
+            # 按优先级依次分配剩余预算，排在前面的调用放不下时后面的也不能插队
+            rows = db.execute(
+                "SELECT w.id, w.job, w.tokens FROM waiters w LEFT JOIN jobs j ON j.job = w.job "
+                "ORDER BY w.job_class, w.task, COALESCE(j.last_grant, 0), w.enqueued_at, w.id"
+            ).fetchall()
+            for waiter_id, job, tokens in rows:
+                if rpm > 0 and count + 1 > rpm:
+                    break
+                if self.tpm > 0 and count > 0 and used + tokens > self.tpm:
+                    break
+                if waiter_id == waiter:
+                    db.execute("DELETE FROM waiters WHERE id = ?", (waiter,))
+                    grant = db.execute("INSERT INTO grants VALUES (?, ?)", (now, tokens)).lastrowid
+                    # 轮转：刚获得调用机会的任务排到同一优先级的末尾
+                    db.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?)", (job, now))
+                    return (grant, now), 0
+                count += 1
+                used += tokens
+            oldest = db.execute("SELECT MIN(granted_at) FROM grants").fetchone()[0]
+            if oldest is not None:
+                return None, max(0.01, min(POLL_SECONDS, oldest + RATE_WINDOW_SECONDS - now))
+            return None, POLL_SECONDS
+
+
+_scheduler = RateScheduler()
+
+
+def get_scheduler() -> RateScheduler:
+    """进程内共享的调度器，configure 指定状态文件后与其他进程共享"""
+    return _scheduler
@@ -0,0 +1,188 @@
+"""
+按话题切分段落（TextTiling）
+
+merge_subtitles 只按累计字数切分，章节边界常落在话题中间。这里按词汇衔接度找话题转换处：
+- 每条字幕去掉空白和标点后取字符 n-gram，按 IDF 加权，作为该条字幕的向量
+- 在每个字幕间隙两侧各取 window 条字幕，计算两侧合并向量的余弦相似度；
+  相似度的「深度」（两侧最高点减去该处的值）越大，说明话题在此转换
+- 深度与字幕间的停顿长度加权合并为边界得分
+- 从第一条字幕开始，在满足最短/最长字数的范围内选得分最高的间隙作为段落结尾
+相似度只需要窗口内字幕两两的点积：按 n-gram 和字幕序号排序后，
+用 searchsorted 一次求出相距 d 条的所有字幕对的点积（d < 2*window），全部计算都在 NumPy 中完成。
+NumPy 为可选依赖，未安装时只能使用按长度合并。
+"""
+import re
+from typing import List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_WINDOW_CUES = 6         # 间隙两侧各取的字幕条数
+DEFAULT_NGRAM = 2               # 字符 n-gram 长度，中文取 2 即为常见的双字词
+DEFAULT_PAUSE_WEIGHT = 0.5      # 停顿得分相对词汇深度得分的权重
+DEFAULT_LONG_PAUSE_MS = 2000    # 停顿达到此值时停顿得分为满分
+MIN_LENGTH_RATIO = 0.5          # 未指定最短/最长字数时，按目标长度的比例确定
+MAX_LENGTH_RATIO = 2.0
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _cue_vectors(texts: List[str], ngram: int):
+    """
+    返回 (键, 权重)：键为 n-gram 编号 * 步长 + 字幕序号，已排序且不重复；权重为 n-gram 在该条字幕中的次数 * IDF
+    步长比字幕数多出的部分保证「序号 + d」不会越过到下一个 n-gram 的范围
+    """
+    normalized = [_NON_WORD_RE.sub("", text.lower()) for text in texts]
+    lengths = np.fromiter((len(text) for text in normalized), dtype=np.int64, count=len(normalized))
+    codes = np.frombuffer("".join(normalized).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    cue_of_char = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    count = len(codes) - ngram + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), 0
+    # 同一条字幕内的 n-gram：起点和终点属于同一条字幕
+    valid = cue_of_char[:count] == cue_of_char[ngram - 1:]
+    grams = codes[:count].copy()
+    for offset in range(1, ngram):
+        grams = grams * np.uint64(0x110000) + codes[offset:offset + count]
+    grams = grams[valid]
+    cues = cue_of_char[:count][valid]
+    gram_ids = np.unique(grams, return_inverse=True)[1].reshape(-1)
+    return gram_ids, cues, int(gram_ids.max()) + 1 if len(gram_ids) else 0
+
+
+def _pair_dots(texts: List[str], window: int, ngram: int):
+    """B[i, d] 为第 i 条与第 i+d 条字幕向量的点积，d 为 0 到 2*window-1"""
+    n = len(texts)
+    span = 2 * window
+    dots = np.zeros((n, span))
+    gram_ids, cues, vocabulary = _cue_vectors(texts, ngram)
+    if not vocabulary:
+        return dots
+    stride = n + span
+    keys, counts = np.unique(gram_ids * stride + cues, return_counts=True)
+    key_grams = keys // stride
+    # IDF：出现在越多字幕中的 n-gram（如「我们」「这个」）权重越低
+    document_frequency = np.bincount(key_grams, minlength=vocabulary)
+    weights = counts * np.log((n + 1) / (document_frequency[key_grams] + 0.5))
+    key_cues = keys % stride
+    for d in range(span):
+        targets = keys + d
+        positions = np.minimum(np.searchsorted(keys, targets), len(keys) - 1)
+        matched = keys[positions] == targets
+        dots[:, d] = np.bincount(key_cues[matched], weights=weights[matched] * weights[positions[matched]],
+                                 minlength=n)[:n]
+    return dots
+
+
+def cohesion_scores(texts: List[str], window: int = DEFAULT_WINDOW_CUES, ngram: int = DEFAULT_NGRAM):
+    """
+    每个间隙两侧窗口的余弦相似度，返回长度为 len(texts)+1 的数组，
+    第 g 项对应第 g-1 条与第 g 条字幕之间的间隙（首尾两项无意义，为 1）
+    """
+    n = len(texts)
+    sims = np.ones(n + 1)
+    if n < 2:
+        return sims
+    dots = _pair_dots(texts, window, ngram)
+    # 前后各补 window 条空字幕，窗口超出范围的部分点积为 0
+    padded = np.zeros((n + 2 * window, 2 * window))
+    padded[window:window + n] = dots
+    prefix = np.cumsum(padded, axis=1)
+    gaps = np.arange(1, n)
+    rows = gaps + window  # 第 g 条字幕在 padded 中的行号
+    cross = np.zeros(len(gaps))
+    left = np.zeros(len(gaps))
+    right = np.zeros(len(gaps))
+    for k in range(1, window + 1):
+        # 左窗口中距间隙 k 条的字幕与右窗口各条字幕的点积，d 从 k 到 k+window-1
+        row = prefix[rows - k]
+        cross += row[:, k + window - 1] - row[:, k - 1]
+    for m in range(window):
+        # 窗口内第 m 条字幕与自身及其后各条的点积，其后的计两次
+        row = prefix[rows - window + m]
+        left += 2 * row[:, window - 1 - m] - row[:, 0]
+        row = prefix[rows + m]
+        right += 2 * row[:, window - 1 - m] - row[:, 0]
+    norms = np.sqrt(np.maximum(left, 0) * np.maximum(right, 0))
+    sims[1:n] = np.divide(cross, norms, out=np.zeros(len(gaps)), where=norms > 0)
+    return sims
+
+
+def depth_scores(sims, window: int = DEFAULT_WINDOW_CUES):
+    """相似度低谷的深度：间隙两侧 window 范围内的最高相似度之和减去该处相似度的两倍"""
+    n = len(sims) - 1
+    depth = np.zeros(n + 1)
+    if n < 2:
+        return depth
+    inner = sims[1:n]
+    # 先做 3 点平滑，减少单条字幕造成的抖动
+    smooth = np.convolve(np.pad(inner, 1, mode="edge"), np.ones(3) / 3, mode="valid")
+    padded = np.pad(smooth, window, mode="constant", constant_values=-np.inf)
+    peaks = np.lib.stride_tricks.sliding_window_view(padded, window + 1)
+    left_peak = peaks[:len(smooth)].max(axis=1)
+    right_peak = peaks[window:window + len(smooth)].max(axis=1)
+    depth[1:n] = left_peak + right_peak - 2 * smooth
+    return depth
+
+
+def boundary_scores(texts: List[str], pauses_ms, window: int = DEFAULT_WINDOW_CUES, ngram: int = DEFAULT_NGRAM,
+                    pause_weight: float = DEFAULT_PAUSE_WEIGHT, long_pause_ms: int = DEFAULT_LONG_PAUSE_MS):
+    """
+    每个间隙作为段落边界的得分（长度为 len(texts)+1），pauses_ms[g] 为第 g-1 条结束到第 g 条开始的毫秒数
+    词汇深度按最大值归一化，停顿按 long_pause_ms 截断到 0~1
+    """
+    depth = depth_scores(cohesion_scores(texts, window, ngram), window)
+    peak = depth.max() if len(depth) else 0.0
+    if peak > 0:
+        depth = depth / peak
+    pauses = np.clip(np.asarray(pauses_ms, dtype=float) / long_pause_ms, 0.0, 1.0)
+    return depth + pause_weight * pauses
+
+
+def choose_boundaries(lengths, scores, min_length: int, max_length: int) -> List[int]:
+    """
+    按字数限制选择边界，返回每段第一条字幕的序号
+    从段首开始，在段落字数落在 [min_length, max_length] 且剩余字数不少于 min_length 的间隙中取得分最高的；
+    单条字幕超过 max_length 时单独成段
+    """
+    n = len(lengths)
+    cumulative = np.concatenate(([0], np.cumsum(lengths)))
+    total = cumulative[-1]
+    last_cut = np.searchsorted(cumulative, total - min_length, side="right") - 1
+    starts = []
+    start = 0
+    while start < n:
+        starts.append(start)
+        if total - cumulative[start] <= max_length:
+            break
+        low = max(int(np.searchsorted(cumulative, cumulative[start] + min_length)), start + 1)
+        high = min(int(np.searchsorted(cumulative, cumulative[start] + max_length, side="right")) - 1,
+                   int(last_cut), n - 1)
+        if high < low:
+            start = min(low, n)
+        else:
+            start = low + int(np.argmax(scores[low:high + 1]))
+    return starts
+
+
+def topic_boundaries(texts: List[str], starts_ms: List[int], ends_ms: List[int], min_length: int, max_length: int,
+                     window: int = DEFAULT_WINDOW_CUES, ngram: int = DEFAULT_NGRAM,
+                     pause_weight: float = DEFAULT_PAUSE_WEIGHT) -> List[int]:
+    """按话题切分字幕，返回每段第一条字幕的序号"""
+    if np is None:
+        raise RuntimeError("按话题分段需要安装 numpy（pip install numpy）")
+    if not texts:
+        return []
+    starts = np.asarray(starts_ms, dtype=float)
+    ends = np.asarray(ends_ms, dtype=float)
+    pauses = np.zeros(len(texts) + 1)
+    pauses[1:len(texts)] = np.maximum(starts[1:] - ends[:-1], 0)
+    scores = boundary_scores(texts, pauses, window, ngram, pause_weight)
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    return choose_boundaries(lengths, scores, min_length, max_length)
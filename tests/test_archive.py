@@ -0,0 +1,80 @@
+import sqlite3
+
+from archive import ShownotesArchive
+from main import MergedSegment, archive_segment
+
+VERSION = "v1"
+
+
+def segment(text, start_ms=0):
+    return MergedSegment("00:00:00", text, start_ms, start_ms + 1000)
+
+
+def add_run(archive, results, title_model="title-model", proofread_model="proofread-model", version=VERSION):
+    run_id = archive.start_run("a.srt", "hash", 500, title_model, proofread_model, (), version)
+    for idx, (original, title, proofread) in enumerate(results):
+        archive.add_segment(run_id, idx, segment(original), title, original, proofread)
+    return run_id
+
+
+def test_prior_results_by_original(tmp_path):
+    with ShownotesArchive(str(tmp_path / "archive.db")) as archive:
+        add_run(archive, [("第一段", "标题一", "第一段。"), ("第二段", "标题二", None)])
+        titles, proofread = archive.prior_results(["第二段", "第三段", "第一段"], "title-model",
+                                                  "proofread-model", VERSION)
+    assert titles == ["标题二", None, "标题一"]
+    assert proofread == [None, None, "第一段。"]
+
+
+def test_prior_results_latest_non_null(tmp_path):
+    with ShownotesArchive(str(tmp_path / "archive.db")) as archive:
+        add_run(archive, [("原文", "旧标题", "原文。")])
+        add_run(archive, [("原文", "新标题", None)])
+        assert archive.prior_results(["原文"], "title-model", "proofread-model", VERSION) == (["新标题"], ["原文。"])
+
+
+def test_prior_results_keyed_by_model_and_prompt_version(tmp_path):
+    with ShownotesArchive(str(tmp_path / "archive.db")) as archive:
+        add_run(archive, [("原文", "标题", "原文。")])
+        assert archive.prior_results(["原文"], "other", "proofread-model", VERSION) == ([None], ["原文。"])
+        assert archive.prior_results(["原文"], "title-model", "other", VERSION) == (["标题"], [None])
+        assert archive.prior_results(["原文"], "title-model", "proofread-model", "v2") == ([None], [None])
+
+
+def test_unverified_proofread_not_stored(tmp_path):
+    """跳过校对、保留原文或与原文相同的校对结果不写入，以后不会被沿用"""
+    with ShownotesArchive(str(tmp_path / "archive.db")) as archive:
+        run_id = archive.start_run("a.srt", "hash", 500, "title-model", "proofread-model", (), VERSION)
+        archive_segment(archive, run_id, 0, segment("未改动"), "标题一", "未改动")
+        archive_segment(archive, run_id, 1, segment("未校验"), "标题二", "未校验。", verified=False)
+        archive_segment(archive, run_id, 2, segment("已校对"), "标题三", "已校对。")
+        titles, proofread = archive.prior_results(["未改动", "未校验", "已校对"], "title-model",
+                                                  "proofread-model", VERSION)
+    assert titles == ["标题一", "标题二", "标题三"]
+    assert proofread == [None, None, "已校对。"]
+
+
+def test_old_archive_gains_prompt_version(tmp_path):
+    """早期没有提示词版本的归档可以打开，其中的结果不再沿用"""
+    path = str(tmp_path / "archive.db")
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE runs (id INTEGER PRIMARY KEY, source TEXT NOT NULL, source_hash TEXT NOT NULL,
+            target_length INTEGER NOT NULL, title_model TEXT, proofread_model TEXT, outputs TEXT,
+            started_at REAL NOT NULL);
+        INSERT INTO runs VALUES (1, 'a.srt', 'hash', 500, 'title-model', 'proofread-model', '', 0);
+    """)
+    db.close()
+    with ShownotesArchive(path) as archive:
+        archive.add_segment(1, 0, segment("原文"), "标题", "原文", "原文。")
+        assert archive.prior_results(["原文"], "title-model", "proofread-model", VERSION) == ([None], [None])
+        add_run(archive, [("原文", "标题", "原文。")])
+        assert archive.prior_results(["原文"], "title-model", "proofread-model", VERSION) == (["标题"], ["原文。"])
+
+
+def test_search(tmp_path):
+    with ShownotesArchive(str(tmp_path / "archive.db")) as archive:
+        add_run(archive, [("今天聊一聊性能优化", "性能优化", "今天聊一聊性能优化。"), ("再说说缓存", "缓存", None)])
+        assert [result["title"] for result in archive.search("性能优化")] == ["性能优化"]
+        assert [result["title"] for result in archive.search("缓存")] == ["缓存"]
+        assert archive.search("不存在的词") == []
@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from budget import Budget, BudgetExceeded, JobBudget, RetryBudget, call_with_budget
+
+THREADS = 8
+ATTEMPTS = 20
+
+
+def hammer(budget, tokens):
+    """多个线程同时检查、预留并结算，返回通过检查的请求数"""
+    granted = []
+    start = threading.Barrier(THREADS)
+
+    def worker():
+        start.wait()
+        for _ in range(ATTEMPTS):
+            try:
+                reservation = budget.check(tokens)
+            except BudgetExceeded:
+                continue
+            granted.append(1)
+            budget.charge(tokens, reservation)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(granted)
+
+
+def test_run_cap_under_threads(tmp_path):
+    budget = Budget(max_run_tokens=1000, usage_path=str(tmp_path / "usage.db"))
+    assert hammer(budget, 100) == 10
+    assert budget.run_tokens == 1000
+    assert budget._reserved == 0
+    with pytest.raises(BudgetExceeded):
+        budget.check(1)
+
+
+def test_run_cap_reconciles_actual_usage(tmp_path):
+    """预留按预估，结算按实际用量，实际较少时多出的额度可以继续使用"""
+    budget = Budget(max_run_tokens=1000, usage_path=str(tmp_path / "usage.db"))
+    granted = 0
+    while True:
+        try:
+            reservation = budget.check(100)
+        except BudgetExceeded:
+            break
+        granted += 1
+        budget.charge(50, reservation)
+    assert granted == 19
+    assert budget.run_tokens == 950
+    assert budget._reserved == 0
+
+
+def test_day_cap_shared_between_processes(tmp_path):
+    """两个 Budget 共用同一个用量文件，相当于两个进程共用每日预算"""
+    path = str(tmp_path / "usage.db")
+    first, second = Budget(max_day_tokens=1500, usage_path=path), Budget(max_day_tokens=1500, usage_path=path)
+    results = []
+    threads = [threading.Thread(target=lambda b=b: results.append(hammer(b, 100))) for b in (first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(results) == 15
+    assert first.day_usage() == {"tokens": 1500, "requests": 15}
+    with pytest.raises(BudgetExceeded):
+        second.check(1)
+
+
+def test_reservation_released_on_failure(tmp_path):
+    budget = Budget(max_run_tokens=100, max_day_tokens=100, usage_path=str(tmp_path / "usage.db"))
+
+    def fail():
+        raise RuntimeError("请求失败")
+
+    with pytest.raises(RuntimeError):
+        call_with_budget(budget, 60, 40, fail)
+    assert budget._reserved == 0
+    assert budget.run_tokens == 0
+    # 额度已退回，同样大小的请求仍可通过
+    budget.release(budget.check(100))
+
+
+def test_job_budgets_share_run_cap(tmp_path):
+    shared = Budget(max_run_tokens=1000, usage_path=str(tmp_path / "usage.db"))
+    jobs = [JobBudget(shared) for _ in range(2)]
+    results = []
+    threads = [threading.Thread(target=lambda job=job: results.append(hammer(job, 100))) for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(results) == 10
+    assert shared.run_tokens == 1000
+    assert sum(job.run_tokens for job in jobs) == 1000
+    assert shared._reserved == 0 and all(job._reserved == 0 for job in jobs)
+
+
+def test_retry_budget_cap(tmp_path):
+    shared = Budget(max_run_tokens=10000, usage_path=str(tmp_path / "usage.db"))
+    retry = RetryBudget(JobBudget(shared), max_tokens=300)
+    assert hammer(retry, 100) == 3
+    assert retry.shared.run_tokens == shared.run_tokens == 300
+    assert shared._reserved == 0
@@ -0,0 +1,64 @@
+from main import parse_srt, read_srt_text
+
+SRT = "1\n00:00:01,000 --> 00:00:02,500\n第一句\n\n2\n00:00:03,000 --> 00:00:04,000\n第二句\n第二行\n\n"
+
+
+def cues(items):
+    return [(item.index, item.start_time, item.end_time, item.text) for item in items]
+
+
+EXPECTED = [(1, "00:00:01,000", "00:00:02,500", "第一句"), (2, "00:00:03,000", "00:00:04,000", "第二句 第二行")]
+
+
+def test_standard():
+    warnings = []
+    assert cues(parse_srt(SRT, warnings)) == EXPECTED
+    assert warnings == []
+
+
+def test_bom_and_crlf():
+    warnings = []
+    assert cues(parse_srt("\ufeff" + SRT.replace("\n", "\r\n"), warnings)) == EXPECTED
+    assert warnings == []
+
+
+def test_bare_cr():
+    assert cues(parse_srt(SRT.replace("\n", "\r"))) == EXPECTED
+
+
+def test_lines_without_newlines():
+    """行列表中的行可以不带换行符"""
+    assert cues(parse_srt(SRT.split("\n"))) == EXPECTED
+
+
+def test_missing_milliseconds():
+    warnings = []
+    items = parse_srt("1\n00:00:01 --> 00:00:02.5\n第一句\n\n2\n01:02 --> 01:03,000\n第二句\n", warnings)
+    assert cues(items) == [(1, "00:00:01,000", "00:00:02,500", "第一句"),
+                           (2, "00:01:02,000", "00:01:03,000", "第二句")]
+    assert len(warnings) == 2
+    assert all("缺少毫秒" in warning for warning in warnings)
+
+
+def test_warnings_carry_line_numbers():
+    warnings = []
+    items = parse_srt("1\n00:00:01,000 --> 00:00:02,000\n第一句\n\n3\n00:00:03,000 --> 00:00:04,000\n第三句\n",
+                      warnings)
+    assert [item.index for item in items] == [1, 3]
+    assert warnings == ["第5行: 序号不连续：1 -> 3"]
+
+
+def test_read_utf8_bom_crlf(tmp_path):
+    path = tmp_path / "bom.srt"
+    path.write_bytes(b"\xef\xbb\xbf" + SRT.replace("\n", "\r\n").encode("utf-8"))
+    text, encoding = read_srt_text(str(path))
+    assert not text.startswith("\ufeff")
+    assert cues(parse_srt(text)) == EXPECTED
+
+
+def test_read_gbk(tmp_path):
+    path = tmp_path / "gbk.srt"
+    path.write_bytes(SRT.encode("gbk"))
+    text, encoding = read_srt_text(str(path))
+    assert encoding in ("gb18030", "gbk")
+    assert cues(parse_srt(text)) == EXPECTED
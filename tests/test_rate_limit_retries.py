@@ -0,0 +1,83 @@
+import pytest
+
+import main
+import scheduler
+from routing import ModelRouter
+from scheduler import RateScheduler, TASK_PROOFREAD
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+class Completion:
+    usage = None
+
+
+@pytest.fixture
+def loop(monkeypatch):
+    """独立的调度器和模型路由，退避缩短到毫秒级"""
+    monkeypatch.setattr(scheduler, "BACKOFF_SECONDS", 0.001)
+    monkeypatch.setattr(scheduler, "MAX_BACKOFF_SECONDS", 0.001)
+    monkeypatch.setattr(scheduler, "ADAPTIVE_DECREASE", 100)
+    monkeypatch.setattr(main, "MAX_RATE_LIMIT_RETRIES", 3)
+    rate = RateScheduler()
+    router = ModelRouter()
+    router.configure({TASK_PROOFREAD: "primary"}, ["backup"])
+    monkeypatch.setattr(main, "get_scheduler", lambda: rate)
+    monkeypatch.setattr(main, "get_router", lambda: router)
+    return rate
+
+
+def test_gives_up_after_retry_cap(loop):
+    calls, delays = [], []
+
+    def call(model):
+        calls.append(model)
+        raise RateLimited()
+
+    with pytest.raises(main.RateLimitExhausted):
+        main.kimi_rpm_handle(call, task=TASK_PROOFREAD, log=lambda message: None, on_rate_limited=delays.append)
+    # 先改用备用模型，两个模型都在冷却后才退避，退避 3 次后放弃
+    assert calls[:2] == ["primary", "backup"]
+    assert len(delays) == 3
+
+
+def test_gives_up_after_deadline(loop, monkeypatch):
+    monkeypatch.setattr(main, "MAX_RATE_LIMIT_RETRIES", 1000)
+    monkeypatch.setattr(main, "RATE_LIMIT_DEADLINE_SECONDS", 0.05)
+
+    def call(model):
+        raise RateLimited()
+
+    with pytest.raises(main.RateLimitExhausted):
+        main.kimi_rpm_handle(call, task=TASK_PROOFREAD, log=lambda message: None)
+
+
+def test_recovers_and_resets_backoff(loop):
+    failures = [RateLimited(), RateLimited()]
+    completion = Completion()
+    seen = []
+
+    def call(model):
+        if failures:
+            raise failures.pop()
+        return completion
+
+    result = main.kimi_rpm_handle(call, task=TASK_PROOFREAD, log=lambda message: None,
+                                  on_success=lambda model, seconds, result: seen.append(result))
+    assert result is completion
+    assert seen == [completion]
+    assert loop.status()["consecutive_429"] == 0
+
+
+def test_other_errors_are_not_retried(loop):
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        raise ValueError("请求格式错误")
+
+    with pytest.raises(ValueError):
+        main.kimi_rpm_handle(call, task=TASK_PROOFREAD, log=lambda message: None)
+    assert calls == ["primary"]
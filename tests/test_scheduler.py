@@ -0,0 +1,128 @@
+import threading
+
+import pytest
+
+import scheduler
+from scheduler import AcquireCancelled, RateScheduler
+
+
+class Clock:
+    """替换调度器使用的 time 模块，测试中手动推进时间"""
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(scheduler, "time", fake)
+    return fake
+
+
+def try_acquire(rate, tokens=0, wait=0.3):
+    """申请一次调用，wait 秒内没有放行时取消，返回调用记录或 None"""
+    cancel = threading.Event()
+    timer = threading.Timer(wait, cancel.set)
+    timer.start()
+    try:
+        return rate.acquire(tokens=tokens, cancel=cancel)
+    except AcquireCancelled:
+        return None
+    finally:
+        timer.cancel()
+
+
+def test_backoff_doubles_and_resets_on_success(clock):
+    rate = RateScheduler()
+    delays = [rate.report_rate_limited() for _ in range(8)]
+    assert delays[:3] == [scheduler.BACKOFF_SECONDS, scheduler.BACKOFF_SECONDS * 2, scheduler.BACKOFF_SECONDS * 4]
+    assert delays[-1] == scheduler.MAX_BACKOFF_SECONDS
+    assert rate.status()["consecutive_429"] == 8
+    rate.report_success()
+    assert rate.status()["consecutive_429"] == 0
+    assert rate.report_rate_limited() == scheduler.BACKOFF_SECONDS
+
+
+def test_backoff_blocks_until_expired(clock):
+    rate = RateScheduler()
+    delay = rate.report_rate_limited()
+    assert try_acquire(rate, wait=0.1) is None
+    clock.now += delay + 0.01
+    assert try_acquire(rate) is not None
+
+
+def test_learned_rpm_from_429(clock):
+    rate = RateScheduler()
+    for _ in range(10):
+        assert try_acquire(rate) is not None
+    rate.report_rate_limited()
+    assert rate.status()["learned_rpm"] == int(10 * scheduler.ADAPTIVE_DECREASE)
+    # 退避结束后仍按学到的上限放行：一分钟内已有 10 次调用
+    clock.now += scheduler.MAX_BACKOFF_SECONDS
+    assert try_acquire(rate, wait=0.1) is None
+    # 调用移出窗口后最多放行学到的次数（每过 ADAPTIVE_STEP_SECONDS 加 1）
+    clock.now += scheduler.RATE_WINDOW_SECONDS - scheduler.MAX_BACKOFF_SECONDS + 0.01
+    learned = rate.status()["learned_rpm"]
+    assert learned == 8 + int((scheduler.RATE_WINDOW_SECONDS + 0.01) // scheduler.ADAPTIVE_STEP_SECONDS)
+    for _ in range(learned):
+        assert try_acquire(rate) is not None
+    assert try_acquire(rate, wait=0.1) is None
+
+
+def test_learned_rpm_only_decreases_and_resets(clock):
+    rate = RateScheduler()
+    for _ in range(5):
+        try_acquire(rate)
+    rate.report_rate_limited()
+    assert rate.status()["learned_rpm"] == 4
+    for _ in range(20):
+        rate._db.execute("INSERT INTO grants VALUES (?, 0)", (clock.now,))
+    rate.report_rate_limited()
+    assert rate.status()["learned_rpm"] == 4
+    clock.now += scheduler.ADAPTIVE_RESET_SECONDS
+    assert rate.status()["learned_rpm"] == 0
+
+
+def test_learned_rpm_below_configured_rpm(clock, monkeypatch):
+    """配置的 rpm 偏高时按学到的上限放行"""
+    monkeypatch.setattr(scheduler, "ADAPTIVE_STEP_SECONDS", 3600.0)
+    rate = RateScheduler(rpm=5)
+    for _ in range(5):
+        assert try_acquire(rate) is not None
+    assert try_acquire(rate, wait=0.1) is None
+    rate.report_rate_limited()
+    clock.now += scheduler.RATE_WINDOW_SECONDS + 0.01
+    assert [try_acquire(rate, wait=0.1) is not None for _ in range(5)] == [True] * 4 + [False]
+
+
+def test_state_shared_between_processes(clock, tmp_path):
+    """两个调度器使用同一个状态文件，相当于两个进程：一方的 429 退避和学到的上限对另一方生效"""
+    path = str(tmp_path / "rate.db")
+    first, second = RateScheduler(state_path=path), RateScheduler(state_path=path)
+    for _ in range(5):
+        assert try_acquire(first) is not None
+    first.report_rate_limited()
+    status = second.status()
+    assert status["blocked_seconds"] > 0
+    assert status["learned_rpm"] == 4
+    assert status["calls_last_minute"] == 5
+    assert try_acquire(second, wait=0.1) is None
+
+
+def test_tpm_uses_reported_tokens(clock):
+    rate = RateScheduler(tpm=1000)
+    grant = try_acquire(rate, tokens=800)
+    assert grant is not None
+    assert try_acquire(rate, tokens=800, wait=0.1) is None
+    rate.report_success(grant, tokens=100)
+    assert try_acquire(rate, tokens=800) is not None
+
+
+def test_cancel_removes_waiter(clock):
+    rate = RateScheduler()
+    rate.report_rate_limited()
+    assert try_acquire(rate, wait=0.05) is None
+    assert rate.pending() == 0
@@ -0,0 +1,98 @@
+import difflib
+import random
+
+import pytest
+
+from textdiff import DiffCache, changed_ratio, diff_opcodes
+
+
+def apply(opcodes, a, b):
+    """按操作区间由 a 还原 b，同时检查区间首尾相接、equal 区间内容相同"""
+    out, i, j = [], 0, 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j)
+        assert tag in ("equal", "replace", "delete", "insert")
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+        out.append(b[j1:j2])
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    return "".join(out)
+
+
+def changed(opcodes):
+    return sum((i2 - i1) + (j2 - j1) for tag, i1, i2, j1, j2 in opcodes if tag != "equal")
+
+
+def difflib_opcodes(a, b):
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+
+
+CASES = [
+    ("", ""),
+    ("", "新增"),
+    ("删除", ""),
+    ("完全相同的文本", "完全相同的文本"),
+    ("今天我们聊一聊性能优化这个话题", "今天我们聊一聊性能优化这个话题。"),
+    ("大家好今天我们来聊一聊性能优化", "大家好，今天我们来聊一聊性能优化。"),
+    ("我门今天来讨论一下这个问题", "我们今天来讨论一下这个问题。"),
+]
+
+
+@pytest.mark.parametrize("a, b", CASES)
+def test_matches_difflib(a, b):
+    opcodes = diff_opcodes(a, b)
+    assert apply(opcodes, a, b) == b
+    assert opcodes == difflib_opcodes(a, b)
+    assert changed_ratio(opcodes, a, b) == pytest.approx(1 - difflib.SequenceMatcher(None, a, b).ratio())
+
+
+def test_shortest_edit_script():
+    """difflib 按最长连续匹配切分，不保证改动最少；Myers 给出最短编辑路径（论文中的例子，D = 5）"""
+    opcodes = diff_opcodes("abcabba", "cbabac")
+    assert apply(opcodes, "abcabba", "cbabac") == "cbabac"
+    assert changed(opcodes) == 5
+    assert changed(difflib_opcodes("abcabba", "cbabac")) > 5
+
+
+def test_proofread_edits_same_as_difflib():
+    """校对常见的改动（加标点、改个别字）与 difflib 的结果相同"""
+    original = "大家好欢迎收听本期节目今天我们请到了一位嘉宾来聊一聊他在性能优化方面的经验" * 5
+    proofread = original.replace("大家好", "大家好，").replace("节目", "节目。").replace("他在", "她在")
+    assert diff_opcodes(original, proofread) == difflib_opcodes(original, proofread)
+
+
+def test_random_edits_are_minimal():
+    """随机改动：结果可还原，且改动的字数不多于 difflib（Myers 给出最短编辑路径）"""
+    rng = random.Random(0)
+    for _ in range(300):
+        a = "".join(rng.choice("甲乙丙丁，。") for _ in range(rng.randint(0, 40)))
+        b = list(a)
+        for _ in range(rng.randint(0, 8)):
+            position = rng.randint(0, len(b))
+            action = rng.random()
+            if action < 0.4:
+                b.insert(position, rng.choice("甲乙丙丁，。"))
+            elif b and action < 0.7:
+                del b[min(position, len(b) - 1)]
+            elif b:
+                b[min(position, len(b) - 1)] = rng.choice("甲乙丙丁，。")
+        b = "".join(b)
+        opcodes = diff_opcodes(a, b)
+        assert apply(opcodes, a, b) == b
+        assert changed(opcodes) <= changed(difflib_opcodes(a, b))
+
+
+def test_falls_back_to_difflib_for_large_rewrites():
+    a = "一二三四五六七八九十" * 10
+    b = "十九八七六五四三二一" * 10
+    assert diff_opcodes(a, b, max_edits=5) == difflib_opcodes(a, b)
+
+
+def test_diff_cache_recomputes_on_change():
+    cache = DiffCache()
+    first = cache.get(0, "原文", "原文。")
+    assert cache.get(0, "原文", "原文。")[0] is first[0]
+    opcodes, ratio = cache.get(0, "原文", "原文！")
+    assert opcodes is not first[0]
+    assert apply(opcodes, "原文", "原文！") == "原文！"
@@ -0,0 +1,153 @@
+"""
+校对前后正文的字符级差异
+
+供 GUI 段落编辑页的「显示修改」使用，核对校对改动了哪些字。校对通常只改少量字符，
+这里用 Myers 差分算法，耗时 O((N+M)·D)，D 为改动的字符数：先去掉相同的前缀和后缀，
+再按编辑距离从小到大搜索最短编辑路径，改动不多时 500 字的段落在一毫秒左右比较完。
+改动超过 MAX_EDITS 个字符（如整段重写）时改用 difflib，避免搜索时间按 D 增长。
+结果与 difflib.SequenceMatcher.get_opcodes() 的格式相同。
+"""
+import difflib
+from typing import Dict, List, Optional, Tuple
+
+MAX_EDITS = 200  # Myers 搜索的最大编辑距离
+
+Opcode = Tuple[str, int, int, int, int]
+
+
+def _edit_path(a: str, b: str, max_edits: int) -> Optional[List[Tuple[str, int, int]]]:
+    """
+    最短编辑路径，按顺序返回 ("equal"/"delete"/"insert", a 中位置, b 中位置) 的单字符操作；
+    编辑距离超过 max_edits 时返回 None
+    """
+    n, m = len(a), len(b)
+    limit = min(max_edits, n + m)
+    offset = limit + 1
+    v = [0] * (2 * limit + 3)  # v[offset + k]: 对角线 k 上走得最远的 x
+    trace = []  # 每一步结束时对角线 -d..d 上的 x
+    for d in range(limit + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                trace.append(v[offset - d:offset + d + 1])
+                return _backtrack(trace, n, m)
+        trace.append(v[offset - d:offset + d + 1])
+    return None
+
+
+def _backtrack(trace: List[List[int]], n: int, m: int) -> List[Tuple[str, int, int]]:
+    """从终点沿 trace 倒推编辑路径"""
+    ops = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        previous = trace[d - 1]
+        k = x - y
+        if k == -d or (k != d and previous[k - 1 + d - 1] < previous[k + 1 + d - 1]):
+            previous_k = k + 1  # 从上方下移：插入 b 中的一个字
+        else:
+            previous_k = k - 1  # 从左侧右移：删除 a 中的一个字
+        previous_x = previous[previous_k + d - 1]
+        previous_y = previous_x - previous_k
+        # 编辑之后沿对角线走到 (x, y) 的部分是相同的字
+        mid_x = previous_x if previous_k == k + 1 else previous_x + 1
+        while x > mid_x:
+            x -= 1
+            y -= 1
+            ops.append(("equal", x, y))
+        if previous_k == k + 1:
+            ops.append(("insert", previous_x, previous_y))
+        else:
+            ops.append(("delete", previous_x, previous_y))
+        x, y = previous_x, previous_y
+    while x > 0:
+        x -= 1
+        y -= 1
+        ops.append(("equal", x, y))
+    ops.reverse()
+    return ops
+
+
+def _opcodes(ops: List[Tuple[str, int, int]], n: int, m: int, base: int) -> List[Opcode]:
+    """单字符操作合并为区间，相邻的删除和插入合并为 replace；base 为去掉的公共前缀长度"""
+    opcodes = []
+    i = j = 0  # 上一个相同字之后的位置，其后到下一个相同字之间都是改动
+    for tag, x, y in ops + [("end", n, m)]:
+        if tag not in ("equal", "end"):
+            continue
+        if (i, j) != (x, y):
+            changed = "replace" if x > i and y > j else "delete" if x > i else "insert"
+            opcodes.append((changed, base + i, base + x, base + j, base + y))
+        if tag == "equal":
+            if opcodes and opcodes[-1][0] == "equal":
+                opcodes[-1] = ("equal", opcodes[-1][1], base + x + 1, opcodes[-1][3], base + y + 1)
+            else:
+                opcodes.append(("equal", base + x, base + x + 1, base + y, base + y + 1))
+            i, j = x + 1, y + 1
+    return opcodes
+
+
+def diff_opcodes(a: str, b: str, max_edits: int = MAX_EDITS) -> List[Opcode]:
+    """a 变为 b 的操作区间 (tag, i1, i2, j1, j2)，tag 为 equal/replace/delete/insert"""
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    middle_a = a[prefix:len(a) - suffix]
+    middle_b = b[prefix:len(b) - suffix]
+    ops = _edit_path(middle_a, middle_b, max_edits)
+    if ops is None:
+        middle = [(tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix) for tag, i1, i2, j1, j2 in
+                  difflib.SequenceMatcher(None, middle_a, middle_b, autojunk=False).get_opcodes()]
+    else:
+        middle = _opcodes(ops, len(middle_a), len(middle_b), prefix)
+    opcodes = []
+    if prefix:
+        opcodes.append(("equal", 0, prefix, 0, prefix))
+    opcodes.extend(middle)
+    if suffix:
+        opcodes.append(("equal", len(a) - suffix, len(a), len(b) - suffix, len(b)))
+    # 前缀、中间、后缀相接处的 equal 合并
+    merged = []
+    for opcode in opcodes:
+        if merged and opcode[0] == "equal" and merged[-1][0] == "equal":
+            merged[-1] = ("equal", merged[-1][1], opcode[2], merged[-1][3], opcode[4])
+        else:
+            merged.append(opcode)
+    return merged
+
+
+def changed_ratio(opcodes: List[Opcode], a: str, b: str) -> float:
+    """改动比例：删除和插入的字数占两段总字数的比例，与 1 - difflib 的 ratio() 相同"""
+    total = len(a) + len(b)
+    if not total:
+        return 0.0
+    changed = sum((i2 - i1) + (j2 - j1) for tag, i1, i2, j1, j2 in opcodes if tag != "equal")
+    return changed / total
+
+
+class DiffCache:
+    """按段落序号缓存差异和改动比例，原文或正文变化（如用户编辑）后才重新计算"""
+    def __init__(self):
+        self._entries: Dict[int, tuple] = {}
+
+    def get(self, index: int, original: str, text: str) -> Tuple[List[Opcode], float]:
+        entry = self._entries.get(index)
+        if entry is None or entry[0] != original or entry[1] != text:
+            opcodes = diff_opcodes(original, text)
+            entry = (original, text, opcodes, changed_ratio(opcodes, original, text))
+            self._entries[index] = entry
+        return entry[2], entry[3]
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,145 @@
+"""
+运行时间线（Chrome Trace Event 格式）
+
+供 main.py --trace 和 GUI「时间线」开关使用，生成的 JSON 可在 chrome://tracing 或 ui.perfetto.dev 中打开：
+- 每个线程一条轨道：处理线程、并发请求的工作线程、GUI 的界面线程
+- 读取、解析、合并字幕，每段的标题和校对，每次请求（含校验重试）、调度器等待（含 429 退避）都是一个区间
+- GUI 事件从 send_event 放入队列到 handle_event 开始处理的等待时间记为异步区间，
+  并用流箭头从发送的线程连到界面线程，便于发现界面线程跟不上的情况
+未开启时 span() 返回空的上下文管理器，不记录任何内容。
+"""
+import contextlib
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from typing import List
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Tracer:
+    """时间线记录器，线程安全；同一进程共用一个，start() 后开始记录"""
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._events: List[dict] = []
+        self._local = threading.local()
+        self._run = 0  # 每次 start() 加一，轨道名称在每次记录中重新写出
+        self._ids = itertools.count(1)
+        self._origin = 0.0
+        self._pid = os.getpid()
+        self.event_waits: List[float] = []  # 界面事件的排队秒数
+
+    def start(self):
+        with self._lock:
+            self._events = []
+            self._run += 1
+            self.event_waits = []
+            self._origin = time.perf_counter()
+            self.enabled = True
+
+    def _us(self, t: float) -> float:
+        return round((t - self._origin) * 1e6, 1)
+
+    def _add(self, event: dict):
+        """
+        在当前线程的轨道上记录一个事件；第一次出现的线程同时记录线程名，作为轨道名称
+        轨道编号按线程对象分配，不使用线程 ID：线程结束后 ID 可能被新线程复用
+        """
+        track = getattr(self._local, "track", None)
+        with self._lock:
+            if track is None or track[0] != self._run:
+                track = (self._run, next(self._ids))
+                self._local.track = track
+                self._events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": track[1],
+                                     "args": {"name": threading.current_thread().name}})
+            event["pid"] = self._pid
+            event["tid"] = track[1]
+            self._events.append(event)
+
+    def complete(self, name: str, start: float, end: float, cat: str = "", args: dict = None):
+        """记录一个已结束的区间，start/end 为 perf_counter 时间"""
+        if not self.enabled:
+            return
+        event = {"name": name, "cat": cat, "ph": "X", "ts": self._us(start), "dur": round((end - start) * 1e6, 1)}
+        if args:
+            event["args"] = args
+        self._add(event)
+
+    @contextlib.contextmanager
+    def _span(self, name: str, cat: str, args: dict):
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.complete(name, start, time.perf_counter(), cat, args)
+
+    def span(self, name: str, cat: str = "", **args):
+        """with tracer.span(...) as args: 记录代码块的区间，块内可以向 args 补充结果"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, cat, args)
+
+    def instant(self, name: str, cat: str = "", **args):
+        """记录一个时刻，如一次 429"""
+        if not self.enabled:
+            return
+        event = {"name": name, "cat": cat, "ph": "i", "s": "t", "ts": self._us(time.perf_counter())}
+        if args:
+            event["args"] = args
+        self._add(event)
+
+    def mark_sent(self) -> tuple:
+        """事件放入队列时调用，返回 (发送时间, 流编号)，并在发送线程上记录流箭头的起点"""
+        sent_at = time.perf_counter()
+        flow_id = next(self._ids)
+        self._add({"name": "event", "cat": "event_queue", "ph": "s", "id": flow_id, "ts": self._us(sent_at)})
+        return sent_at, flow_id
+
+    def mark_handled(self, name: str, mark: tuple, started: float, finished: float):
+        """界面线程处理完事件后调用：记录排队等待（异步区间）、处理耗时和流箭头的终点"""
+        if not self.enabled:
+            return
+        sent_at, flow_id = mark
+        with self._lock:
+            self.event_waits.append(started - sent_at)
+        for phase, t in (("b", sent_at), ("e", started)):
+            self._add({"name": f"排队 {name}", "cat": "event_queue", "ph": phase, "id": flow_id,
+                       "ts": self._us(t), "args": {"wait_ms": round((started - sent_at) * 1000, 3)}})
+        self.complete(f"handle_event {name}", started, finished, "event_queue")
+        self._add({"name": "event", "cat": "event_queue", "ph": "f", "bp": "e", "id": flow_id,
+                   "ts": self._us(started)})
+
+    def stop(self, path: str) -> str:
+        """停止记录并写出 JSON，返回路径"""
+        with self._lock:
+            self.enabled = False
+            events = self._events
+            self._events = []
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return path
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """本进程共用的时间线记录器"""
+    return _tracer
+
+
+def traced(name: str, cat: str = "srt"):
+    """装饰器：开启时间线时把函数的每次调用记为一个区间"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _tracer.enabled:
+                return func(*args, **kwargs)
+            with _tracer.span(name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
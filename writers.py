@@ -0,0 +1,180 @@
+"""
+Shownotes 输出写入器
+
+每个写入器在段落完成时立即写入文件，不在内存中拼接整篇文档。
+支持的格式：txt、Markdown、JSON、YouTube 章节、WebVTT 章节。
+"""
+import json
+import os
+from typing import Dict, List
+
+
+def ms_to_timestamp(ms: int, sep: str = ':', with_ms: bool = False) -> str:
+    """毫秒转为 hh:MM:ss（with_ms 时为 hh:MM:ss.mmm）"""
+    ms = max(0, int(ms))
+    h, rest = divmod(ms, 3600000)
+    m, rest = divmod(rest, 60000)
+    s, millis = divmod(rest, 1000)
+    text = f"{h:02d}{sep}{m:02d}{sep}{s:02d}"
+    if with_ms:
+        text += f".{millis:03d}"
+    return text
+
+
+class OutputWriter:
+    """
+    写入器基类
+    segment 需提供 time、text、start_ms、end_ms 属性（见 main.MergedSegment）
+    """
+    extension = ".txt"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.file = open(path, 'w', encoding='utf-8')
+        self.write_header()
+
+    def write_header(self):
+        pass
+
+    def write_footer(self):
+        pass
+
+    def write_segment(self, segment, title: str):
+        self.format_segment(segment, title)
+        self.count += 1
+        self.file.flush()
+
+    def format_segment(self, segment, title: str):
+        raise NotImplementedError
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.write_footer()
+        self.file.close()
+
+
+class TxtWriter(OutputWriter):
+    """hh:MM:ss 标题\\n正文，段落之间空一行"""
+    extension = ".txt"
+
+    def format_segment(self, segment, title):
+        if self.count:
+            self.file.write("\n\n")
+        self.file.write(f"{segment.time} {title}\n{segment.text}")
+
+
+class MarkdownWriter(OutputWriter):
+    """每段一个二级标题"""
+    extension = ".md"
+
+    def format_segment(self, segment, title):
+        self.file.write(f"## {segment.time} {title}\n\n{segment.text}\n\n")
+
+
+class JsonWriter(OutputWriter):
+    """JSON 数组，每段包含起止毫秒、标题和正文"""
+    extension = ".json"
+
+    def write_header(self):
+        self.file.write("[")
+
+    def format_segment(self, segment, title):
+        item = {
+            "index": self.count,
+            "time": segment.time,
+            "start_ms": segment.start_ms,
+            "end_ms": segment.end_ms,
+            "title": title,
+            "text": segment.text,
+        }
+        self.file.write(",\n  " if self.count else "\n  ")
+        self.file.write(json.dumps(item, ensure_ascii=False))
+
+    def write_footer(self):
+        self.file.write("\n]\n" if self.count else "]\n")
+
+
+class YouTubeChaptersWriter(OutputWriter):
+    """YouTube 章节列表，第一章必须从 0:00 开始"""
+    extension = ".youtube.txt"
+
+    def format_segment(self, segment, title):
+        start_ms = 0 if self.count == 0 else segment.start_ms
+        h, rest = divmod(int(start_ms) // 1000, 3600)
+        m, s = divmod(rest, 60)
+        stamp = f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+        self.file.write(f"{stamp} {title}\n")
+
+
+class WebVTTChaptersWriter(OutputWriter):
+    """WebVTT 章节轨道"""
+    extension = ".vtt"
+
+    def write_header(self):
+        self.file.write("WEBVTT\n\n")
+
+    def format_segment(self, segment, title):
+        start = ms_to_timestamp(segment.start_ms, with_ms=True)
+        end = ms_to_timestamp(max(segment.end_ms, segment.start_ms), with_ms=True)
+        self.file.write(f"{self.count + 1}\n{start} --> {end}\n{title}\n\n")
+
+
+WRITERS: Dict[str, type] = {
+    "txt": TxtWriter,
+    "md": MarkdownWriter,
+    "json": JsonWriter,
+    "youtube": YouTubeChaptersWriter,
+    "vtt": WebVTTChaptersWriter,
+}
+
+DEFAULT_FORMATS = ["txt"]
+
+
+def parse_formats(value: str) -> List[str]:
+    """解析逗号分隔的格式列表，如 "txt,md,json"，重复的格式只保留一次"""
+    formats = list(dict.fromkeys(f.strip().lower() for f in value.split(',') if f.strip()))
+    unknown = [f for f in formats if f not in WRITERS]
+    if unknown:
+        raise ValueError(f"不支持的输出格式: {', '.join(unknown)}（可选: {', '.join(WRITERS)}）")
+    return formats or list(DEFAULT_FORMATS)
+
+
+class MultiWriter:
+    """把每个段落同时写入多个格式"""
+
+    def __init__(self, writers: List[OutputWriter]):
+        self.writers = writers
+
+    @property
+    def paths(self) -> List[str]:
+        return [w.path for w in self.writers]
+
+    def write_segment(self, segment, title: str):
+        for writer in self.writers:
+            writer.write_segment(segment, title)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_writers(formats: List[str], output_dir: str, basename: str) -> MultiWriter:
+    """按格式列表打开写入器，文件名为 basename + 各格式扩展名"""
+    writers = []
+    try:
+        for fmt in formats:
+            cls = WRITERS[fmt]
+            writers.append(cls(os.path.join(output_dir, basename + cls.extension)))
+    except Exception:
+        for writer in writers:
+            writer.close()
+        raise
+    return MultiWriter(writers)